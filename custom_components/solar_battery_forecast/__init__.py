@@ -65,7 +65,7 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     )
 
     if unloaded:
-        hass.data[DOMAIN][entry.entry_id]["controller"].unload()
+        await hass.data[DOMAIN][entry.entry_id]["controller"].unload()
         hass.data[DOMAIN].pop(entry.entry_id)
 
     return unloaded
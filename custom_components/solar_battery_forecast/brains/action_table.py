@@ -0,0 +1,79 @@
+from array import array
+from typing import TYPE_CHECKING
+from typing import Sequence
+from typing import TypeAlias
+
+from .simulation import INITIAL_ACTION
+from .simulation import Action
+from .simulation import ActionType
+
+# Value in a plan which means "carry on with the previous action"
+CONTINUE_ACTION = -1
+
+# Every soc that an action can have is a multiple of this
+ACTION_SOC_STEP_PERCENT = 10
+_NUM_SOCS = 100 // ACTION_SOC_STEP_PERCENT + 1
+
+# array is only subscriptable at runtime from Python 3.12, but Plan needs to be a real type, so that e.g. Plan | None
+# can be evaluated in annotations
+if TYPE_CHECKING:
+    Plan: TypeAlias = array[int]
+else:
+    Plan: TypeAlias = array
+"""A plan as one index into ACTIONS per slot, or CONTINUE_ACTION"""
+
+ACTIONS: tuple[Action, ...] = tuple(
+    Action(action_type, min_soc=min_soc_percent / 100, max_soc=max_soc_percent / 100)
+    for action_type in ActionType
+    for min_soc_percent in range(0, 101, ACTION_SOC_STEP_PERCENT)
+    for max_soc_percent in range(0, 101, ACTION_SOC_STEP_PERCENT)
+)
+"""
+Every action which can appear in a plan, enumerated once, so that plans can refer to them by index. These are shared,
+so mustn't be mutated.
+"""
+
+
+def action_index(action_type: ActionType, min_soc_percent: int, max_soc_percent: int) -> int:
+    """The index into ACTIONS of the given action"""
+    for percent in (min_soc_percent, max_soc_percent):
+        if percent % ACTION_SOC_STEP_PERCENT != 0 or not 0 <= percent <= 100:
+            raise ValueError(f"SoC {percent}% is not a multiple of {ACTION_SOC_STEP_PERCENT}% between 0 and 100%")
+    return (
+        action_type.value * _NUM_SOCS + min_soc_percent // ACTION_SOC_STEP_PERCENT
+    ) * _NUM_SOCS + max_soc_percent // ACTION_SOC_STEP_PERCENT
+
+
+def index_of(action: Action) -> int:
+    """The index into ACTIONS of an action which is equal to the given one"""
+    index = action_index(action.action_type, round(action.min_soc * 100), round(action.max_soc * 100))
+    # The socs have to round-trip exactly, otherwise we won't give the same results as simulating the action itself
+    if ACTIONS[index] != action:
+        raise ValueError(f"{action} is not in the action table")
+    return index
+
+
+def with_min_soc(index: int, min_soc_percent: int) -> int:
+    action = ACTIONS[index]
+    return action_index(action.action_type, min_soc_percent, round(action.max_soc * 100))
+
+
+def with_max_soc(index: int, max_soc_percent: int) -> int:
+    action = ACTIONS[index]
+    return action_index(action.action_type, round(action.min_soc * 100), max_soc_percent)
+
+
+INITIAL_ACTION_INDEX = index_of(INITIAL_ACTION)
+
+
+def new_plan(num_slots: int) -> Plan:
+    """A plan which carries on with the initial action throughout"""
+    return array("h", [CONTINUE_ACTION]) * num_slots
+
+
+def plan_from_actions(actions: Sequence[Action | None]) -> Plan:
+    return array("h", (CONTINUE_ACTION if x is None else index_of(x) for x in actions))
+
+
+def plan_to_actions(plan: Sequence[int]) -> list[Action | None]:
+    return [None if x == CONTINUE_ACTION else ACTIONS[x] for x in plan]
@@ -0,0 +1,363 @@
+from dataclasses import dataclass
+from typing import Sequence
+
+import numpy as np
+import numpy.typing as npt
+
+from .action_table import CONTINUE_ACTION
+from .simulation import AC_TO_DC_EFFICIENCY
+from .simulation import BATTERY_CAPACITY
+from .simulation import DC_TO_AC_EFFICIENCY
+from .simulation import DISCHARGE_DISINCENTIVE
+from .simulation import INITIAL_ACTION
+from .simulation import INVERTER_POWER_PER_SEGMENT
+from .simulation import Action
+from .simulation import ActionType
+from .simulation import RunOutput
+from .simulation import RunOutputSegment
+from .simulation import TimeSegment
+from .simulation import plan_score
+
+FloatArray = npt.NDArray[np.float64]
+IntArray = npt.NDArray[np.int16]
+
+
+@dataclass
+class PlanBatch:
+    """N plans of S slots each, as integer-coded (N, S) arrays"""
+
+    action_types: IntArray
+    """ActionType.value for each slot, or CONTINUE_ACTION to carry on with the previous action"""
+
+    min_soc_percents: IntArray
+    max_soc_percents: IntArray
+
+    @property
+    def num_plans(self) -> int:
+        return int(self.action_types.shape[0])
+
+    @staticmethod
+    def from_actions(plans: Sequence[Sequence[Action | None]]) -> "PlanBatch":
+        num_slots = len(plans[0]) if len(plans) > 0 else 0
+        action_types = np.full((len(plans), num_slots), CONTINUE_ACTION, dtype=np.int16)
+        min_soc_percents = np.zeros((len(plans), num_slots), dtype=np.int16)
+        max_soc_percents = np.zeros((len(plans), num_slots), dtype=np.int16)
+        for i, plan in enumerate(plans):
+            if len(plan) != num_slots:
+                raise ValueError(f"Plan {i} has {len(plan)} slots, expected {num_slots}")
+            for slot, action in enumerate(plan):
+                if action is not None:
+                    action_types[i, slot] = action.action_type.value
+                    min_soc_percents[i, slot] = _to_percent(action.min_soc)
+                    max_soc_percents[i, slot] = _to_percent(action.max_soc)
+        return PlanBatch(action_types, min_soc_percents, max_soc_percents)
+
+
+@dataclass
+class SegmentBatch:
+    """The fields of N TimeSegments, as arrays, so that each row of a batch can be in a different segment"""
+
+    generation: FloatArray
+    consumption: FloatArray
+    feed_in_tariff: FloatArray
+    import_tariff: FloatArray
+
+    @staticmethod
+    def from_segments(segments: Sequence[TimeSegment]) -> "SegmentBatch":
+        return SegmentBatch(
+            np.array([x.generation for x in segments], dtype=np.float64),
+            np.array([x.consumption for x in segments], dtype=np.float64),
+            np.array([x.feed_in_tariff for x in segments], dtype=np.float64),
+            np.array([x.import_tariff for x in segments], dtype=np.float64),
+        )
+
+    def take(self, indices: npt.NDArray[np.int64]) -> "SegmentBatch":
+        return SegmentBatch(
+            self.generation[indices],
+            self.consumption[indices],
+            self.feed_in_tariff[indices],
+            self.import_tariff[indices],
+        )
+
+
+def _to_percent(soc: float) -> int:
+    percent = round(soc * 100)
+    # The socs are turned back into floats by dividing by 100, which has to give exactly the same float as the Action
+    # had, otherwise we won't give the same results as BatteryModel.run
+    if percent / 100 != soc:
+        raise ValueError(f"SoC {soc} is not a whole percentage")
+    return percent
+
+
+def _clamp(val: FloatArray, lower: float, upper: float | FloatArray) -> FloatArray:
+    # Written to behave identically to the clamp used by simulate_segment, including for nan
+    return np.where(val < lower, lower, np.where(val > upper, upper, val))
+
+
+def simulate_segment_batch(
+    segment: TimeSegment,
+    action_types: IntArray,
+    min_socs: FloatArray,
+    max_socs: FloatArray,
+    battery_levels: FloatArray,
+) -> tuple[FloatArray, FloatArray]:
+    """
+    Vectorized version of simulate_segment, over many (action, battery level) pairs.
+
+    The operations are carried out in the same order as in simulate_segment, so that the results are bit-for-bit
+    identical. Returns (battery_discharge, inverter_output_ac).
+    """
+
+    # Anything which depends only on the segment is calculated once, in plain Python, as simulate_segment does
+
+    # SELF_USE
+    if segment.generation > segment.consumption / DC_TO_AC_EFFICIENCY:
+        excess_solar_dc = segment.generation - segment.consumption / DC_TO_AC_EFFICIENCY
+        self_use_discharge = -_clamp(BATTERY_CAPACITY * max_socs - battery_levels, 0, excess_solar_dc)
+        self_use_output_ac = segment.consumption + (excess_solar_dc + self_use_discharge) * DC_TO_AC_EFFICIENCY
+    else:
+        required_energy_dc = segment.consumption / DC_TO_AC_EFFICIENCY - segment.generation
+        self_use_discharge = _clamp(battery_levels - BATTERY_CAPACITY * min_socs, 0, required_energy_dc)
+        self_use_output_ac = (segment.generation + self_use_discharge) * DC_TO_AC_EFFICIENCY
+
+    # CHARGE
+    solar_to_battery = _clamp(BATTERY_CAPACITY * max_socs - battery_levels, 0, segment.generation)
+    solar_covers_charge = solar_to_battery == segment.generation
+    inverter_to_battery_dc = np.where(
+        solar_covers_charge,
+        _clamp(
+            BATTERY_CAPACITY * max_socs - battery_levels - solar_to_battery,
+            0,
+            INVERTER_POWER_PER_SEGMENT / AC_TO_DC_EFFICIENCY,
+        ),
+        0.0,
+    )
+    charge_output_ac = np.where(
+        solar_covers_charge,
+        -inverter_to_battery_dc * AC_TO_DC_EFFICIENCY,
+        (segment.generation - solar_to_battery) * DC_TO_AC_EFFICIENCY,
+    )
+    charge_discharge = -(solar_to_battery + inverter_to_battery_dc)
+
+    # DISCHARGE
+    inverter_max_export_dc = INVERTER_POWER_PER_SEGMENT / DC_TO_AC_EFFICIENCY
+    solar_to_inverter_export = min(segment.generation, inverter_max_export_dc)
+    if inverter_max_export_dc > solar_to_inverter_export:
+        discharge_discharge = _clamp(
+            battery_levels - BATTERY_CAPACITY * min_socs,
+            0,
+            inverter_max_export_dc - solar_to_inverter_export,
+        )
+    else:
+        discharge_discharge = -_clamp(
+            BATTERY_CAPACITY * max_socs - battery_levels,
+            0,
+            solar_to_inverter_export - inverter_max_export_dc,
+        )
+    discharge_output_ac = (
+        solar_to_inverter_export + np.where(discharge_discharge > 0, discharge_discharge, 0)
+    ) * DC_TO_AC_EFFICIENCY
+
+    is_charge = action_types == ActionType.CHARGE.value
+    is_discharge = action_types == ActionType.DISCHARGE.value
+    battery_discharge = np.where(
+        is_charge, charge_discharge, np.where(is_discharge, discharge_discharge, self_use_discharge)
+    )
+    inverter_output_ac = np.where(
+        is_charge, charge_output_ac, np.where(is_discharge, discharge_output_ac, self_use_output_ac)
+    )
+    return battery_discharge, inverter_output_ac
+
+
+def simulate_segments_batch(
+    segments: SegmentBatch,
+    action_types: IntArray,
+    min_socs: FloatArray,
+    max_socs: FloatArray,
+    battery_levels: FloatArray,
+) -> tuple[FloatArray, FloatArray]:
+    """
+    As simulate_segment_batch, but each (action, battery level) pair is in its own segment. The choices which
+    simulate_segment makes based on the segment alone are made for each pair.
+    """
+
+    generation = segments.generation
+    consumption = segments.consumption
+
+    # SELF_USE
+    solar_covers_consumption = generation > consumption / DC_TO_AC_EFFICIENCY
+    excess_solar_dc = generation - consumption / DC_TO_AC_EFFICIENCY
+    self_use_charge = -_clamp(BATTERY_CAPACITY * max_socs - battery_levels, 0, excess_solar_dc)
+    required_energy_dc = consumption / DC_TO_AC_EFFICIENCY - generation
+    self_use_shortfall = _clamp(battery_levels - BATTERY_CAPACITY * min_socs, 0, required_energy_dc)
+    self_use_discharge = np.where(solar_covers_consumption, self_use_charge, self_use_shortfall)
+    self_use_output_ac = np.where(
+        solar_covers_consumption,
+        consumption + (excess_solar_dc + self_use_charge) * DC_TO_AC_EFFICIENCY,
+        (generation + self_use_shortfall) * DC_TO_AC_EFFICIENCY,
+    )
+
+    # CHARGE
+    solar_to_battery = _clamp(BATTERY_CAPACITY * max_socs - battery_levels, 0, generation)
+    solar_covers_charge = solar_to_battery == generation
+    inverter_to_battery_dc = np.where(
+        solar_covers_charge,
+        _clamp(
+            BATTERY_CAPACITY * max_socs - battery_levels - solar_to_battery,
+            0,
+            INVERTER_POWER_PER_SEGMENT / AC_TO_DC_EFFICIENCY,
+        ),
+        0.0,
+    )
+    charge_output_ac = np.where(
+        solar_covers_charge,
+        -inverter_to_battery_dc * AC_TO_DC_EFFICIENCY,
+        (generation - solar_to_battery) * DC_TO_AC_EFFICIENCY,
+    )
+    charge_discharge = -(solar_to_battery + inverter_to_battery_dc)
+
+    # DISCHARGE
+    inverter_max_export_dc = INVERTER_POWER_PER_SEGMENT / DC_TO_AC_EFFICIENCY
+    solar_to_inverter_export = np.minimum(generation, inverter_max_export_dc)
+    discharge_discharge = np.where(
+        inverter_max_export_dc > solar_to_inverter_export,
+        _clamp(battery_levels - BATTERY_CAPACITY * min_socs, 0, inverter_max_export_dc - solar_to_inverter_export),
+        -_clamp(BATTERY_CAPACITY * max_socs - battery_levels, 0, solar_to_inverter_export - inverter_max_export_dc),
+    )
+    discharge_output_ac = (
+        solar_to_inverter_export + np.where(discharge_discharge > 0, discharge_discharge, 0)
+    ) * DC_TO_AC_EFFICIENCY
+
+    is_charge = action_types == ActionType.CHARGE.value
+    is_discharge = action_types == ActionType.DISCHARGE.value
+    battery_discharge = np.where(
+        is_charge, charge_discharge, np.where(is_discharge, discharge_discharge, self_use_discharge)
+    )
+    inverter_output_ac = np.where(
+        is_charge, charge_output_ac, np.where(is_discharge, discharge_output_ac, self_use_output_ac)
+    )
+    return battery_discharge, inverter_output_ac
+
+
+def segment_costs_batch(
+    segment: TimeSegment | SegmentBatch, inverter_output_ac: FloatArray
+) -> tuple[FloatArray, FloatArray, FloatArray, FloatArray]:
+    """
+    Vectorized version of the end of simulate_segment, which turns the inverter output into grid flows and costs.
+    If given a SegmentBatch, each output is in its own segment.
+
+    Returns (feed_in_amount, import_amount, feed_in_cost, import_cost).
+    """
+    is_feed_in = inverter_output_ac > segment.consumption
+    feed_in_amount = np.where(is_feed_in, inverter_output_ac - segment.consumption, 0.0)
+    import_amount = np.where(is_feed_in, 0.0, segment.consumption - inverter_output_ac)
+
+    feed_in_cost = feed_in_amount * (segment.feed_in_tariff - DISCHARGE_DISINCENTIVE)
+    feed_in_cost = np.where(feed_in_cost > 0, feed_in_cost, 0.0)
+    import_cost = import_amount * segment.import_tariff
+    return feed_in_amount, import_amount, feed_in_cost, import_cost
+
+
+def _resolve_plans(plans: PlanBatch) -> tuple[IntArray, FloatArray, FloatArray]:
+    """Replace CONTINUE_ACTION with whichever action is in force in that slot"""
+
+    num_plans, num_slots = plans.action_types.shape
+    # For each slot, the index of the slot whose action is in force. -1 means INITIAL_ACTION
+    source_slots = np.where(plans.action_types != CONTINUE_ACTION, np.arange(num_slots), -1)
+    source_slots = np.maximum.accumulate(source_slots, axis=1)
+    rows = np.arange(num_plans)[:, np.newaxis]
+    has_action = source_slots >= 0
+    source_slots = np.maximum(source_slots, 0)
+
+    action_types = np.where(
+        has_action, plans.action_types[rows, source_slots], INITIAL_ACTION.action_type.value
+    ).astype(np.int16)
+    # Dividing by 100 gives the same floats as the percent / 100 used to create Actions
+    min_socs = np.where(has_action, plans.min_soc_percents[rows, source_slots] / 100, INITIAL_ACTION.min_soc)
+    max_socs = np.where(has_action, plans.max_soc_percents[rows, source_slots] / 100, INITIAL_ACTION.max_soc)
+    return action_types, min_socs, max_socs
+
+
+def simulate_batch(
+    segments: Sequence[TimeSegment],
+    initial_battery: float,
+    plans: PlanBatch,
+    outputs: list[RunOutput] | None = None,
+    terminal_value: float = 0.0,
+) -> FloatArray:
+    """
+    Equivalent to calling BatteryModel.run for each plan in the batch, and returns the same scores.
+
+    If outputs is given, a RunOutput is appended for each plan. terminal_value is as for plan_score.
+    """
+
+    num_plans, num_slots = plans.action_types.shape
+    if num_slots != len(segments):
+        raise ValueError(f"Plans have {num_slots} slots, but there are {len(segments)} segments")
+
+    action_types, min_socs, max_socs = _resolve_plans(plans)
+    battery_level: FloatArray = np.full(num_plans, initial_battery, dtype=np.float64)
+    feed_in_cost: FloatArray = np.zeros(num_plans)
+    import_cost: FloatArray = np.zeros(num_plans)
+
+    history: list[tuple[FloatArray, ...]] = []
+
+    for slot, segment in enumerate(segments):
+        battery_discharge, inverter_output_ac = simulate_segment_batch(
+            segment, action_types[:, slot], min_socs[:, slot], max_socs[:, slot], battery_level
+        )
+
+        battery_level = battery_level - battery_discharge
+        assert np.all(battery_level >= 0)
+
+        feed_in_amount, import_amount, this_feed_in_cost, this_import_cost = segment_costs_batch(
+            segment, inverter_output_ac
+        )
+        feed_in_cost = feed_in_cost + this_feed_in_cost
+        import_cost = import_cost + this_import_cost
+
+        if outputs is not None:
+            history.append(
+                (
+                    battery_level,
+                    feed_in_amount,
+                    import_amount,
+                    this_feed_in_cost,
+                    feed_in_cost,
+                    this_import_cost,
+                    import_cost,
+                )
+            )
+
+    if outputs is not None:
+        for i in range(num_plans):
+            outputs.append(RunOutput(segments=[_make_output_segment(*(x[i] for x in h)) for h in history]))
+
+    # Python's round() doesn't always agree with numpy's, so use the same rounding as BatteryModel.run
+    scores = [
+        plan_score(f, i, b, terminal_value)
+        for f, i, b in zip(feed_in_cost.tolist(), import_cost.tolist(), battery_level.tolist(), strict=True)
+    ]
+    return np.array(scores)
+
+
+def _make_output_segment(
+    battery_level: np.float64,
+    feed_in_amount: np.float64,
+    import_amount: np.float64,
+    this_feed_in_cost: np.float64,
+    feed_in_cost: np.float64,
+    this_import_cost: np.float64,
+    import_cost: np.float64,
+) -> RunOutputSegment:
+    return RunOutputSegment(
+        battery_level=round(float(battery_level), 2),
+        battery_soc=round((float(battery_level) / BATTERY_CAPACITY) * 100),
+        feed_in_kwh=round(float(feed_in_amount), 2),
+        import_kwh=round(float(import_amount), 2),
+        feed_in_cost=round(float(this_feed_in_cost), 2),
+        cumulative_feed_in_cost=round(float(feed_in_cost), 2),
+        import_cost=round(float(this_import_cost), 2),
+        cumulative_import_cost=round(float(import_cost), 2),
+        cumulative_score=round(float(feed_in_cost), 2) - round(float(import_cost), 2),
+    )
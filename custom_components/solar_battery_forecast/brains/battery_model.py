@@ -1,57 +1,57 @@
+import logging
 import random
-from dataclasses import dataclass
-from dataclasses import field
+import time
+from array import array
+from concurrent.futures import Executor
+from dataclasses import replace
 from enum import Enum
+from itertools import repeat
 from typing import Iterable
 from typing import Sequence
 
+import numpy as np
+import numpy.typing as npt
+
+from .action_table import ACTIONS
+from .action_table import CONTINUE_ACTION
+from .action_table import INITIAL_ACTION_INDEX
+from .action_table import Plan
+from .action_table import action_index
+from .action_table import new_plan
+from .action_table import plan_to_actions
+from .action_table import with_max_soc
+from .action_table import with_min_soc
+from .batch_simulator import PlanBatch
+from .batch_simulator import simulate_batch
+from .change_points import Move
+from .change_points import apply_move
+from .change_points import change_point_moves
+from .dominance import dominated_action_types
+from .dp_optimizer import DEFAULT_GRID_STEP_PERCENT
+from .dp_optimizer import optimize_dp
+from .incremental_simulator import IncrementalSimulator
+from .milp_optimizer import optimize_milp
+from .optimizer_stats import OptimizerStats
+from .optimizer_stats import PhaseStats
+from .optimizer_stats import RestartStats
+from .score_cache import ScoreCache
+from .score_cache import plan_key
+from .segment_compression import group_equivalent_slots
+from .segment_compression import share_group_decisions
+from .simulation import BATTERY_CAPACITY
+from .simulation import DC_TO_AC_EFFICIENCY
+from .simulation import MIN_SOC_PERMITTED_PERCENT
+from .simulation import Action
+from .simulation import ActionType
+from .simulation import RunOutput
+from .simulation import RunOutputSegment
+from .simulation import SimulationCounters
+from .simulation import TimeSegment
+from .simulation import plan_score
+from .simulation import simulate_segment
+from .terminal_value import terminal_battery_value
+from .transition_table import TransitionTable
 
-class ActionType(Enum):
-    SELF_USE = 0
-    CHARGE = 1
-    DISCHARGE = 2
-
-
-@dataclass
-class Action:
-    action_type: ActionType
-    min_soc: float
-    max_soc: float
-
-    def clone(self) -> "Action":
-        return Action(self.action_type, self.min_soc, self.max_soc)
-
-    def make_hash(self) -> int:
-        return hash((self.action_type, self.min_soc, self.max_soc))
-
-    def __repr__(self) -> str:
-        return f"Action({self.action_type}, {self.min_soc}, {self.max_soc})"
-
-
-@dataclass
-class TimeSegment:
-    generation: float
-    consumption: float
-    feed_in_tariff: float
-    import_tariff: float
-
-
-DISCHARGE_DISINCENTIVE = 2
-
-SEGMENT_LENGTH_HOURS = 1
-BATTERY_CAPACITY = 4.2
-
-AC_TO_DC_EFFICIENCY = 0.95
-DC_TO_AC_EFFICIENCY = 0.95
-
-INVERTER_POWER_PER_SEGMENT = 3 * SEGMENT_LENGTH_HOURS
-
-# TODO: These are currently unused
-EXPORT_LIMIT_PER_SEGMENT = 9999
-EXPORT_LIMIT_PER_SEGMENT_DC = EXPORT_LIMIT_PER_SEGMENT / DC_TO_AC_EFFICIENCY
-
-# Lowest that we can choose to discharge the battery to
-MIN_SOC_PERMITTED_PERCENT = 20
 SOC_STEP_PERCENT = 20
 # Discharge seems to be much more sensitive to precise step control
 DISCHARGE_SOC_STEP_PERCENT = 10
@@ -63,38 +63,113 @@ OPTIMIZATION_SOC_STEP_PERCENT = 10
 # worse can still be selected
 MARGIN = 1.0
 
-INITIAL_ACTION = Action(ActionType.SELF_USE, min_soc=MIN_SOC_PERMITTED_PERCENT / 100, max_soc=1.0)
-
+_LOGGER = logging.getLogger(__name__)
 
-@dataclass
-class RunOutputSegment:
-    battery_level: float
-    battery_soc: float
-    feed_in_kwh: float
-    import_kwh: float
-    feed_in_cost: float
-    cumulative_feed_in_cost: float
-    import_cost: float
-    cumulative_import_cost: float
-    cumulative_score: float
+NUM_RESTARTS = 10
+# If we've been given a plan to start from (e.g. the previous hour's), it's probably close to the best, and we only need
+# a few random restarts in case things have changed a lot
+NUM_RESTARTS_WITH_SEED_PLAN = 3
+# At most this many random restarts are replaced by plans from a PlanLibrary. At least one random restart is kept, so
+# that the search still explores
+NUM_LIBRARY_PLANS = 2
 
 
-@dataclass
-class RunOutput:
-    segments: list[RunOutputSegment] = field(default_factory=list)
+class OptimizerEngine(Enum):
+    HILL_CLIMB = "hill_climb"
+    DYNAMIC_PROGRAMMING = "dynamic_programming"
+    MILP = "milp"
+    CHANGE_POINT = "change_point"
 
 
 class BatteryModel:
-    def __init__(self, initial_battery: float, debug: bool = False) -> None:
-        self.num_runs = 0
+    def __init__(
+        self,
+        initial_battery: float,
+        debug: bool = False,
+        engine: OptimizerEngine = OptimizerEngine.HILL_CLIMB,
+        grid_step_percent: float = DEFAULT_GRID_STEP_PERCENT,
+        executor: Executor | None = None,
+        seed: int | None = None,
+        time_budget: float | None = None,
+        run_budget: int | None = None,
+        trace_convergence: bool = False,
+        score_cache_size: int = 0,
+        coarse_block_slots: int | None = None,
+        compress_segments: bool = False,
+        prune_dominated: bool = True,
+        horizon_slots: int | None = None,
+    ) -> None:
+        self.counters = SimulationCounters()
         self._initial_battery = initial_battery
         self._debug = debug
-
-    def plot(self, segments: list[TimeSegment], actions: Sequence[Action | None]) -> None:
+        self._engine = engine
+        # Resolution of the battery level grid used by the dynamic programming engine, as a % of capacity
+        self._grid_step_percent = grid_step_percent
+        # If given, hill climb restarts are run on this. It needs to be able to pickle its arguments, e.g. a
+        # ProcessPoolExecutor
+        self._executor = executor
+        self._rng = random.Random(seed)
+        # If given, the search is cut short after this many seconds, or after scoring this many plans (excluding
+        # post-processing), and the best plan found so far is used
+        self._time_budget = time_budget
+        self._run_budget = run_budget
+        # If set, each hill climb restart records its score after every iteration in stats
+        self._trace_convergence = trace_convergence
+        # If given, each optimization remembers the scores of this many plans, so that it doesn't need to simulate them
+        # again. Only about 1 in 20 plans are repeats though, and with the incremental simulator that doesn't save as
+        # much as the lookups cost, so it's off by default
+        self._score_cache_size = score_cache_size
+        self.score_cache: ScoreCache | None = None
+        # If given, each random hill climb restart first climbs using blocks of this many slots, then refines that
+        self._coarse_block_slots = coarse_block_slots
+        # If set, the hill climb makes one decision for each run of slots with no generation and the same tariffs
+        self._compress_segments = compress_segments
+        # If set, the hill climb doesn't try actions which can't be any better than self-use in a slot
+        self._prune_dominated = prune_dominated
+        # If given, the segments are optimized this many slots at a time, without looking any further ahead: the battery
+        # level at the end of each chunk is valued instead (see terminal_battery_value)
+        self._horizon_slots = horizon_slots
+        # What each kWh left in the battery at the end of the plan is worth. Set while optimizing a shortened horizon
+        self.terminal_value = 0.0
+        # Describes the last optimization
+        self.stats = OptimizerStats()
+        self._stats_start_time = 0.0
+        self._stats_start_counters = SimulationCounters()
+        # The whole of the last optimized plan, not just the first 24h
+        self.best_plan: Plan = new_plan(0)
+
+    @property
+    def num_runs(self) -> int:
+        return self.counters.runs
+
+    @property
+    def converged(self) -> bool:
+        """Whether the last optimization ran to completion, rather than being cut short by the budget"""
+        return self.stats.converged
+
+    def _start_stats(self, engine: OptimizerEngine) -> None:
+        self.stats = OptimizerStats(engine=engine.value)
+        self._stats_start_time = time.perf_counter()
+        self._stats_start_counters = replace(self.counters)
+
+    def _finish_stats(self) -> None:
+        self.stats.wall_time = time.perf_counter() - self._stats_start_time
+        self.stats.runs = self.counters.runs - self._stats_start_counters.runs
+        self.stats.segments_simulated = self.counters.segments_simulated - self._stats_start_counters.segments_simulated
+        self.stats.cache_hits = self.counters.cache_hits - self._stats_start_counters.cache_hits
+        self.stats.cache_misses = self.counters.cache_misses - self._stats_start_counters.cache_misses
+        self.stats.pruned = self.counters.pruned - self._stats_start_counters.pruned
+
+    def _new_score_cache(self) -> ScoreCache | None:
+        # Scores are only valid for one set of segments, so each optimization needs a new cache
+        return ScoreCache(self._score_cache_size) if self._score_cache_size > 0 else None
+
+    def plot(self, segments: list[TimeSegment], plan: Sequence[int]) -> None:
         from matplotlib import pyplot as plt  # type: ignore
 
         output = RunOutput()
-        self.run(segments, actions, output)
+        self.run(segments, plan, output)
+        actions = plan_to_actions(plan)
 
         size = len(output.segments)
         print(
@@ -118,97 +193,33 @@ class BatteryModel:
     def run(
         self,
         segments: list[TimeSegment],
-        actions: Sequence[Action | None],
+        plan: Sequence[int],
         outputs: RunOutput | None = None,
     ) -> float:
-        def clamp(val: float, lower: float, upper: float) -> float:
-            if val < lower:
-                return lower
-            if val > upper:
-                return upper
-            return val
-
-        self.num_runs += 1
+        self.counters.runs += 1
+        key = b""
+        if outputs is None and self.score_cache is not None:
+            key = plan_key(plan)
+            score = self.score_cache.get(key)
+            if score is not None:
+                self.counters.cache_hits += 1
+                return score
+            self.counters.cache_misses += 1
+
+        self.counters.segments_simulated += len(segments)
         battery_level = self._initial_battery
         feed_in_cost = 0.0
         import_cost = 0.0
-        action = INITIAL_ACTION
-
-        for segment, action_change in zip(segments, actions, strict=True):
-            if action_change is not None:
-                action = action_change
-
-            battery_discharge = 0.0
-            inverter_output_ac = 0.0
-
-            if action.action_type == ActionType.SELF_USE:
-                # If generation can cover consumption, excess goes into battery. Else excess comes from battery if
-                # available
-                if segment.generation > segment.consumption / DC_TO_AC_EFFICIENCY:
-                    # Generation covers consumption: charge the battery and then export the rest
-                    excess_solar_dc = segment.generation - segment.consumption / DC_TO_AC_EFFICIENCY
-                    battery_discharge = -clamp(BATTERY_CAPACITY * action.max_soc - battery_level, 0, excess_solar_dc)
-                    # TODO: Export limit
-                    inverter_output_ac = (
-                        segment.consumption + (excess_solar_dc + battery_discharge) * DC_TO_AC_EFFICIENCY
-                    )
-                else:
-                    # Generation doesn't cover consumption: output all generation + some battery
-                    required_energy_dc = segment.consumption / DC_TO_AC_EFFICIENCY - segment.generation
-                    battery_discharge = clamp(battery_level - BATTERY_CAPACITY * action.min_soc, 0, required_energy_dc)
-                    inverter_output_ac = (segment.generation + battery_discharge) * DC_TO_AC_EFFICIENCY
-
-            elif action.action_type == ActionType.CHARGE:
-                # Solar goes to the battery if available
-                solar_to_battery = clamp(BATTERY_CAPACITY * action.max_soc - battery_level, 0, segment.generation)
-                if solar_to_battery == segment.generation:
-                    # Any remaining charge comes through the inverter
-                    inverter_to_battery_dc = clamp(
-                        BATTERY_CAPACITY * action.max_soc - battery_level - solar_to_battery,
-                        0,
-                        INVERTER_POWER_PER_SEGMENT / AC_TO_DC_EFFICIENCY,
-                    )
-                    inverter_output_ac = -inverter_to_battery_dc * AC_TO_DC_EFFICIENCY
-                else:
-                    # Any excess solar is output from the inverter
-                    inverter_to_battery_dc = 0
-                    inverter_output_ac = (segment.generation - solar_to_battery) * DC_TO_AC_EFFICIENCY
-                battery_discharge = -(solar_to_battery + inverter_to_battery_dc)
-
-            elif action.action_type == ActionType.DISCHARGE:
-                # The inverter exports at the set rate, using as much solar as possible, and the rest from battery.
-                # Load is taken from the exported energy, with the rest going to the grid
-                # TODO: Max export rate
-                inverter_max_export_dc = INVERTER_POWER_PER_SEGMENT / DC_TO_AC_EFFICIENCY
-                solar_to_inverter_export = min(segment.generation, inverter_max_export_dc)
-                # The battery dischages to make up the gap if possible. Any excess generation goes into the battery
-                if inverter_max_export_dc > solar_to_inverter_export:
-                    battery_discharge = clamp(
-                        battery_level - BATTERY_CAPACITY * action.min_soc,
-                        0,
-                        inverter_max_export_dc - solar_to_inverter_export,
-                    )
-                else:
-                    battery_discharge = -clamp(
-                        BATTERY_CAPACITY * action.max_soc - battery_level,
-                        0,
-                        solar_to_inverter_export - inverter_max_export_dc,
-                    )
-                inverter_output_ac = (solar_to_inverter_export + max(0, battery_discharge)) * DC_TO_AC_EFFICIENCY
-
-            battery_level -= battery_discharge
-            assert battery_level >= 0
+        action = ACTIONS[INITIAL_ACTION_INDEX]
 
-            if inverter_output_ac > segment.consumption:
-                feed_in_amount = inverter_output_ac - segment.consumption
-                import_amount = 0.0
-            else:
-                feed_in_amount = 0.0
-                import_amount = segment.consumption - inverter_output_ac
+        for segment, action_change in zip(segments, plan, strict=True):
+            if action_change != CONTINUE_ACTION:
+                action = ACTIONS[action_change]
 
-            this_feed_in_cost = max(0, feed_in_amount * (segment.feed_in_tariff - DISCHARGE_DISINCENTIVE))
+            battery_level, feed_in_amount, import_amount, this_feed_in_cost, this_import_cost = simulate_segment(
+                segment, action, battery_level
+            )
             feed_in_cost += this_feed_in_cost
-            this_import_cost = import_amount * segment.import_tariff
             import_cost += this_import_cost
 
             if outputs is not None:
@@ -226,315 +237,828 @@ class BatteryModel:
                     )
                 )
 
-        score = round(feed_in_cost, 2) - round(import_cost, 2)
-
-        # Round to avoid floating-point error saying that one result is better than another, when in fact they're the
-        # same
+        score = plan_score(feed_in_cost, import_cost, battery_level, self.terminal_value)
+        if outputs is None and self.score_cache is not None:
+            self.score_cache.put(key, score)
         return score
 
-    def create_hash(self, actions: list[Action | None]) -> int:
-        prev_action_hash = INITIAL_ACTION.make_hash()
-        h = 0
-        for action in actions:
-            this_hash = prev_action_hash if action is None else action.make_hash()
-            h = hash((h, this_hash))
-        return h
+    def run_batch(
+        self,
+        segments: list[TimeSegment],
+        plans: PlanBatch,
+        outputs: list[RunOutput] | None = None,
+    ) -> npt.NDArray[np.float64]:
+        """Equivalent to calling run() on each plan in turn, but much faster for large numbers of plans"""
+        self.counters.runs += plans.num_plans
+        self.counters.segments_simulated += plans.num_plans * len(segments)
+        return simulate_batch(segments, self._initial_battery, plans, outputs, self.terminal_value)
+
+    def create_hash(self, plan: Sequence[int]) -> int:
+        """Plans which do the same thing in every slot have the same hash"""
+        return hash(plan_key(plan))
 
     def is_better(self, x: float, y: float, margin: float = 0.0) -> bool:
         if abs(x - y) < margin:
             return False
         return x > y
 
-    def shotgun_hillclimb(self, segments: list[TimeSegment]) -> tuple[list[Action], RunOutput]:
-        # visited_actions_hashes = set()
-        action_type_set = (ActionType.SELF_USE, ActionType.CHARGE, ActionType.DISCHARGE)
+    def optimize(
+        self,
+        segments: list[TimeSegment],
+        seed_plan: Sequence[int] | None = None,
+        library_plans: Sequence[Sequence[int]] = (),
+    ) -> tuple[list[Action], RunOutput]:
+        """
+        Find the best plan using the configured engine. Returns the first 24 actions, and the full run output. The
+        whole plan is left in best_plan.
+
+        seed_plan is a plan which is expected to be close to the best (e.g. the last plan, shifted to start now), which
+        engines may use as a starting point. library_plans are plans which were best for similar segments in the past
+        (see PlanLibrary), most similar first, which the hill climb starts from in place of some random restarts.
+        """
+        if self._horizon_slots is not None and len(segments) > self._horizon_slots:
+            return self._optimize_horizon(segments, self._horizon_slots, seed_plan, library_plans)
+        if self._engine == OptimizerEngine.DYNAMIC_PROGRAMMING:
+            return self.dynamic_programming(segments)
+        if self._engine == OptimizerEngine.MILP:
+            return self.milp(segments)
+        if self._engine == OptimizerEngine.CHANGE_POINT:
+            return self.change_point_search(segments, seed_plan)
+        return self.shotgun_hillclimb(segments, seed_plan, library_plans)
+
+    def _optimize_horizon(
+        self,
+        segments: list[TimeSegment],
+        horizon_slots: int,
+        seed_plan: Sequence[int] | None,
+        library_plans: Sequence[Sequence[int]],
+    ) -> tuple[list[Action], RunOutput]:
+        """
+        Optimize the segments horizon_slots at a time, each chunk starting from the battery level which the one before
+        leaves, and valuing whatever it leaves in the battery by the tariffs after it. The budget is split evenly
+        between the chunks.
+        """
+        chunk_starts = range(0, len(segments), horizon_slots)
+        time_budget = self._time_budget
+        run_budget = self._run_budget
+        initial_battery = self._initial_battery
+        if time_budget is not None:
+            self._time_budget = time_budget / len(chunk_starts)
+        if run_budget is not None:
+            self._run_budget = run_budget // len(chunk_starts)
+
+        plan = new_plan(0)
+        actions: list[Action] = []
+        stats: OptimizerStats | None = None
+        try:
+            for chunk_start in chunk_starts:
+                chunk_end = chunk_start + horizon_slots
+                chunk = segments[chunk_start:chunk_end]
+                self.terminal_value = terminal_battery_value(segments[chunk_end:])
+                _LOGGER.debug(
+                    "Optimizing slots %d to %d, with terminal value %s", chunk_start, chunk_end, self.terminal_value
+                )
+                chunk_actions, _ = self.optimize(
+                    chunk,
+                    None if seed_plan is None else seed_plan[chunk_start:chunk_end],
+                    [x[chunk_start:chunk_end] for x in library_plans],
+                )
+                # Each chunk was planned as if it followed the initial action, so mustn't continue the last one's
+                if self.best_plan[0] == CONTINUE_ACTION:
+                    self.best_plan[0] = INITIAL_ACTION_INDEX
+                plan.extend(self.best_plan)
+                actions.extend(chunk_actions)
+                self._initial_battery = self._final_battery_level(chunk, self.best_plan)
+                if stats is None:
+                    stats = self.stats
+                else:
+                    stats.add_stage("tail", self.stats)
+        finally:
+            self._time_budget = time_budget
+            self._run_budget = run_budget
+            self._initial_battery = initial_battery
+            self.terminal_value = 0.0
+
+        assert stats is not None
+        self.stats = stats
+        self.best_plan = plan
+        outputs = RunOutput()
+        self.stats.score = self.run(segments, plan, outputs)
+        return actions[:24], outputs
+
+    def _final_battery_level(self, segments: list[TimeSegment], plan: Sequence[int]) -> float:
+        battery_level = self._initial_battery
+        action = ACTIONS[INITIAL_ACTION_INDEX]
+        for segment, action_change in zip(segments, plan, strict=True):
+            if action_change != CONTINUE_ACTION:
+                action = ACTIONS[action_change]
+            battery_level = simulate_segment(segment, action, battery_level)[0]
+        return battery_level
+
+    def dynamic_programming(self, segments: list[TimeSegment]) -> tuple[list[Action], RunOutput]:
+        self._start_stats(OptimizerEngine.DYNAMIC_PROGRAMMING)
+        self.score_cache = self._new_score_cache()
+        with self.stats.phase("dynamic_programming", self.counters):
+            plan = optimize_dp(
+                segments,
+                self._initial_battery,
+                self.counters,
+                grid_step_percent=self._grid_step_percent,
+                terminal_value=self.terminal_value,
+            )
+            result = self.run(segments, plan)
+        _LOGGER.debug("Dynamic programming: %s", result)
+        # The amount of work is fixed by the size of the grid, so there's no need to apply the budget
+        self.stats.converged = True
+        return self._simplify_and_tune(segments, plan, result)
+
+    def milp(self, segments: list[TimeSegment]) -> tuple[list[Action], RunOutput]:
+        self._start_stats(OptimizerEngine.MILP)
+        self.score_cache = self._new_score_cache()
+        with self.stats.phase("milp", self.counters):
+            solution = optimize_milp(
+                segments, self._initial_battery, time_limit=self._time_budget, terminal_value=self.terminal_value
+            )
+            # The linear model is only an approximation, so see how the plan really does
+            result = self.run(segments, solution.plan)
+        _LOGGER.debug("MILP: %s (predicted %s)", result, solution.predicted_score)
+        self.stats.converged = solution.optimal
+        return self._simplify_and_tune(segments, solution.plan, result)
+
+    def change_point_search(
+        self, segments: list[TimeSegment], seed_plan: Sequence[int] | None = None
+    ) -> tuple[list[Action], RunOutput]:
+        """
+        Search over plans as lists of change points, rather than slot by slot (see change_point_moves). This can move
+        whole periods of charge or discharge at once, so it finds the neat plans which the post-processing would
+        otherwise have to work towards one slot at a time, with far fewer runs than the hill climb.
+        """
+        self._start_stats(OptimizerEngine.CHANGE_POINT)
+        self.score_cache = self._new_score_cache()
+        deadline = None if self._time_budget is None else time.time() + self._time_budget
+        max_runs = None if self._run_budget is None else self.counters.runs + self._run_budget
+
+        # Start from plans which never change action: one which uses the battery as it goes, and one which holds it.
+        # That's enough for the search to find plans which save the battery for later, as well as ones which don't
+        initial_plans = [
+            array("h", [x]) + new_plan(len(segments) - 1)
+            for x in (INITIAL_ACTION_INDEX, action_index(ActionType.SELF_USE, 100, 100))
+        ]
+        if seed_plan is not None:
+            if len(seed_plan) != len(segments):
+                raise ValueError(f"Seed plan has {len(seed_plan)} slots, but there are {len(segments)} segments")
+            # The seed plan goes first, so that it wins any ties
+            initial_plans.insert(0, array("h", seed_plan))
+
         best_result_ever: float | None = None
-        best_actions_ever: list[Action] = []
-        slots = list(range(len(segments)))
-        for loops in range(10):
-            # Keeping a fair number of "Do last action" seems to make it easier for it to find solutions which only work
-            # if you consistently do the same thing a lot.
-            # actions: list[Action | None] = [INITIAL_ACTION.clone() for _ in range(len(segments))]
-            actions: list[Action | None] = [None] * len(segments)
-            # I've noticed that just seeding the first 24 hours works well: it speeds things up, without compromising
-            # the quality of the first 24 hours. Of course the second 24 hours suffers, but we don't care about that
-            # really.
-
-            # Different types of scenario suit different numbers of seeds. For cases where we e.g. need to hold the soc
-            # low for a long period, then having a long sequence of None's works well. For simpler cases, we converge
-            # faster if there are fewer Nones, as the whole thing is a bit less volatile.
-            # A long fill factor is quite often better if we need to keep the soc low all day, but other than that
-            # short fill factors tend to be better.
-            fill_factor = (1, 4, 8)[(loops % 3)]
-            # TODO: Thi 24 is faster... Is it better in all cases?
-            for i in range(len(actions)):
-                if i % fill_factor == 0:
-                    # if True:
-                    action_type = random.choice(action_type_set)
-                    # No point having a min soc when charging
-                    min_soc_percent = (
-                        MIN_SOC_PERMITTED_PERCENT
-                        if action_type == ActionType.CHARGE
-                        else random.choice((MIN_SOC_PERMITTED_PERCENT, 100))
-                    )
-                    # No point in having a max soc when self-use or discharging
-                    max_soc_percent = (
-                        random.randrange(min_soc_percent, 101, SOC_STEP_PERCENT)
-                        if action_type == ActionType.CHARGE
-                        else random.choice([min_soc_percent, 100])
-                    )
-                    actions[i] = Action(
-                        action_type,
-                        min_soc=min_soc_percent / 100.0,
-                        max_soc=max_soc_percent / 100.0,
+        best_plan_ever = new_plan(0)
+        self.stats.converged = True
+        for restart, initial_plan in enumerate(initial_plans):
+            start_time = time.perf_counter()
+            start_runs = self.counters.runs
+            trace: list[float] | None = [] if self._trace_convergence else None
+            best_result, best_plan, converged = self.change_point_restart(
+                segments, initial_plan, deadline, max_runs, trace
+            )
+            self.stats.converged = self.stats.converged and converged
+            self.stats.restarts.append(
+                RestartStats(
+                    restart=restart,
+                    seeded=seed_plan is not None and restart == 0,
+                    wall_time=time.perf_counter() - start_time,
+                    runs=self.counters.runs - start_runs,
+                    score=best_result,
+                    converged=converged,
+                    score_trace=trace,
+                )
+            )
+            _LOGGER.debug("Change point search %d: %s", restart, best_result)
+            if best_result_ever is None or self.is_better(best_result, best_result_ever):
+                best_result_ever = best_result
+                best_plan_ever = best_plan
+            if not converged:
+                break
+
+        # Spell out the continues, so that each slot's action can be tuned separately
+        old_action = INITIAL_ACTION_INDEX
+        for slot in range(len(best_plan_ever)):
+            if best_plan_ever[slot] == CONTINUE_ACTION:
+                best_plan_ever[slot] = old_action
+            else:
+                old_action = best_plan_ever[slot]
+
+        assert best_result_ever is not None
+        return self._simplify_and_tune(segments, best_plan_ever, best_result_ever, deadline, max_runs)
+
+    def change_point_restart(
+        self,
+        segments: list[TimeSegment],
+        initial_plan: Sequence[int],
+        deadline: float | None = None,
+        max_runs: int | None = None,
+        trace: list[float] | None = None,
+    ) -> tuple[float, Plan, bool]:
+        """
+        Climb from initial_plan using change_point_moves, taking the best move each time, until no move improves it,
+        or until time.time() reaches deadline or counters.runs reaches max_runs. Returns the best score and plan
+        found, and whether the climb converged.
+
+        If trace is given, the score at the start of each iteration is appended to it.
+        """
+        candidates = [self.slot_candidates(x) for x in segments]
+        if self._prune_dominated:
+            for slot_candidates, dominated in zip(
+                candidates, dominated_action_types(segments, self.terminal_value), strict=True
+            ):
+                slot_candidates[:] = [x for x in slot_candidates if ACTIONS[x].action_type not in dominated]
+
+        simulator = IncrementalSimulator(
+            segments,
+            self._initial_battery,
+            self.counters,
+            self.score_cache,
+            TransitionTable(segments),
+            self.terminal_value,
+        )
+        plan = array("h", initial_plan)
+        best_result = simulator.reset(plan)
+        converged = True
+        while True:
+            if trace is not None:
+                trace.append(best_result)
+            with self.stats.phase("change_point_ascent", self.counters):
+                moves = change_point_moves(plan, candidates)
+                if self._out_of_budget(deadline, max_runs, len(moves)):
+                    converged = False
+                    break
+                # Shuffling these means we choose a random move from those with the best score
+                self._rng.shuffle(moves)
+                best_move, new_result = simulator.evaluate_best(plan, moves)
+                if not self.is_better(new_result, best_result):
+                    break
+                apply_move(plan, moves[best_move])
+                best_result = simulator.reset(plan)
+
+        # Moves which don't change the score aren't taken above, so there may be change points we can do without
+        with self.stats.phase("change_point_removal", self.counters):
+            for slot in range(len(plan)):
+                old_action = plan[slot]
+                if old_action != CONTINUE_ACTION:
+                    plan[slot] = CONTINUE_ACTION
+                    new_result = simulator.evaluate(plan, slot, slot)
+                    if self.is_better(best_result, new_result):
+                        plan[slot] = old_action
+                    else:
+                        simulator.accept()
+
+        if trace is not None:
+            trace.append(best_result)
+        return best_result, plan, converged
+
+    def random_plan(self, num_slots: int, restart: int, rng: random.Random) -> Plan:
+        action_type_set = (ActionType.SELF_USE, ActionType.CHARGE, ActionType.DISCHARGE)
+        # Keeping a fair number of "Do last action" seems to make it easier for it to find solutions which only work
+        # if you consistently do the same thing a lot.
+        plan = new_plan(num_slots)
+
+        # Different types of scenario suit different numbers of seeds. For cases where we e.g. need to hold the soc
+        # low for a long period, then having a long sequence of None's works well. For simpler cases, we converge
+        # faster if there are fewer Nones, as the whole thing is a bit less volatile.
+        # A long fill factor is quite often better if we need to keep the soc low all day, but other than that
+        # short fill factors tend to be better.
+        fill_factor = (1, 4, 8)[(restart % 3)]
+        for i in range(len(plan)):
+            if i % fill_factor == 0:
+                action_type = rng.choice(action_type_set)
+                # No point having a min soc when charging
+                min_soc_percent = (
+                    MIN_SOC_PERMITTED_PERCENT
+                    if action_type == ActionType.CHARGE
+                    else rng.choice((MIN_SOC_PERMITTED_PERCENT, 100))
+                )
+                # No point in having a max soc when self-use or discharging
+                max_soc_percent = (
+                    rng.randrange(min_soc_percent, 101, SOC_STEP_PERCENT)
+                    if action_type == ActionType.CHARGE
+                    else rng.choice([min_soc_percent, 100])
+                )
+                plan[i] = action_index(action_type, min_soc_percent, max_soc_percent)
+        return plan
+
+    def slot_candidates(self, segment: TimeSegment) -> list[int]:
+        """Every action which the hill climb tries in a slot with the given segment, in the order it tries them"""
+        candidates: list[int] = []
+        for action_type in (ActionType.SELF_USE, ActionType.CHARGE, ActionType.DISCHARGE):
+            # min soc is used:
+            # - when charging, it isn't used
+            # - when in self use, to prevent discharge
+            # - when force discharging, to say what limit to force discharge to
+            min_soc_percents: Iterable[int]
+            if action_type == ActionType.CHARGE:
+                min_soc_percents = (MIN_SOC_PERMITTED_PERCENT,)
+            elif action_type == ActionType.SELF_USE:
+                min_soc_percents = (
+                    (MIN_SOC_PERMITTED_PERCENT,)
+                    if segment.generation > segment.consumption / DC_TO_AC_EFFICIENCY
+                    else (MIN_SOC_PERMITTED_PERCENT, 100)
+                )
+            elif action_type == ActionType.DISCHARGE:
+                # Don't allow a discharge down to 100%: the model tries to use it as a way to keep charge
+                min_soc_percents = range(MIN_SOC_PERMITTED_PERCENT, 99, DISCHARGE_SOC_STEP_PERCENT)
+
+            for min_soc_percent in min_soc_percents:
+                # max soc is used:
+                #  - when charging, to limit how much we pull from the grid
+                #  - when we're consuming solar, to leave space in the battery for e.g. a cheap charge period in the
+                #    future
+                # - when discharging, unused
+                max_soc_percents: Iterable[int]
+                if action_type == ActionType.CHARGE:
+                    max_soc_percents = range(min_soc_percent, 101, SOC_STEP_PERCENT)
+                elif action_type == ActionType.SELF_USE:
+                    max_soc_percents = (
+                        (min_soc_percent, 100)
+                        if segment.generation > segment.consumption / DC_TO_AC_EFFICIENCY
+                        else (100,)
                     )
-            best_actions = actions.copy()
-            best_result = self.run(segments, actions)
-            while True:
-                found_better = False
-                # We evaluate each of the possible changes, and see which one has the greatest effect
-                best_improved_result = best_result
-                best_improved_actions: list[Action | None] | None = None
-                # Shuffling these means we choose a random action from those with the best score
-                random.shuffle(slots)
-                for slot in slots:
-                    old_action = actions[slot]
-                    if actions[slot] is None:
-                        actions[slot] = Action(
-                            ActionType.SELF_USE, min_soc=MIN_SOC_PERMITTED_PERCENT / 100, max_soc=1.0
-                        )  # All these properties are going to be overridden shortly
+                elif action_type == ActionType.DISCHARGE:
+                    max_soc_percents = (100,)
+
+                candidates.extend(action_index(action_type, min_soc_percent, x) for x in max_soc_percents)
+        return candidates
+
+    def hillclimb_restart(
+        self,
+        segments: list[TimeSegment],
+        restart: int,
+        rng: random.Random,
+        deadline: float | None = None,
+        max_runs: int | None = None,
+        initial_plan: Sequence[int] | None = None,
+        trace: list[float] | None = None,
+        coarse_block_slots: int | None = None,
+        compress_segments: bool = False,
+        prune_dominated: bool = True,
+    ) -> tuple[float, Plan, bool]:
+        """
+        Climb from initial_plan (or a random starting plan) until no single-slot change improves it, or until
+        time.time() reaches deadline or we've scored max_runs plans. restart selects how sparse a random starting plan
+        is. Returns the best score and plan found, and whether the climb converged.
+
+        If coarse_block_slots is given (and we're starting from a random plan), we first climb by changing whole blocks
+        of that many slots at a time to a single action, and then refine the result slot by slot.
+
+        If compress_segments is set, each group of slots from group_equivalent_slots shares a single decision, rather
+        than each slot being changed on its own.
+
+        If prune_dominated is set, actions from dominated_action_types aren't tried. They're counted in counters.pruned.
+
+        If trace is given, the score at the start of each iteration is appended to it.
+        """
+        all_candidates = [self.slot_candidates(x) for x in segments]
+        candidates = all_candidates
+        if prune_dominated:
+            candidates = [
+                [x for x in slot_candidates if ACTIONS[x].action_type not in dominated]
+                for slot_candidates, dominated in zip(
+                    all_candidates, dominated_action_types(segments, self.terminal_value), strict=True
+                )
+            ]
+
+        def block(first_slot: int, last_slot: int) -> tuple[int, int, list[int], int]:
+            # Every action which any slot in the block would try, in the order they'd first be tried, and how many
+            # were pruned
+            if first_slot == last_slot:
+                block_candidates = candidates[first_slot]
+                num_pruned = len(all_candidates[first_slot]) - len(block_candidates)
+            else:
+                block_candidates = list(dict.fromkeys(x for y in candidates[first_slot : last_slot + 1] for x in y))
+                num_all = len({x for y in all_candidates[first_slot : last_slot + 1] for x in y})
+                num_pruned = num_all - len(block_candidates)
+            return first_slot, last_slot, block_candidates, num_pruned
+
+        # The slots which share a decision, as (first_slot, last_slot)
+        groups = group_equivalent_slots(segments) if compress_segments else [(x, x) for x in range(len(segments))]
+        # Each level of the search is a list of (first_slot, last_slot, candidates, num_pruned) blocks
+        levels = [[block(first_slot, last_slot) for first_slot, last_slot in groups]]
+        if coarse_block_slots is not None and coarse_block_slots > 1 and initial_plan is None:
+            coarse_blocks = [
+                block(first_slot, min(first_slot + coarse_block_slots, len(segments)) - 1)
+                for first_slot in range(0, len(segments), coarse_block_slots)
+            ]
+            levels.insert(0, coarse_blocks)
+
+        # Almost every run below changes a single slot (or block of slots) from a plan we've already simulated
+        simulator = IncrementalSimulator(
+            segments,
+            self._initial_battery,
+            self.counters,
+            self.score_cache,
+            TransitionTable(segments),
+            self.terminal_value,
+        )
+        plan = self.random_plan(len(segments), restart, rng) if initial_plan is None else array("h", initial_plan)
+        share_group_decisions(plan, groups)
+        best_plan = plan[:]
+        best_result = simulator.reset(plan)
+        converged = True
+        for level, blocks in enumerate(levels):
+            phase = "steepest_ascent" if level == len(levels) - 1 else "coarse_ascent"
+            if level > 0:
+                # A coarse plan is mostly continues, so changing one slot would change the rest of its block too.
+                # Spell the actions out so that each slot can be refined on its own
+                plan = best_plan[:]
+                action = INITIAL_ACTION_INDEX
+                for slot in range(len(plan)):
+                    if plan[slot] == CONTINUE_ACTION:
+                        plan[slot] = action
                     else:
-                        actions[slot] = actions[slot].clone()  # type: ignore
-                    action = actions[slot]
-                    assert action is not None
-
-                    for new_action_type in action_type_set:
-                        action.action_type = new_action_type
-                        # min soc is used:
-                        # - when charging, it isn't used
-                        # - when in self use, to prevent discharge
-                        # - when force discharging, to say what limit to force discharge to
-                        new_min_soc_percents: Iterable[int]
-                        if new_action_type == ActionType.CHARGE:
-                            new_min_soc_percents = (MIN_SOC_PERMITTED_PERCENT,)
-                        elif new_action_type == ActionType.SELF_USE:
-                            new_min_soc_percents = (
-                                (MIN_SOC_PERMITTED_PERCENT,)
-                                if segments[slot].generation > segments[slot].consumption / DC_TO_AC_EFFICIENCY
-                                else (MIN_SOC_PERMITTED_PERCENT, 100)
-                            )
-                        elif new_action_type == ActionType.DISCHARGE:
-                            # Don't allow a discharge down to 100%: the model tries to use it as a way to keep charge
-                            new_min_soc_percents = range(MIN_SOC_PERMITTED_PERCENT, 99, DISCHARGE_SOC_STEP_PERCENT)
-
-                        for new_min_soc_percent in new_min_soc_percents:
-                            action.min_soc = new_min_soc_percent / 100
-                            # max soc is used:
-                            #  - when charging, to limit how much we pull from the grid
-                            #  - when we're consuming solar, to leave space in the battery for e.g. a cheap charge
-                            #    period in the future
-                            # - when discharging, unused
-                            new_max_soc_percents: Iterable[int]
-                            if new_action_type == ActionType.CHARGE:
-                                new_max_soc_percents = range(new_min_soc_percent, 101, SOC_STEP_PERCENT)
-                            elif new_action_type == ActionType.SELF_USE:
-                                new_max_soc_percents = (
-                                    (new_min_soc_percent, 100)
-                                    if segments[slot].generation > segments[slot].consumption / DC_TO_AC_EFFICIENCY
-                                    else (100,)
-                                )
-                            elif new_action_type == ActionType.DISCHARGE:
-                                new_max_soc_percents = (100,)
-
-                            for new_max_soc_percent in new_max_soc_percents:
-                                action.max_soc = new_max_soc_percent / 100
-                                new_result = self.run(segments, actions)
-                                if self.is_better(new_result, best_improved_result):
-                                    # self.run(segments, actions, initial_battery, debug=True)
-                                    found_better = True
-                                    best_improved_result = new_result
-                                    best_improved_actions = actions.copy()
-                                    # Since we're going to be further mutating this action, we need to clone it now
-                                    action = actions[slot] = action.clone()
-
-                    actions[slot] = old_action
+                        action = plan[slot]
+                # Sharing decisions can change the plan, so the refinement starts from its own score. Otherwise it
+                # would only accept moves which beat the coarse plan
+                share_group_decisions(plan, groups)
+                best_result = simulator.reset(plan)
+                best_plan = plan[:]
+            while True:
+                if trace is not None:
+                    trace.append(best_result)
+                with self.stats.phase(phase, self.counters):
+                    # We evaluate each of the possible changes, and see which one has the greatest effect
+                    best_improved_result = best_result
+                    best_improved_plan: Plan | None = None
+                    # Shuffling these means we choose a random action from those with the best score
+                    rng.shuffle(blocks)
+                    # The whole neighbourhood. The rest of each block carries on with its first action
+                    moves: list[Move] = []
+                    for first_slot, last_slot, block_candidates, num_pruned in blocks:
+                        if self._out_of_budget(deadline, max_runs, len(moves)):
+                            converged = False
+                            break
+
+                        self.counters.pruned += num_pruned
+                        moves.extend((first_slot, last_slot, x, CONTINUE_ACTION) for x in block_candidates)
+
+                    # Scoring them all at once is much cheaper than one at a time. Ties go to the first move, so the
+                    # shuffle still picks between them
+                    if len(moves) > 0:
+                        best_move, new_result = simulator.evaluate_best(plan, moves)
+                        if self.is_better(new_result, best_improved_result):
+                            best_improved_result = new_result
+                            best_improved_plan = plan[:]
+                            apply_move(best_improved_plan, moves[best_move])
+
+                if not converged:
+                    # Go with the best we've found so far
+                    if best_improved_plan is not None:
+                        best_result = best_improved_result
+                        best_plan = best_improved_plan
+                    break
 
                 # Doing this here, rather than only when we reach a local maximum, seems to help some scenarios with
                 # high generation and a late free period
-                removed = 0
-                for slot in range(len(actions)):
-                    old_action = actions[slot]
-                    if old_action is not None:
-                        actions[slot] = None
-                        new_result = self.run(segments, actions)
-                        if self.is_better(best_improved_result, new_result):
-                            actions[slot] = old_action
-                        else:
-                            removed += 1
-
-                if found_better:
-                    # Did we find an improvement? Keep going
+                with self.stats.phase("none_removal", self.counters):
+                    removed = 0
+                    removed_result = best_result
+                    for slot in range(len(plan)):
+                        if self._out_of_budget(deadline, max_runs):
+                            converged = False
+                            break
+                        old_action = plan[slot]
+                        if old_action != CONTINUE_ACTION:
+                            plan[slot] = CONTINUE_ACTION
+                            new_result = simulator.evaluate(plan, slot, slot)
+                            if self.is_better(best_improved_result, new_result):
+                                plan[slot] = old_action
+                            else:
+                                removed += 1
+                                removed_result = new_result
+                                simulator.accept()
+
+                if best_improved_plan is not None:
+                    # Did we find an improvement? Keep going, from a copy, as the next removal pass edits the plan
                     best_result = best_improved_result
-                    best_actions = actions = best_improved_actions  # type: ignore
+                    best_plan = best_improved_plan
+                    plan = best_plan[:]
+                    simulator.reset(plan)
+                    if not converged:
+                        break
                 else:
+                    # We're at a local maximum, which the removals didn't make any worse, so keep them
+                    if removed > 0:
+                        best_result = removed_result
+                        best_plan = plan[:]
                     break
 
-            best_result_24h = self.run(segments[:24], best_actions[:24])
-            # self.run(segments, best_actions, initial_battery, debug=True)
-            if best_result_ever is None or self.is_better(best_result, best_result_ever):
-                print(f"Improved: {best_result} ({best_result_24h})")
-                best_result_ever = best_result
-                best_actions_ever = best_actions  # type: ignore
-            else:
-                print(f"Not improved: {best_result} ({best_result_24h})")
+            if not converged:
+                break
 
-        # Also get rid of Nones
+        if trace is not None:
+            trace.append(best_result)
+        return best_result, best_plan, converged
 
-        old_action = INITIAL_ACTION
-        for slot in range(len(best_actions_ever)):
-            if best_actions_ever[slot] is None:
-                # We're going to be mutating these, so we need to clone them
-                best_actions_ever[slot] = old_action.clone()
+    def _out_of_budget(self, deadline: float | None, max_runs: int | None, pending_runs: int = 0) -> bool:
+        """Whether we've run out of time, or will have scored max_runs plans once pending_runs more are scored"""
+        return (deadline is not None and time.time() >= deadline) or (
+            max_runs is not None and self.counters.runs + pending_runs >= max_runs
+        )
+
+    def shotgun_hillclimb(
+        self,
+        segments: list[TimeSegment],
+        seed_plan: Sequence[int] | None = None,
+        library_plans: Sequence[Sequence[int]] = (),
+    ) -> tuple[list[Action], RunOutput]:
+        self._start_stats(OptimizerEngine.HILL_CLIMB)
+        # Shared between the restarts (if they're run in this process) and the post-processing
+        self.score_cache = self._new_score_cache()
+        best_result_ever: float | None = None
+        best_plan_ever = new_plan(0)
+
+        # The seed plan goes first, so that it wins any ties. This keeps the plan from changing needlessly
+        initial_plans: list[Sequence[int] | None]
+        if seed_plan is None:
+            initial_plans = [None] * NUM_RESTARTS
+        else:
+            if len(seed_plan) != len(segments):
+                raise ValueError(f"Seed plan has {len(seed_plan)} slots, but there are {len(segments)} segments")
+            initial_plans = [seed_plan, *([None] * NUM_RESTARTS_WITH_SEED_PLAN)]
+        # Library plans go in place of random restarts, after the seed plan
+        library_plans = library_plans[: min(NUM_LIBRARY_PLANS, initial_plans.count(None) - 1)]
+        for library_plan in library_plans:
+            if len(library_plan) != len(segments):
+                raise ValueError(f"Library plan has {len(library_plan)} slots, but there are {len(segments)} segments")
+        first_random = initial_plans.index(None)
+        initial_plans[first_random : first_random + len(library_plans)] = library_plans
+
+        # The restarts are independent, so can be run in parallel. Each gets its own RNG, so that the results don't
+        # depend on how they were scheduled
+        restart_seeds = [self._rng.getrandbits(64) for _ in initial_plans]
+        # Use wall-clock time rather than a monotonic clock, as it needs to mean the same thing in other processes
+        deadline = None if self._time_budget is None else time.time() + self._time_budget
+        # Split the run budget evenly, so that the result doesn't depend on how the restarts were scheduled
+        max_runs = None if self._run_budget is None else max(1, self._run_budget // len(initial_plans))
+        # ...but the post-processing can have whatever they leave
+        total_max_runs = None if self._run_budget is None else self.counters.runs + self._run_budget
+        # Restarts in other processes can't share our score cache, so they each get their own
+        score_caches: Iterable[ScoreCache | None] = (
+            repeat(self.score_cache)
+            if self._executor is None or self.score_cache is None
+            else [ScoreCache(self.score_cache.max_size) for _ in initial_plans]
+        )
+        restart_args = (
+            repeat(self._initial_battery),
+            repeat(segments),
+            range(len(initial_plans)),
+            restart_seeds,
+            repeat(deadline),
+            repeat(max_runs),
+            initial_plans,
+            repeat(self._trace_convergence),
+            score_caches,
+            repeat(self._coarse_block_slots),
+            repeat(self._compress_segments),
+            repeat(self._prune_dominated),
+            repeat(self.terminal_value),
+        )
+        results: Iterable[tuple[Plan, SimulationCounters, RestartStats, dict[str, PhaseStats]]]
+        with self.stats.phase("restarts", self.counters):
+            if self._executor is None:
+                results = map(run_hillclimb_restart, *restart_args)
+            else:
+                results = self._executor.map(run_hillclimb_restart, *restart_args)
+            self.stats.converged = True
+            for best_plan, counters, restart_stats, phases in results:
+                best_result = restart_stats.score
+                self.stats.converged = self.stats.converged and restart_stats.converged
+                self.stats.restarts.append(restart_stats)
+                for name, phase in phases.items():
+                    self.stats.add_phase(name, phase)
+                self.counters.add(counters)
+                # self.run(segments, best_plan, initial_battery, debug=True)
+                improved = best_result_ever is None or self.is_better(best_result, best_result_ever)
+                if _LOGGER.isEnabledFor(logging.DEBUG):
+                    # Scored by a separate model, so that logging doesn't change the counters and stats
+                    best_result_24h = BatteryModel(initial_battery=self._initial_battery).run(
+                        segments[:24], best_plan[:24]
+                    )
+                    _LOGGER.debug(
+                        "Restart %d: %s: %s (%s)",
+                        restart_stats.restart,
+                        "Improved" if improved else "Not improved",
+                        best_result,
+                        best_result_24h,
+                    )
+                if improved:
+                    best_result_ever = best_result
+                    best_plan_ever = best_plan
+
+        # Also get rid of continues, so that each slot's action can be tuned separately
+        old_action = INITIAL_ACTION_INDEX
+        for slot in range(len(best_plan_ever)):
+            if best_plan_ever[slot] == CONTINUE_ACTION:
+                best_plan_ever[slot] = old_action
             else:
-                old_action = best_actions_ever[slot]
+                old_action = best_plan_ever[slot]
 
-        assert best_actions_ever is not None
         assert best_result_ever is not None
-        print(repr(best_actions_ever))
+        return self._simplify_and_tune(segments, best_plan_ever, best_result_ever, deadline, total_max_runs)
+
+    def _simplify_and_tune(
+        self,
+        segments: list[TimeSegment],
+        best_plan_ever: Plan,
+        best_result_ever: float,
+        deadline: float | None = None,
+        max_runs: int | None = None,
+    ) -> tuple[list[Action], RunOutput]:
+        """
+        Post-process the best plan an engine found: remove unnecessary changes of action, extend charge periods and
+        shorten discharge periods where that doesn't hurt the score too much, and tune the min/max socs.
+
+        If time.time() reaches deadline or we've scored max_runs plans, the rest of the post-processing is skipped, and
+        the optimization doesn't count as converged.
+
+        best_plan_ever mustn't contain any CONTINUE_ACTIONs.
+        """
+
+        def out_of_budget() -> bool:
+            # Every change so far has been accepted or undone, so the plan can be used as it is
+            if self._out_of_budget(deadline, max_runs):
+                self.stats.converged = False
+                return True
+            return False
+
+        simulator = IncrementalSimulator(
+            segments,
+            self._initial_battery,
+            self.counters,
+            self.score_cache,
+            TransitionTable(segments),
+            self.terminal_value,
+        )
+
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("Best actions before post-processing: %s", plan_to_actions(best_plan_ever))
 
         if self._debug:
-            self.plot(segments, best_actions_ever)
-            self.plot(segments[:24], best_actions_ever[:24])
+            self.plot(segments, best_plan_ever)
+            self.plot(segments[:24], best_plan_ever[:24])
 
         # Try and simplify: if changing a slot to a "lower" action doesn't hurt the score, do it
 
         # TODO: Use 24 rather than len(actions) below? Do we really care about optimizing beyond 24h?
 
-        for slot in range(len(best_actions_ever)):
-            old_action = best_actions_ever[slot]
-
-            copied_another_action = False
-
-            # If we can make it the same as the previous action, do that.
-            # Don't do this for discharge: it tends to make the model extend the discharge beyond the end of a period
-            # with good export rates, which negatively affects things later. For discharge, it's better if we can extend
-            # it earlier.
-            # TODO: We might want to try copying discharge actions forward in time? That would require passes in two
-            # directions here.
-            if (
-                not copied_another_action
-                and slot > 0
-                and old_action != best_actions_ever[slot - 1]
-                and best_actions_ever[slot - 1].action_type != ActionType.DISCHARGE
-            ):
-                best_actions_ever[slot] = best_actions_ever[slot - 1].clone()
-                new_result = self.run(segments, best_actions_ever)
-                if not self.is_better(best_result_ever, new_result, margin=MARGIN):
-                    copied_another_action = True
-                else:
-                    best_actions_ever[slot] = old_action
-
-            # Try and disable charging
-            # (discharging doesn't seem to need this)
-            if not copied_another_action and best_actions_ever[slot].action_type == ActionType.CHARGE:
-                best_actions_ever[slot] = best_actions_ever[slot].clone()
-                # A charge with a low max soc is sometimes used to limit charge (which we can replace with low min/max
-                # soc) or discharge (replaced with high min/max soc)
-                best_actions_ever[slot].action_type = ActionType.SELF_USE
-                best_actions_ever[slot].max_soc = 1.0
-                best_actions_ever[slot].min_soc = 1.0
-                new_result = self.run(segments, best_actions_ever)
-                # If the old result was better, go back to it and continue. Otherwise go for the new result
-                if self.is_better(best_result_ever, new_result, margin=MARGIN):
-                    best_actions_ever[slot].max_soc = MIN_SOC_PERMITTED_PERCENT / 100.0
-                    best_actions_ever[slot].min_soc = MIN_SOC_PERMITTED_PERCENT / 100.0
-                    new_result = self.run(segments, best_actions_ever)
+        with self.stats.phase("simplify", self.counters):
+            simulator.reset(best_plan_ever)
+            for slot in range(len(best_plan_ever)):
+                if out_of_budget():
+                    break
+                old_action = best_plan_ever[slot]
+
+                copied_another_action = False
+
+                # If we can make it the same as the previous action, do that.
+                # Don't do this for discharge: it tends to make the model extend the discharge beyond the end of a
+                # period with good export rates, which negatively affects things later. For discharge, it's better if we
+                # can extend it earlier.
+                # TODO: We might want to try copying discharge actions forward in time? That would require passes in
+                # two directions here.
+                if (
+                    not copied_another_action
+                    and slot > 0
+                    and old_action != best_plan_ever[slot - 1]
+                    and ACTIONS[best_plan_ever[slot - 1]].action_type != ActionType.DISCHARGE
+                ):
+                    best_plan_ever[slot] = best_plan_ever[slot - 1]
+                    new_result = simulator.evaluate(best_plan_ever, slot, slot)
+                    if not self.is_better(best_result_ever, new_result, margin=MARGIN):
+                        copied_another_action = True
+                        simulator.accept()
+                    else:
+                        best_plan_ever[slot] = old_action
+
+                # Try and disable charging
+                # (discharging doesn't seem to need this)
+                if not copied_another_action and ACTIONS[best_plan_ever[slot]].action_type == ActionType.CHARGE:
+                    # A charge with a low max soc is sometimes used to limit charge (which we can replace with low
+                    # min/max soc) or discharge (replaced with high min/max soc)
+                    best_plan_ever[slot] = action_index(ActionType.SELF_USE, 100, 100)
+                    new_result = simulator.evaluate(best_plan_ever, slot, slot)
+                    # If the old result was better, go back to it and continue. Otherwise go for the new result
                     if self.is_better(best_result_ever, new_result, margin=MARGIN):
-                        best_actions_ever[slot] = old_action
+                        best_plan_ever[slot] = action_index(
+                            ActionType.SELF_USE, MIN_SOC_PERMITTED_PERCENT, MIN_SOC_PERMITTED_PERCENT
+                        )
+                        new_result = simulator.evaluate(best_plan_ever, slot, slot)
+                        if self.is_better(best_result_ever, new_result, margin=MARGIN):
+                            best_plan_ever[slot] = old_action
+                        else:
+                            simulator.accept()
+                    else:
+                        simulator.accept()
 
         # The step above will have removed any unnecessary charge periods (which do pop up, as a means to prevent
         # discharge). However, we do want charge periods to extend backwards as far as possible. If we have a 3-hour
         # cheap period say, we want the charge period to extend across all of it.
         # The "copy last action" step above will already have extended it forwards
-        ends_of_charge_periods = [
-            i
-            for i in range(1, len(best_actions_ever))
-            if best_actions_ever[i].action_type == ActionType.CHARGE
-            and (i == len(best_actions_ever) - 1 or best_actions_ever[i + 1].action_type != ActionType.CHARGE)
-        ]
-        for end_of_charge_period in ends_of_charge_periods:
-            for candidate in range(end_of_charge_period - 1, -1, -1):
-                if best_actions_ever[candidate].action_type == ActionType.CHARGE:
-                    continue
-                prev_action = best_actions_ever[candidate]
-                best_actions_ever[candidate] = best_actions_ever[end_of_charge_period].clone()
-                new_result = self.run(segments, best_actions_ever)
-                if self.is_better(best_result_ever, new_result, margin=MARGIN):
-                    best_actions_ever[candidate] = prev_action
+        with self.stats.phase("extend_charge", self.counters):
+            ends_of_charge_periods = [
+                i
+                for i in range(1, len(best_plan_ever))
+                if ACTIONS[best_plan_ever[i]].action_type == ActionType.CHARGE
+                and (i == len(best_plan_ever) - 1 or ACTIONS[best_plan_ever[i + 1]].action_type != ActionType.CHARGE)
+            ]
+            for end_of_charge_period in ends_of_charge_periods:
+                if out_of_budget():
                     break
+                for candidate in range(end_of_charge_period - 1, -1, -1):
+                    if ACTIONS[best_plan_ever[candidate]].action_type == ActionType.CHARGE:
+                        continue
+                    prev_action = best_plan_ever[candidate]
+                    best_plan_ever[candidate] = best_plan_ever[end_of_charge_period]
+                    new_result = simulator.evaluate(best_plan_ever, candidate, candidate)
+                    if self.is_better(best_result_ever, new_result, margin=MARGIN):
+                        best_plan_ever[candidate] = prev_action
+                        break
+                    simulator.accept()
 
         # We want to move discharge periods as late as possible. This is so that there's a bit more of a buffer in case
         # load is higher than expected.
         # We've already extended the period as late as we can, so just try and chop off the start.
-        start_of_discharge_periods = [
-            i
-            for i in range(len(best_actions_ever))
-            if best_actions_ever[i].action_type == ActionType.DISCHARGE
-            and (i == 0 or best_actions_ever[i - 1].action_type != ActionType.DISCHARGE)
-        ]
-        for start_of_discharge_period in start_of_discharge_periods:
-            for candidate in range(start_of_discharge_period, len(best_actions_ever)):
-                if best_actions_ever[candidate].action_type != ActionType.DISCHARGE:
-                    break
-                prev_action = best_actions_ever[candidate]
-                best_actions_ever[candidate] = best_actions_ever[candidate].clone()
-                # The closest we can get to discharge using self-use is a low min/max to prevent charge
-                best_actions_ever[candidate].action_type = ActionType.SELF_USE
-                best_actions_ever[candidate].min_soc = MIN_SOC_PERMITTED_PERCENT / 100.0
-                best_actions_ever[candidate].max_soc = MIN_SOC_PERMITTED_PERCENT / 100.0
-                new_result = self.run(segments, best_actions_ever)
-                if self.is_better(best_result_ever, new_result, margin=MARGIN):
-                    best_actions_ever[candidate] = prev_action
+        with self.stats.phase("trim_discharge", self.counters):
+            start_of_discharge_periods = [
+                i
+                for i in range(len(best_plan_ever))
+                if ACTIONS[best_plan_ever[i]].action_type == ActionType.DISCHARGE
+                and (i == 0 or ACTIONS[best_plan_ever[i - 1]].action_type != ActionType.DISCHARGE)
+            ]
+            for start_of_discharge_period in start_of_discharge_periods:
+                if out_of_budget():
                     break
+                for candidate in range(start_of_discharge_period, len(best_plan_ever)):
+                    if ACTIONS[best_plan_ever[candidate]].action_type != ActionType.DISCHARGE:
+                        break
+                    prev_action = best_plan_ever[candidate]
+                    # The closest we can get to discharge using self-use is a low min/max to prevent charge
+                    best_plan_ever[candidate] = action_index(
+                        ActionType.SELF_USE, MIN_SOC_PERMITTED_PERCENT, MIN_SOC_PERMITTED_PERCENT
+                    )
+                    new_result = simulator.evaluate(best_plan_ever, candidate, candidate)
+                    if self.is_better(best_result_ever, new_result, margin=MARGIN):
+                        best_plan_ever[candidate] = prev_action
+                        break
+                    simulator.accept()
 
         # We might have made the result slightly worse. Re-calculate
         # (we don't do this as we go, to make sure that we never get more than MARGIN away from the original best case)
-        best_result_ever = self.run(segments, best_actions_ever)
+        best_result_ever = self.run(segments, best_plan_ever)
 
         # We may need to run this more than once
-        while True:
-            changed, best_result_ever = self.optimize_min_max_soc(
-                segments, best_actions_ever, best_result_ever, margin=MARGIN
-            )
-            if not changed:
-                break
+        with self.stats.phase("optimize_min_max_soc", self.counters):
+            while not out_of_budget():
+                changed, best_result_ever = self.optimize_min_max_soc(
+                    segments, best_plan_ever, best_result_ever, margin=MARGIN
+                )
+                if not changed:
+                    break
 
-        for i, action in enumerate(best_actions_ever):
-            print(f"{i}: {action}")
-        best_result_ever = self.run(segments, best_actions_ever)
+        # Nothing is mutated from here on, so we can hand out the shared actions
+        best_actions_ever = [ACTIONS[x] for x in best_plan_ever]
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            for i, action in enumerate(best_actions_ever):
+                _LOGGER.debug("%d: %s", i, action)
+        best_result_ever = self.run(segments, best_plan_ever)
 
         if self._debug:
-            self.plot(segments, best_actions_ever)
+            self.plot(segments, best_plan_ever)
             for i, action in enumerate(best_actions_ever[:24]):
                 print(f"{i}: {action}")
 
-            self.plot(segments[:24], best_actions_ever[:24])
+            self.plot(segments[:24], best_plan_ever[:24])
 
             print(f"Number of runs: {self.num_runs}")
 
         outputs = RunOutput()
-        self.run(segments, best_actions_ever, outputs)
+        self.run(segments, best_plan_ever, outputs)
+        self.best_plan = best_plan_ever
+        self.stats.score = best_result_ever
+        self._finish_stats()
         return best_actions_ever[:24], outputs
 
     def optimize_min_max_soc(
         self,
         segments: list[TimeSegment],
-        actions: Sequence[Action],
+        plan: Plan,
         best_result_ever: float,
         shock: bool = True,
         margin: float = 0.0,
     ) -> tuple[bool, float]:
         changed = False
+        # The shocks below change the segments, so the scores here can't go in the score cache, and segments can't be
+        # simulated using a TransitionTable
+        simulator = IncrementalSimulator(
+            segments, self._initial_battery, self.counters, terminal_value=self.terminal_value
+        )
 
         # Now that we've got the charge periods in place, try and optimize the min/max socs
         # This time we can lower it to 10%. We didn't want to do that during planning to as to leave a margin.
@@ -542,14 +1066,15 @@ class BatteryModel:
         # Do the non-charge slots before the charge slots. Otherwise we can have a situation where we fail to increase
         # a charge slot because an unnecessarily low max soc later on would stop the battery from charging from solar
         # later.
-        for slot in range(len(actions)):
+        for slot in range(len(plan)):
             # Introduce a shock -- a large consumption for this slot. This gives us a way of tuning the min soc so
             # as to prevent excessive discharge in this case (e.g. to tide us through an expensive period).
 
-            prev_min_soc = actions[slot].min_soc
-            if actions[slot].action_type == ActionType.CHARGE:
+            prev_action = plan[slot]
+            action = ACTIONS[prev_action]
+            if action.action_type == ActionType.CHARGE:
                 # For charge periods, just set min soc to the min
-                actions[slot].min_soc = OPTIMIZATION_MIN_SOC_PERCENT / 100
+                plan[slot] = with_min_soc(prev_action, OPTIMIZATION_MIN_SOC_PERCENT)
             else:
                 prev_consumption = segments[slot].consumption
                 prev_generation = segments[slot].generation
@@ -557,36 +1082,35 @@ class BatteryModel:
                 # This needs to be large enough to drain the battery.
                 # Don't do this for discharge: we're draining down to a min soc anyway, so this won't affect how much
                 # the battery is drained. In practice, it just results in the model opting to drain the battery too far.
-                if shock and actions[slot].action_type == ActionType.SELF_USE:
+                if shock and action.action_type == ActionType.SELF_USE:
                     segments[slot].consumption = BATTERY_CAPACITY
                     segments[slot].generation = 0
 
-                test_result = self.run(segments, actions)
+                test_result = simulator.reset(plan)
 
-                best_min_soc = actions[slot].min_soc
+                best_action = prev_action
                 # The model's pretty good at finding the min soc when discharging. Don't try and find one that's lower,
                 # as this can result in over-zealous discharging.
                 min_soc_percents = (
-                    range(int(actions[slot].min_soc * 100), 101, OPTIMIZATION_SOC_STEP_PERCENT)
-                    if actions[slot].action_type == ActionType.DISCHARGE
+                    range(int(action.min_soc * 100), 101, OPTIMIZATION_SOC_STEP_PERCENT)
+                    if action.action_type == ActionType.DISCHARGE
                     else range(OPTIMIZATION_MIN_SOC_PERCENT, 101, OPTIMIZATION_SOC_STEP_PERCENT)
                 )
                 for min_soc_percent in min_soc_percents:
-                    min_soc = min_soc_percent / 100
-                    actions[slot].min_soc = min_soc
-                    new_result = self.run(segments, actions)
+                    plan[slot] = with_min_soc(prev_action, min_soc_percent)
+                    new_result = simulator.evaluate(plan, slot, slot)
                     if self.is_better(new_result, test_result, margin=margin):
                         test_result = new_result
-                        best_min_soc = min_soc
+                        best_action = plan[slot]
 
-                changed = changed or prev_min_soc != best_min_soc
+                changed = changed or prev_action != best_action
 
-                actions[slot].min_soc = best_min_soc
+                plan[slot] = best_action
                 segments[slot].consumption = prev_consumption
                 segments[slot].generation = prev_generation
                 # Reducing the min allowable min_soc can improve the score, particularly past the 24h point, as it's
                 # able to drain the battery further
-                best_result_ever = self.run(segments, actions)
+                best_result_ever = simulator.reset(plan)
 
             # We want to try the max and min before anything in between. If we're just charging normally it
             # should be 1.0, if we're using it to prevent discharge it should be min_soc, and more specialised cases
@@ -595,39 +1119,39 @@ class BatteryModel:
             # generation < consumption, the model won't see any reason to impose a max soc to stop the battery from
             # charging. Applying a shock generation ensures that this limit is put in place.
             # Else, if this is a charge period, just make it as high as it can be.
-            if actions[slot].action_type == ActionType.DISCHARGE:
+            prev_action = plan[slot]
+            action = ACTIONS[prev_action]
+            if action.action_type == ActionType.DISCHARGE:
                 # For discharge periods, just set the max soc to the max
-                actions[slot].max_soc = 1.0
-            elif actions[slot].action_type == ActionType.SELF_USE:
-                prev_max_soc = actions[slot].max_soc
+                plan[slot] = with_max_soc(prev_action, 100)
+            elif action.action_type == ActionType.SELF_USE:
                 prev_generation = segments[slot].generation
                 # Don't do this if it's night
                 if shock and segments[slot].generation > 0:
                     segments[slot].generation = BATTERY_CAPACITY + segments[slot].consumption
 
-                test_result = self.run(segments, actions)
+                test_result = simulator.reset(plan)
 
-                best_max_soc = actions[slot].max_soc
+                best_action = prev_action
                 # We prefer a max soc of 1.0 (normal operation) or 0.1 (prevent charge) before other values.
-                min_soc_percent = round(actions[slot].min_soc * 100)
+                min_soc_percent = round(action.min_soc * 100)
                 max_soc_percents = [
                     *range(min_soc_percent + OPTIMIZATION_SOC_STEP_PERCENT, 100, OPTIMIZATION_SOC_STEP_PERCENT),
                     min_soc_percent,
                     100,
                 ]
                 for max_soc_percent in max_soc_percents:
-                    max_soc = max_soc_percent / 100
-                    actions[slot].max_soc = max_soc
-                    new_result = self.run(segments, actions)
+                    plan[slot] = with_max_soc(prev_action, max_soc_percent)
+                    new_result = simulator.evaluate(plan, slot, slot)
                     # Allow socs which result in the same score as the model to be used in preference
                     if not self.is_better(test_result, new_result, margin=margin):
                         test_result = new_result
-                        best_max_soc = max_soc
+                        best_action = plan[slot]
 
-                changed = changed or prev_max_soc != best_max_soc
-                actions[slot].max_soc = best_max_soc
+                changed = changed or prev_action != best_action
+                plan[slot] = best_action
                 segments[slot].generation = prev_generation
-                best_result_ever = self.run(segments, actions)
+                best_result_ever = simulator.reset(plan)
 
         # When we optimize charge periods, we need to do all actions in a period at the same time,
         # otherwise there's no advantage in just reducing the soc of the first.
@@ -635,38 +1159,90 @@ class BatteryModel:
         # parts separately
         start_of_charge_periods = [
             i
-            for i in range(len(actions))
-            if actions[i].action_type == ActionType.CHARGE
+            for i in range(len(plan))
+            if ACTIONS[plan[i]].action_type == ActionType.CHARGE
             and (
                 i == 0
-                or actions[i - 1].action_type != ActionType.CHARGE
-                or actions[i - 1].max_soc != actions[i].max_soc
+                or ACTIONS[plan[i - 1]].action_type != ActionType.CHARGE
+                or ACTIONS[plan[i - 1]].max_soc != ACTIONS[plan[i]].max_soc
             )
         ]
+        # Charge and discharge slots above were changed without being re-simulated
+        simulator.reset(plan)
         for slot in start_of_charge_periods:
-            prev_max_soc = actions[slot].max_soc
-            actions_in_period = [actions[slot]]
-            for i in range(slot + 1, len(actions)):
-                if actions[i].action_type != ActionType.CHARGE or actions[slot].max_soc != prev_max_soc:
+            prev_max_soc = ACTIONS[plan[slot]].max_soc
+            slots_in_period = [slot]
+            for i in range(slot + 1, len(plan)):
+                if ACTIONS[plan[i]].action_type != ActionType.CHARGE or ACTIONS[plan[slot]].max_soc != prev_max_soc:
                     break
-                actions_in_period.append(actions[i])
+                slots_in_period.append(i)
 
             # We might want to tune this up *or* down a bit, as we're now working with smaller step size.
             # Therefore just search the whole space for the best.
-            best_max_soc = prev_max_soc
+            best_max_soc_percent = round(prev_max_soc * 100)
             for max_soc_percent in range(OPTIMIZATION_MIN_SOC_PERCENT, 101, OPTIMIZATION_SOC_STEP_PERCENT):
-                max_soc = max_soc_percent / 100
-                for action in actions_in_period:
-                    action.max_soc = max_soc
+                for i in slots_in_period:
+                    plan[i] = with_max_soc(plan[i], max_soc_percent)
 
-                new_result = self.run(segments, actions)
+                new_result = simulator.evaluate(plan, slot, slot + len(slots_in_period) - 1)
                 if self.is_better(new_result, best_result_ever, margin=margin):
                     best_result_ever = new_result
-                    best_max_soc = max_soc
+                    best_max_soc_percent = max_soc_percent
 
-            for action in actions_in_period:
-                action.max_soc = best_max_soc
+            for i in slots_in_period:
+                plan[i] = with_max_soc(plan[i], best_max_soc_percent)
+            simulator.evaluate(plan, slot, slot + len(slots_in_period) - 1)
+            simulator.accept()
 
-            changed = changed or best_max_soc != prev_max_soc
+            changed = changed or best_max_soc_percent / 100 != prev_max_soc
 
         return (changed, best_result_ever)
+
+
+def run_hillclimb_restart(
+    initial_battery: float,
+    segments: list[TimeSegment],
+    restart: int,
+    seed: int,
+    deadline: float | None,
+    max_runs: int | None,
+    initial_plan: Sequence[int] | None,
+    trace_convergence: bool,
+    score_cache: ScoreCache | None,
+    coarse_block_slots: int | None,
+    compress_segments: bool,
+    prune_dominated: bool,
+    terminal_value: float,
+) -> tuple[Plan, SimulationCounters, RestartStats, dict[str, PhaseStats]]:
+    """
+    Run a single hill climb restart. This is a module-level function so that it can be run in another process.
+
+    Returns the best plan found, the counters and stats for the restart, and the time spent in each phase.
+    """
+    battery_model = BatteryModel(initial_battery=initial_battery)
+    battery_model.score_cache = score_cache
+    battery_model.terminal_value = terminal_value
+    trace: list[float] | None = [] if trace_convergence else None
+    start_time = time.perf_counter()
+    best_result, best_plan, converged = battery_model.hillclimb_restart(
+        segments,
+        restart,
+        random.Random(seed),
+        deadline,
+        max_runs,
+        initial_plan,
+        trace,
+        coarse_block_slots,
+        compress_segments,
+        prune_dominated,
+    )
+    restart_stats = RestartStats(
+        restart=restart,
+        seeded=initial_plan is not None,
+        wall_time=time.perf_counter() - start_time,
+        runs=battery_model.counters.runs,
+        score=best_result,
+        converged=converged,
+        score_trace=trace,
+    )
+    return best_plan, battery_model.counters, restart_stats, battery_model.stats.phases
@@ -0,0 +1,53 @@
+from typing import Sequence
+
+from .action_table import CONTINUE_ACTION
+from .action_table import INITIAL_ACTION_INDEX
+from .action_table import Plan
+from .action_table import new_plan
+
+Move = tuple[int, int, int, int]
+"""
+(first_slot, last_slot, first_action, last_action): first_slot is changed to first_action, last_slot to last_action,
+and any slots in between to CONTINUE_ACTION. If first_slot == last_slot, last_action is ignored
+"""
+
+
+def apply_move(plan: Plan, move: Move) -> None:
+    first_slot, last_slot, first_action, last_action = move
+    plan[first_slot : last_slot + 1] = new_plan(last_slot - first_slot + 1)
+    plan[last_slot] = last_action
+    plan[first_slot] = first_action
+
+
+def change_point_moves(plan: Sequence[int], candidates: Sequence[Sequence[int]]) -> list[Move]:
+    """
+    Every move from the given plan, treating it as a list of change points: the slots which don't continue the
+    previous action. A move can:
+
+    - Change the action at a change point to any of that slot's candidates
+    - Insert a new change point using any of the slot's candidates, lasting just that slot. Shifting the change point
+      after it then makes it longer
+    - Delete a change point, so that the previous action carries on
+    - Shift a change point (with its action) earlier or later, up to the change points either side of it
+    """
+    moves: list[Move] = []
+    action = INITIAL_ACTION_INDEX
+    for slot, slot_candidates in enumerate(candidates):
+        if plan[slot] != CONTINUE_ACTION:
+            action = plan[slot]
+            moves.extend((slot, slot, x, x) for x in slot_candidates if x != action)
+        elif slot + 1 < len(plan) and plan[slot + 1] == CONTINUE_ACTION:
+            # The next slot needs to become a change point, to go back to the action which was in force
+            moves.extend((slot, slot + 1, x, action) for x in slot_candidates if x != action)
+        else:
+            moves.extend((slot, slot, x, x) for x in slot_candidates if x != action)
+
+    change_points = [slot for slot, action in enumerate(plan) if action != CONTINUE_ACTION]
+    for i, slot in enumerate(change_points):
+        action = plan[slot]
+        moves.append((slot, slot, CONTINUE_ACTION, CONTINUE_ACTION))
+        previous_slot = change_points[i - 1] if i > 0 else -1
+        moves.extend((new_slot, slot, action, CONTINUE_ACTION) for new_slot in range(previous_slot + 1, slot))
+        next_slot = change_points[i + 1] if i + 1 < len(change_points) else len(plan)
+        moves.extend((slot, new_slot, CONTINUE_ACTION, action) for new_slot in range(slot + 1, next_slot))
+    return moves
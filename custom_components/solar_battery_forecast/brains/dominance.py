@@ -0,0 +1,35 @@
+from typing import Sequence
+
+from .simulation import DISCHARGE_DISINCENTIVE
+from .simulation import ActionType
+from .simulation import TimeSegment
+
+
+def dominated_action_types(segments: Sequence[TimeSegment], terminal_value: float = 0.0) -> list[set[ActionType]]:
+    """
+    For each slot, the action types which can't do any better in that slot than self-use, so aren't worth trying:
+
+    - Charging, if there's no solar and the import tariff is higher than anything which a kWh in the battery could be
+      worth later (the most we'd otherwise pay to import it, or be paid to feed it in, or terminal_value if it's still
+      there at the end of the segments). With no solar, a charge to a
+      max soc which the battery is already above just holds the battery, which self-use with a 100% min soc does too.
+    - Discharging, if feeding in doesn't pay anything (after DISCHARGE_DISINCENTIVE) and there's nowhere later where
+      we'd be paid to import, so emptying the battery to make space for that isn't worth anything either.
+
+    This only looks at the slot itself: in the hill climb, an action also carries on into any following slots which
+    continue it.
+    """
+    dominated: list[set[ActionType]] = [set() for _ in segments]
+    # The most a kWh in the battery could be worth after the current slot, and whether we're paid to import later
+    later_value = terminal_value
+    later_negative_import = False
+    for slot in reversed(range(len(segments))):
+        segment = segments[slot]
+        if segment.generation == 0 and segment.import_tariff > later_value:
+            dominated[slot].add(ActionType.CHARGE)
+        if segment.feed_in_tariff - DISCHARGE_DISINCENTIVE <= 0 and not later_negative_import:
+            dominated[slot].add(ActionType.DISCHARGE)
+
+        later_value = max(later_value, segment.import_tariff, segment.feed_in_tariff - DISCHARGE_DISINCENTIVE)
+        later_negative_import = later_negative_import or segment.import_tariff < 0
+    return dominated
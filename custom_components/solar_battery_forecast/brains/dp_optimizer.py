@@ -0,0 +1,135 @@
+from array import array
+from typing import Sequence
+
+import numpy as np
+
+from .action_table import Plan
+from .action_table import index_of
+from .batch_simulator import FloatArray
+from .batch_simulator import IntArray
+from .batch_simulator import segment_costs_batch
+from .batch_simulator import simulate_segment_batch
+from .simulation import BATTERY_CAPACITY
+from .simulation import MIN_SOC_PERMITTED_PERCENT
+from .simulation import Action
+from .simulation import ActionType
+from .simulation import SimulationCounters
+from .simulation import TimeSegment
+from .simulation import simulate_segment
+
+DEFAULT_GRID_STEP_PERCENT = 1.0
+DEFAULT_SOC_STEP_PERCENT = 10
+
+# Interpolating the value function introduces a little noise, which shouldn't decide between two actions which are
+# really equally good
+TIE_TOLERANCE = 1e-6
+
+
+def candidate_actions(soc_step_percent: int = DEFAULT_SOC_STEP_PERCENT) -> list[Action]:
+    """
+    Every action which the optimizer may choose for a slot.
+
+    Ties are broken in favour of the earliest, so the simplest actions come first.
+    """
+    soc_percents = range(MIN_SOC_PERMITTED_PERCENT, 101, soc_step_percent)
+    actions = [Action(ActionType.SELF_USE, min_soc=x / 100, max_soc=1.0) for x in soc_percents]
+    # A low max soc stops the battery charging from solar, leaving space for a cheap charge period later
+    actions += [Action(ActionType.SELF_USE, min_soc=x / 100, max_soc=x / 100) for x in soc_percents if x != 100]
+    # No point having a min soc when charging
+    min_soc = MIN_SOC_PERMITTED_PERCENT / 100
+    actions += [Action(ActionType.CHARGE, min_soc=min_soc, max_soc=x / 100) for x in soc_percents]
+    # Don't allow a discharge down to 100%, as with the hill climb
+    actions += [Action(ActionType.DISCHARGE, min_soc=x / 100, max_soc=1.0) for x in soc_percents if x < 100]
+    return actions
+
+
+def optimize_dp(
+    segments: Sequence[TimeSegment],
+    initial_battery: float,
+    counters: SimulationCounters,
+    grid_step_percent: float = DEFAULT_GRID_STEP_PERCENT,
+    soc_step_percent: int = DEFAULT_SOC_STEP_PERCENT,
+    terminal_value: float = 0.0,
+) -> Plan:
+    """
+    Find the plan with the best score by dynamic programming over (slot, battery level).
+
+    The best achievable score from the start of each slot to the end of the horizon is calculated on a grid of battery
+    levels, grid_step_percent of the battery capacity apart, working backwards from the last slot. Battery levels
+    which fall between grid points are linearly interpolated. We then walk forwards from the actual initial battery
+    level, choosing the action in each slot which maximises the immediate score plus the best score from wherever that
+    leaves the battery, and tracking the battery level exactly.
+
+    Whatever is left in the battery at the end is worth terminal_value per kWh.
+    """
+    if grid_step_percent <= 0 or grid_step_percent > 100:
+        raise ValueError(f"Grid step must be between 0 and 100%, not {grid_step_percent}")
+
+    actions = candidate_actions(soc_step_percent)
+    # This also makes sure that soc_step_percent gives actions which can go in a plan
+    action_indices = [index_of(x) for x in actions]
+    action_types = np.array([x.action_type.value for x in actions], dtype=np.int16)
+    min_socs: FloatArray = np.array([x.min_soc for x in actions])
+    max_socs: FloatArray = np.array([x.max_soc for x in actions])
+
+    num_levels = round(100 / grid_step_percent) + 1
+    levels: FloatArray = np.linspace(0, BATTERY_CAPACITY, num_levels)
+
+    # Every (level, action) pair, level-major, so that the scores reshape to (num_levels, num_actions)
+    grid_battery_levels: FloatArray = np.repeat(levels, len(actions))
+    grid_action_types = np.tile(action_types, num_levels)
+    grid_min_socs: FloatArray = np.tile(min_socs, num_levels)
+    grid_max_socs: FloatArray = np.tile(max_socs, num_levels)
+
+    # values[slot][i] is the best score achievable from the start of slot, with the battery at levels[i]
+    values: list[FloatArray] = [levels * terminal_value] * (len(segments) + 1)
+    for slot in reversed(range(len(segments))):
+        scores = _score_actions(
+            segments[slot],
+            grid_action_types,
+            grid_min_socs,
+            grid_max_socs,
+            grid_battery_levels,
+            levels,
+            values[slot + 1],
+        )
+        values[slot] = scores.reshape(num_levels, len(actions)).max(axis=1)
+        counters.segments_simulated += len(grid_battery_levels)
+
+    plan: Plan = array("h")
+    battery_level = initial_battery
+    for slot, segment in enumerate(segments):
+        scores = _score_actions(
+            segment,
+            action_types,
+            min_socs,
+            max_socs,
+            np.full(len(actions), battery_level),
+            levels,
+            values[slot + 1],
+        )
+        counters.segments_simulated += len(actions)
+        best = int(np.argmax(scores >= scores.max() - TIE_TOLERANCE))
+        plan.append(action_indices[best])
+        battery_level = simulate_segment(segment, actions[best], battery_level)[0]
+
+    return plan
+
+
+def _score_actions(
+    segment: TimeSegment,
+    action_types: IntArray,
+    min_socs: FloatArray,
+    max_socs: FloatArray,
+    battery_levels: FloatArray,
+    levels: FloatArray,
+    next_values: FloatArray,
+) -> FloatArray:
+    """The score of each action in this segment, plus the best score achievable after it"""
+    battery_discharge, inverter_output_ac = simulate_segment_batch(
+        segment, action_types, min_socs, max_socs, battery_levels
+    )
+    _, _, feed_in_cost, import_cost = segment_costs_batch(segment, inverter_output_ac)
+    next_battery_levels = battery_levels - battery_discharge
+    result: FloatArray = feed_in_cost - import_cost + np.interp(next_battery_levels, levels, next_values)
+    return result
@@ -0,0 +1,344 @@
+from array import array
+from typing import Sequence
+
+import numpy as np
+
+from .action_table import ACTIONS
+from .action_table import CONTINUE_ACTION
+from .action_table import INITIAL_ACTION_INDEX
+from .batch_simulator import FloatArray
+from .batch_simulator import SegmentBatch
+from .batch_simulator import segment_costs_batch
+from .batch_simulator import simulate_segments_batch
+from .change_points import Move
+from .score_cache import ACTION_KEY_SIZE
+from .score_cache import ACTION_KEYS
+from .score_cache import ScoreCache
+from .simulation import SimulationCounters
+from .simulation import TimeSegment
+from .simulation import plan_score
+from .simulation import simulate_segment
+from .transition_table import TransitionTable
+
+# ACTIONS, as arrays for simulate_segments_batch
+_ACTION_TYPES = np.array([x.action_type.value for x in ACTIONS], dtype=np.int16)
+_MIN_SOCS: FloatArray = np.array([x.min_soc for x in ACTIONS])
+_MAX_SOCS: FloatArray = np.array([x.max_soc for x in ACTIONS])
+
+
+class IncrementalSimulator:
+    """
+    Scores plans which differ from a base plan in a single contiguous block of slots, without re-simulating the whole
+    horizon.
+
+    The battery level, the action in force and the cumulative feed-in/import costs are cached at every slot boundary
+    of the base plan. A changed plan is simulated from the first changed slot, and as soon as (after the changed
+    block) its battery level and action in force match the base plan's again, the rest of the per-slot costs are taken
+    from the cache. They're summed in the same order as BatteryModel.run sums them, so the scores are identical.
+
+    Plans are given as indices into ACTIONS, so checking whether the action in force matches is just an int compare.
+
+    If a score_cache is given, evaluate() looks plans up in it before simulating them. It mustn't be used if the
+    segments are going to be changed. Plans which are really the same as the base plan are never simulated.
+
+    Likewise if a TransitionTable is given, segments are simulated using it rather than simulate_segment.
+
+    Scores include the value of the energy left in the battery at the end, at terminal_value per kWh (see plan_score).
+    """
+
+    def __init__(
+        self,
+        segments: Sequence[TimeSegment],
+        initial_battery: float,
+        counters: SimulationCounters,
+        score_cache: ScoreCache | None = None,
+        transitions: TransitionTable | None = None,
+        terminal_value: float = 0.0,
+    ) -> None:
+        self._segments = segments
+        self._initial_battery = initial_battery
+        self._counters = counters
+        self._score_cache = score_cache
+        self._transitions = transitions
+        self._segment_batch = SegmentBatch.from_segments(segments)
+        self._terminal_value = terminal_value
+
+        num_slots = len(segments)
+        # Index i holds the state at the start of slot i, where the action in force is the one carried over from the
+        # previous slot. Index num_slots is the end of the last slot
+        self._battery_levels = [0.0] * (num_slots + 1)
+        self._actions_in_force = [INITIAL_ACTION_INDEX] * (num_slots + 1)
+        self._feed_in_costs = [0.0] * (num_slots + 1)
+        self._import_costs = [0.0] * (num_slots + 1)
+        # Index i holds the costs incurred during slot i
+        self._slot_feed_in_costs = [0.0] * num_slots
+        self._slot_import_costs = [0.0] * num_slots
+        # The base plan's plan_key, which is _actions_in_force[1:]
+        self._base_key = b""
+
+        # The trajectory of the last plan to be simulated, from _pending_first_slot up to and including the slot
+        # boundary where it rejoined the base plan
+        self._pending_first_slot = 0
+        self._pending_states: list[tuple[float, int, float, float]] = []
+        self._pending_slot_costs: list[tuple[float, float]] = []
+        # If the last plan passed to evaluate() came from the cache, it still needs simulating before it can be accepted
+        self._unsimulated: tuple[Sequence[int], int, int | None] | None = None
+
+    def reset(self, plan: Sequence[int]) -> float:
+        """Simulate the whole of the given plan, and make it the base plan"""
+        self._counters.runs += 1
+        self._unsimulated = None
+        self._simulate(plan, 0, len(self._segments), self._initial_battery, INITIAL_ACTION_INDEX, 0.0, 0.0)
+        self.accept()
+        if self._score_cache is not None:
+            self._score_cache.put(self._base_key, self.score)
+        return self.score
+
+    @property
+    def score(self) -> float:
+        """The score of the base plan"""
+        return plan_score(
+            self._feed_in_costs[-1], self._import_costs[-1], self._battery_levels[-1], self._terminal_value
+        )
+
+    def evaluate(self, plan: Sequence[int], first_slot: int, last_slot: int | None = None) -> float:
+        """
+        Score a plan which is the same as the base plan, except for slots first_slot to last_slot inclusive.
+
+        If last_slot is None, anything from first_slot onwards might have changed.
+        """
+        self._counters.runs += 1
+        # A lot of the plans we're asked about just "change" a slot to the action it already had
+        if first_slot == last_slot:
+            action_change = plan[first_slot]
+            action = self._actions_in_force[first_slot] if action_change == CONTINUE_ACTION else action_change
+            if action == self._actions_in_force[first_slot + 1]:
+                self._counters.cache_hits += 1
+                self._unsimulated = (plan, first_slot, last_slot)
+                return self.score
+
+        key = b""
+        if self._score_cache is not None:
+            key = self._plan_key(plan, first_slot, last_slot)
+            score = self._score_cache.get(key)
+            if score is not None:
+                self._counters.cache_hits += 1
+                self._unsimulated = (plan, first_slot, last_slot)
+                return score
+            self._counters.cache_misses += 1
+
+        self._unsimulated = None
+        rejoined_slot = self._simulate_change(plan, first_slot, last_slot)
+        battery_level, _, feed_in_cost, import_cost = self._pending_states[-1]
+        for slot in range(rejoined_slot, len(self._segments)):
+            feed_in_cost += self._slot_feed_in_costs[slot]
+            import_cost += self._slot_import_costs[slot]
+        if rejoined_slot < len(self._segments):
+            battery_level = self._battery_levels[-1]
+
+        score = plan_score(feed_in_cost, import_cost, battery_level, self._terminal_value)
+        if self._score_cache is not None:
+            self._score_cache.put(key, score)
+        return score
+
+    def evaluate_best(self, plan: Sequence[int], moves: Sequence[Move]) -> tuple[int, float]:
+        """
+        Score the plans which each of the given moves would make from the given plan (which must be the base plan), and
+        return the index of the best move, along with its score. If several are equally good, the first one wins.
+
+        The scores are the same as evaluate() would give, but the plans are simulated together using numpy: each step
+        simulates the next slot of every plan which hasn't yet rejoined the base plan.
+        """
+        if len(moves) == 0:
+            raise ValueError("No moves to evaluate")
+        self._counters.runs += len(moves)
+        num_slots = len(self._segments)
+        slots = np.arange(num_slots)
+        move_array = np.array(moves, dtype=np.int64)
+        first_slots = move_array[:, 0]
+        last_slots = move_array[:, 1]
+        rows = np.arange(len(moves))
+
+        # The action in force in each slot of each plan. Before first_slot, that's the base plan's
+        base_actions = np.array(self._actions_in_force, dtype=np.int64)
+        plan_actions = np.broadcast_to(np.asarray(plan, dtype=np.int64), (len(moves), num_slots)).copy()
+        plan_actions[(slots >= first_slots[:, np.newaxis]) & (slots <= last_slots[:, np.newaxis])] = CONTINUE_ACTION
+        plan_actions[rows, last_slots] = move_array[:, 3]
+        plan_actions[rows, first_slots] = move_array[:, 2]
+        plan_actions = np.where(slots < first_slots[:, np.newaxis], base_actions[1:], plan_actions)
+        plan_actions[plan_actions[:, 0] == CONTINUE_ACTION, 0] = INITIAL_ACTION_INDEX
+        source_slots = np.maximum.accumulate(np.where(plan_actions != CONTINUE_ACTION, slots, 0), axis=1)
+        actions_in_force = plan_actions[rows[:, np.newaxis], source_slots]
+
+        base_battery_levels: FloatArray = np.array(self._battery_levels)
+        # With an extra slot at the end which costs nothing, for plans which have finished
+        base_slot_feed_in_costs: FloatArray = np.array([*self._slot_feed_in_costs, 0.0])
+        base_slot_import_costs: FloatArray = np.array([*self._slot_import_costs, 0.0])
+        battery_levels = base_battery_levels[first_slots]
+        feed_in_costs: FloatArray = np.array(self._feed_in_costs)[first_slots]
+        import_costs: FloatArray = np.array(self._import_costs)[first_slots]
+        diverged = rows
+        for step in range(num_slots - int(np.min(first_slots))):
+            # Once a plan has rejoined the base plan it has the base plan's costs for each slot, as in evaluate()
+            plan_slots = np.minimum(first_slots + step, num_slots)
+            slot_feed_in_costs = base_slot_feed_in_costs[plan_slots]
+            slot_import_costs = base_slot_import_costs[plan_slots]
+            if len(diverged) > 0:
+                diverged_slots = plan_slots[diverged]
+                segments = self._segment_batch.take(diverged_slots)
+                actions = actions_in_force[diverged, diverged_slots]
+                battery_discharge, inverter_output_ac = simulate_segments_batch(
+                    segments, _ACTION_TYPES[actions], _MIN_SOCS[actions], _MAX_SOCS[actions], battery_levels[diverged]
+                )
+                new_battery_levels = battery_levels[diverged] - battery_discharge
+                battery_levels[diverged] = new_battery_levels
+                _, _, slot_feed_in_costs[diverged], slot_import_costs[diverged] = segment_costs_batch(
+                    segments, inverter_output_ac
+                )
+                self._counters.segments_simulated += len(diverged)
+
+                next_slots = diverged_slots + 1
+                rejoined = (
+                    (last_slots[diverged] < next_slots)
+                    & (new_battery_levels == base_battery_levels[next_slots])
+                    & (actions == base_actions[next_slots])
+                )
+                # From here on, the battery does the same as in the base plan
+                battery_levels[diverged[rejoined]] = base_battery_levels[num_slots]
+                diverged = diverged[~rejoined & (next_slots < num_slots)]
+            feed_in_costs += slot_feed_in_costs
+            import_costs += slot_import_costs
+
+        # Python's round() doesn't always agree with numpy's, so only use numpy to rule out plans which can't be the
+        # best: rounding moves each score by at most 0.015
+        unrounded_scores = feed_in_costs - import_costs + battery_levels * self._terminal_value
+        contenders = np.flatnonzero(unrounded_scores >= np.max(unrounded_scores) - 0.031)
+        scores = [
+            plan_score(feed_in_cost, import_cost, battery_level, self._terminal_value)
+            for feed_in_cost, import_cost, battery_level in zip(
+                feed_in_costs[contenders].tolist(),
+                import_costs[contenders].tolist(),
+                battery_levels[contenders].tolist(),
+                strict=True,
+            )
+        ]
+        best = max(range(len(scores)), key=scores.__getitem__)
+        return int(contenders[best]), scores[best]
+
+    def accept(self) -> None:
+        """Make the plan which was last passed to evaluate() the new base plan. It mustn't have changed since"""
+        if self._unsimulated is not None:
+            self._simulate_change(*self._unsimulated)
+            self._unsimulated = None
+
+        first_slot = self._pending_first_slot
+        for offset, (battery_level, action, feed_in_cost, import_cost) in enumerate(self._pending_states):
+            slot = first_slot + offset
+            self._battery_levels[slot] = battery_level
+            self._actions_in_force[slot] = action
+            self._feed_in_costs[slot] = feed_in_cost
+            self._import_costs[slot] = import_cost
+        for offset, (feed_in_cost, import_cost) in enumerate(self._pending_slot_costs):
+            self._slot_feed_in_costs[first_slot + offset] = feed_in_cost
+            self._slot_import_costs[first_slot + offset] = import_cost
+
+        # The trajectory after the rejoin point is unchanged, but the cumulative costs need to be re-summed
+        rejoined_slot = first_slot + len(self._pending_slot_costs)
+        feed_in_cost = self._feed_in_costs[rejoined_slot]
+        import_cost = self._import_costs[rejoined_slot]
+        for slot in range(rejoined_slot, len(self._segments)):
+            feed_in_cost += self._slot_feed_in_costs[slot]
+            import_cost += self._slot_import_costs[slot]
+            self._feed_in_costs[slot + 1] = feed_in_cost
+            self._import_costs[slot + 1] = import_cost
+
+        if self._score_cache is not None:
+            self._base_key = array("h", self._actions_in_force[1:]).tobytes()
+
+    def _plan_key(self, plan: Sequence[int], first_slot: int, last_slot: int | None) -> bytes:
+        """plan_key(plan), where plan is the base plan except for slots first_slot to last_slot inclusive"""
+        num_slots = len(self._segments)
+        end_slot = num_slots if last_slot is None else last_slot + 1
+        actions_in_force = self._actions_in_force
+        action = actions_in_force[first_slot]
+        base_key = self._base_key
+        key_parts = [base_key[: first_slot * ACTION_KEY_SIZE]]
+        slot = first_slot
+        # As in _simulate, once we're doing the same as the base plan again nothing else is going to change
+        while slot < num_slots:
+            action_change = plan[slot]
+            if slot >= end_slot and (action_change != CONTINUE_ACTION or action == actions_in_force[slot]):
+                break
+            if action_change != CONTINUE_ACTION:
+                action = action_change
+            key_parts.append(ACTION_KEYS[action])
+            slot += 1
+        key_parts.append(base_key[slot * ACTION_KEY_SIZE :])
+        return b"".join(key_parts)
+
+    def _simulate_change(self, plan: Sequence[int], first_slot: int, last_slot: int | None) -> int:
+        return self._simulate(
+            plan,
+            first_slot,
+            len(self._segments) if last_slot is None else last_slot + 1,
+            self._battery_levels[first_slot],
+            self._actions_in_force[first_slot],
+            self._feed_in_costs[first_slot],
+            self._import_costs[first_slot],
+        )
+
+    def _simulate(
+        self,
+        plan: Sequence[int],
+        first_slot: int,
+        rejoin_from_slot: int,
+        battery_level: float,
+        action: int,
+        feed_in_cost: float,
+        import_cost: float,
+    ) -> int:
+        """
+        Simulate from first_slot until we rejoin the base plan (which can only happen from rejoin_from_slot), or reach
+        the end. Returns the slot where we rejoined, or num_slots.
+        """
+        segments = self._segments
+        battery_levels = self._battery_levels
+        actions_in_force = self._actions_in_force
+        actions = ACTIONS
+        transitions = self._transitions
+        pending_states = self._pending_states
+        pending_slot_costs = self._pending_slot_costs
+        pending_states.clear()
+        pending_slot_costs.clear()
+        self._pending_first_slot = first_slot
+
+        slot = first_slot
+        num_slots = len(segments)
+        while slot < num_slots:
+            action_change = plan[slot]
+            # If we're at the same battery level as the base plan, and from here on we'll be doing the same thing as
+            # it, then nothing else is going to change
+            if (
+                slot >= rejoin_from_slot
+                and battery_level == battery_levels[slot]
+                and (action_change != CONTINUE_ACTION or action == actions_in_force[slot])
+            ):
+                break
+
+            pending_states.append((battery_level, action, feed_in_cost, import_cost))
+            if action_change != CONTINUE_ACTION:
+                action = action_change
+            if transitions is not None:
+                battery_level, this_feed_in_cost, this_import_cost = transitions.get(slot, action)(battery_level)
+            else:
+                battery_level, _, _, this_feed_in_cost, this_import_cost = simulate_segment(
+                    segments[slot], actions[action], battery_level
+                )
+            feed_in_cost += this_feed_in_cost
+            import_cost += this_import_cost
+            pending_slot_costs.append((this_feed_in_cost, this_import_cost))
+            slot += 1
+
+        pending_states.append((battery_level, action, feed_in_cost, import_cost))
+        self._counters.segments_simulated += slot - first_slot
+        return slot
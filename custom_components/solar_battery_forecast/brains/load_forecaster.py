@@ -1,23 +1,94 @@
 import logging
+import time
+from dataclasses import dataclass
+from datetime import date
 from datetime import timedelta
 from math import floor
+from math import sqrt
+from typing import Any
 
 import numpy as np
+import numpy.typing as npt
 import pandas as pd
+from statsmodels.tsa.api import STL
 from statsmodels.tsa.api import STLForecast
+from statsmodels.tsa.forecasting.stl import STLForecastResults
+from statsmodels.tsa.seasonal import DecomposeResult
 from statsmodels.tsa.statespace.sarimax import SARIMAX
 
 TRAIN_PERIOD = timedelta(weeks=4)
 PREDICTION_PERIOD = timedelta(days=2)  # TODO: This is strongly tied to the implementation of BatteryModel currently
 
+# If the one-step-ahead errors since the last full fit have a mean this many standard errors away from 0, the fit no
+# longer describes the data, so a full fit is done early
+RESIDUAL_DRIFT_THRESHOLD = 3.0
+
 _LOGGER = logging.getLogger(__name__)
 
 
+@dataclass
+class LoadForecastStats:
+    update: str = ""
+    """
+    How the fit was brought up to date: "full_fit", "append", or "restored" (a saved fit, used as it is). Empty if there
+    was no forecast
+    """
+
+    warm_start: bool = False
+    """Whether the full fit started from the previous fit's parameters, rather than the defaults"""
+
+    iterations: int = 0
+    """Number of optimizer iterations in the full fit"""
+
+    fit_time: float = 0.0
+    """Seconds spent in the full fit"""
+
+    wall_time: float = 0.0
+
+
 class LoadForecaster:
+    """
+    A full fit is done for the first forecast of each day. Later forecasts that day append the new observations to
+    that fit, keeping its parameters and seasonal shape, which is much cheaper than fitting again.
+
+    The last full fit's parameters can be saved with fit_to_dict, and given to a new forecaster (e.g. after a restart)
+    with restore_fit. If they're from the same day, they're used as they are. Otherwise, like the parameters of any
+    earlier fit, they're where the next full fit starts from.
+    """
+
     def __init__(self) -> None:
         self._order = (2, 1, 1)
+        self._model_kwargs = {"order": self._order, "enforce_invertibility": False, "enforce_stationarity": False}
+        # The last full fit, with any observations appended since
+        self._results: STLForecastResults | None = None
+        # Number of observations in the last full fit, and the day of the first forecast it was used for
+        self._fit_nobs = 0
+        self._fit_day: date | None = None
+        # Parameters of the last full fit, or of one restored by restore_fit
+        self._params: npt.NDArray[np.float64] | None = None
+        # From the last call to predict
+        self.stats = LoadForecastStats()
+
+    def fit_to_dict(self) -> dict[str, Any] | None:
+        """A JSON-serializable form of the last full fit's parameters, which restore_fit can read"""
+        if self._params is None or self._fit_day is None:
+            return None
+        return {"order": list(self._order), "fit_day": self._fit_day.isoformat(), "params": self._params.tolist()}
+
+    def restore_fit(self, data: dict[str, Any]) -> None:
+        """Start from a fit saved by fit_to_dict. Raises ValueError if it's not for the same model"""
+        params = np.array(data["params"], dtype=np.float64)
+        # AR and MA coefficients, and the variance
+        num_params = self._order[0] + self._order[2] + 1
+        if tuple(data["order"]) != self._order or params.shape != (num_params,):
+            raise ValueError(f"Saved fit is for a different model, of order {data['order']}")
+        self._results = None
+        self._fit_day = date.fromisoformat(data["fit_day"])
+        self._params = params
 
     def predict(self, df: pd.DataFrame) -> pd.DataFrame | None:
+        start_time = time.perf_counter()
+        self.stats = LoadForecastStats()
         if len(df) < 24:
             _LOGGER.warning("Unable to provide a forecast for %s hours of data. Please wait", len(df))
             return None
@@ -26,14 +97,35 @@ class LoadForecaster:
         df["value"] = df["value"].interpolate()
         df["value_log"] = np.log(df["value"] + 1)
         df = df.tail(floor(TRAIN_PERIOD.total_seconds() / 3600))
-        model = STLForecast(
-            df["value_log"],
-            SARIMAX,
-            model_kwargs={"order": self._order, "enforce_invertibility": False, "enforce_stationarity": False},
-        )
-        results = model.fit(fit_kwargs={"disp": False, "warn_convergence": False})
+        forecast_start = df.iloc[-1].name + pd.DateOffset(hours=1)  # type: ignore
+
+        forecast_day = forecast_start.date()
+        results = self._append(df["value_log"], forecast_day)
+        if results is not None:
+            self.stats.update = "append"
+        if results is None and self._results is None and self._params is not None and self._fit_day == forecast_day:
+            # Restored from a full fit earlier today, so its parameters can be used without estimating them again
+            results = self._filter(df["value_log"], self._params)
+            self._fit_nobs = len(df)
+            self.stats.update = "restored"
+        if results is None:
+            # The parameters change little from one fit to the next, so the last ones are a much better place for the
+            # optimizer to start from than the defaults
+            fit_start_time = time.perf_counter()
+            model = STLForecast(df["value_log"], SARIMAX, model_kwargs=self._model_kwargs)
+            results = model.fit(fit_kwargs={"start_params": self._params, "disp": False, "warn_convergence": False})
+            self.stats.update = "full_fit"
+            self.stats.warm_start = self._params is not None
+            self.stats.iterations = results.model_result.mle_retvals.get("iterations", 0)
+            self.stats.fit_time = time.perf_counter() - fit_start_time
+            self._fit_nobs = len(df)
+            self._fit_day = forecast_day
+            self._params = results.model_result.params.to_numpy()
+        self._results = results
+
         model_prediction = results.get_prediction(
-            start=df.iloc[-1].name + pd.DateOffset(hours=1), end=df.iloc[-1].name + PREDICTION_PERIOD  # type: ignore
+            start=forecast_start,
+            end=df.iloc[-1].name + PREDICTION_PERIOD,  # type: ignore
         )
         predicted_value: pd.DataFrame = np.exp(model_prediction.predicted_mean.rename("predicted").to_frame()) - 1
         confidence_interval: pd.DataFrame = np.exp(
@@ -43,4 +135,52 @@ class LoadForecaster:
             - 1
         )
         prediction = predicted_value.combine_first(confidence_interval)
+        self.stats.wall_time = time.perf_counter() - start_time
+        _LOGGER.debug("Load forecast: %s", self.stats)
         return prediction
+
+    def _filter(self, endog: "pd.Series[float]", params: npt.NDArray[np.float64]) -> STLForecastResults:
+        """The same as a full fit of endog which estimated these parameters, but without estimating them"""
+        stl = STL(endog)
+        decomposition = stl.fit()
+        model = SARIMAX(decomposition.trend + decomposition.resid, **self._model_kwargs)
+        return STLForecastResults(stl, decomposition, model, model.filter(params), endog)
+
+    def _append(self, endog: "pd.Series[float]", forecast_day: date) -> STLForecastResults | None:
+        """
+        The last fit, with any observations in endog since then appended. None if a full fit is needed instead: it's
+        a new day, endog doesn't carry on from what the last fit saw, or the fit has stopped describing the data
+        """
+        if self._results is None or forecast_day != self._fit_day:
+            return None
+
+        decomposition = self._results.result
+        observed = decomposition.observed
+        seen = endog[endog.index <= observed.index[-1]]
+        new = endog[endog.index > observed.index[-1]]
+        if len(seen) == 0 or not np.allclose(seen, observed.reindex(seen.index)):
+            return None
+        if len(new) == 0:
+            return self._results
+        if new.index[0] != observed.index[-1] + pd.Timedelta(hours=1):
+            return None
+
+        # Carry the last period's seasonal shape on, as the forecast does
+        seasonal = pd.Series(np.resize(decomposition.seasonal.iloc[-self._results.period :], len(new)), new.index)
+        model_result = self._results.model_result.append(new - seasonal, refit=False)
+
+        errors = model_result.resid.iloc[self._fit_nobs :]
+        drift = abs(errors.mean()) * sqrt(len(errors)) / sqrt(model_result.params["sigma2"])
+        if drift > RESIDUAL_DRIFT_THRESHOLD:
+            _LOGGER.debug("Refitting load forecast, as errors have drifted by %s standard errors", drift)
+            return None
+
+        decomposition = DecomposeResult(
+            pd.concat([observed, new]),
+            pd.concat([decomposition.seasonal, seasonal]),
+            pd.concat([decomposition.trend, new - seasonal]),
+            pd.concat([decomposition.resid, new * 0]),
+        )
+        return STLForecastResults(
+            self._results.stl, decomposition, model_result.model, model_result, decomposition.observed
+        )
@@ -0,0 +1,202 @@
+from array import array
+from dataclasses import dataclass
+from typing import Sequence
+
+import numpy as np
+from scipy.optimize import Bounds
+from scipy.optimize import LinearConstraint
+from scipy.optimize import milp
+
+from .action_table import ACTION_SOC_STEP_PERCENT
+from .action_table import INITIAL_ACTION_INDEX
+from .action_table import Plan
+from .action_table import action_index
+from .batch_simulator import FloatArray
+from .simulation import AC_TO_DC_EFFICIENCY
+from .simulation import BATTERY_CAPACITY
+from .simulation import DC_TO_AC_EFFICIENCY
+from .simulation import DISCHARGE_DISINCENTIVE
+from .simulation import INVERTER_POWER_PER_SEGMENT
+from .simulation import MIN_SOC_PERMITTED_PERCENT
+from .simulation import ActionType
+from .simulation import TimeSegment
+
+# The variables for each slot, in order. Energies are in kWh over the slot
+_BATTERY_LEVEL = 0  # At the end of the slot
+_SOLAR_TO_BATTERY = 1  # DC
+_GRID_TO_BATTERY = 2  # DC, through the inverter
+_BATTERY_DISCHARGE = 3  # DC, to the inverter
+_FEED_IN = 4  # AC
+_IMPORT = 5  # AC
+_IS_FEEDING_IN = 6  # Binary: stops the solver from importing and feeding in at the same time
+_IS_CHARGE = 7  # Binary: ActionType.CHARGE
+_IS_DISCHARGE = 8  # Binary: ActionType.DISCHARGE
+_NUM_VARS = 9
+
+# A tiny cost on moving energy in and out of the battery, so that when two plans are equally good the solver doesn't
+# cycle the battery for no reason
+_BATTERY_THROUGHPUT_COST = 1e-4
+
+# Flows smaller than this (in kWh) are treated as 0 when turning the solution into actions
+_FLOW_EPSILON = 1e-6
+
+_MAX_BATTERY_DISCHARGE = INVERTER_POWER_PER_SEGMENT / DC_TO_AC_EFFICIENCY
+_MAX_GRID_TO_BATTERY = INVERTER_POWER_PER_SEGMENT / AC_TO_DC_EFFICIENCY
+
+
+@dataclass
+class MilpSolution:
+    plan: Plan
+    predicted_score: float
+    """The score according to the linear model. The plan's score from BatteryModel.run will be a bit different"""
+
+    optimal: bool
+    """Whether the solver proved that the solution is optimal, rather than running out of time"""
+
+
+def optimize_milp(
+    segments: Sequence[TimeSegment],
+    initial_battery: float,
+    time_limit: float | None = None,
+    terminal_value: float = 0.0,
+) -> MilpSolution:
+    """
+    Find a plan by solving a mixed-integer linear program for the energy flows in each slot.
+
+    The battery level, and the energy flowing between solar, battery and grid in each slot, are continuous variables.
+    Binaries for the charge and discharge modes decide whether the battery may charge from the grid or feed in. This
+    is looser than simulate_segment (which e.g. always charges from solar first), so the flows are then turned into the
+    nearest actions on the ACTION_SOC_STEP_PERCENT grid, which the caller should score properly.
+
+    If the solver doesn't find a feasible solution within time_limit seconds, the plan just continues the initial
+    action. Whatever is left in the battery at the end is worth terminal_value per kWh.
+    """
+    num_slots = len(segments)
+    num_vars = num_slots * _NUM_VARS
+    if num_slots == 0:
+        return MilpSolution(array("h"), 0.0, optimal=True)
+
+    def var(slot: int, index: int) -> int:
+        return slot * _NUM_VARS + index
+
+    objective: FloatArray = np.zeros(num_vars)
+    lower: FloatArray = np.zeros(num_vars)
+    upper: FloatArray = np.full(num_vars, np.inf)
+    integrality = np.zeros(num_vars)
+    rows: list[tuple[dict[int, float], float, float]] = []
+
+    # We don't deliberately discharge below the min soc, but the battery might start below it
+    min_battery_level = min(initial_battery, BATTERY_CAPACITY * MIN_SOC_PERMITTED_PERCENT / 100)
+    for slot, segment in enumerate(segments):
+        # Big enough that it never limits how much we feed in or import
+        big_m = segment.generation + segment.consumption + 2 * INVERTER_POWER_PER_SEGMENT / DC_TO_AC_EFFICIENCY
+
+        # The solver minimizes, so costs are positive. As in simulate_segment, feeding in at a negative price is free
+        objective[var(slot, _FEED_IN)] = -max(0, segment.feed_in_tariff - DISCHARGE_DISINCENTIVE)
+        objective[var(slot, _IMPORT)] = segment.import_tariff
+        objective[var(slot, _SOLAR_TO_BATTERY)] = _BATTERY_THROUGHPUT_COST
+        objective[var(slot, _GRID_TO_BATTERY)] = _BATTERY_THROUGHPUT_COST
+        objective[var(slot, _BATTERY_DISCHARGE)] = _BATTERY_THROUGHPUT_COST
+
+        lower[var(slot, _BATTERY_LEVEL)] = min_battery_level
+        upper[var(slot, _BATTERY_LEVEL)] = BATTERY_CAPACITY
+        upper[var(slot, _SOLAR_TO_BATTERY)] = segment.generation
+        upper[var(slot, _GRID_TO_BATTERY)] = _MAX_GRID_TO_BATTERY
+        upper[var(slot, _BATTERY_DISCHARGE)] = _MAX_BATTERY_DISCHARGE
+        for index in (_IS_FEEDING_IN, _IS_CHARGE, _IS_DISCHARGE):
+            upper[var(slot, index)] = 1
+            integrality[var(slot, index)] = 1
+
+        # Battery level follows from the flows in and out of it
+        battery_level = {
+            var(slot, _BATTERY_LEVEL): 1.0,
+            var(slot, _SOLAR_TO_BATTERY): -1.0,
+            var(slot, _GRID_TO_BATTERY): -1.0,
+            var(slot, _BATTERY_DISCHARGE): 1.0,
+        }
+        if slot == 0:
+            rows.append((battery_level, initial_battery, initial_battery))
+        else:
+            rows.append(({**battery_level, var(slot - 1, _BATTERY_LEVEL): -1.0}, 0, 0))
+
+        # Whatever the inverter outputs, after the house has taken what it needs, is fed in (or made up by importing)
+        rows.append(
+            (
+                {
+                    var(slot, _FEED_IN): 1.0,
+                    var(slot, _IMPORT): -1.0,
+                    var(slot, _SOLAR_TO_BATTERY): DC_TO_AC_EFFICIENCY,
+                    var(slot, _BATTERY_DISCHARGE): -DC_TO_AC_EFFICIENCY,
+                    var(slot, _GRID_TO_BATTERY): AC_TO_DC_EFFICIENCY,
+                },
+                segment.generation * DC_TO_AC_EFFICIENCY - segment.consumption,
+                segment.generation * DC_TO_AC_EFFICIENCY - segment.consumption,
+            )
+        )
+        rows.append(({var(slot, _FEED_IN): 1.0, var(slot, _IS_FEEDING_IN): -big_m}, -np.inf, 0))
+        rows.append(({var(slot, _IMPORT): 1.0, var(slot, _IS_FEEDING_IN): big_m}, -np.inf, big_m))
+
+        # Only a charge can charge from the grid, and it doesn't discharge
+        rows.append(({var(slot, _GRID_TO_BATTERY): 1.0, var(slot, _IS_CHARGE): -_MAX_GRID_TO_BATTERY}, -np.inf, 0))
+        rows.append(
+            (
+                {var(slot, _BATTERY_DISCHARGE): 1.0, var(slot, _IS_CHARGE): _MAX_BATTERY_DISCHARGE},
+                -np.inf,
+                _MAX_BATTERY_DISCHARGE,
+            )
+        )
+        # Only a discharge can feed in more than the excess solar
+        excess_solar_ac = max(0, segment.generation * DC_TO_AC_EFFICIENCY - segment.consumption)
+        rows.append(({var(slot, _FEED_IN): 1.0, var(slot, _IS_DISCHARGE): -big_m}, -np.inf, excess_solar_ac))
+        rows.append(({var(slot, _IS_CHARGE): 1.0, var(slot, _IS_DISCHARGE): 1.0}, -np.inf, 1))
+
+    objective[var(num_slots - 1, _BATTERY_LEVEL)] -= terminal_value
+
+    matrix: FloatArray = np.zeros((len(rows), num_vars))
+    for row, (coefficients, _, _) in enumerate(rows):
+        for column, coefficient in coefficients.items():
+            matrix[row, column] = coefficient
+    constraints = LinearConstraint(matrix, [x[1] for x in rows], [x[2] for x in rows])
+
+    options = {} if time_limit is None else {"time_limit": time_limit}
+    result = milp(
+        objective, constraints=constraints, integrality=integrality, bounds=Bounds(lower, upper), options=options
+    )
+    if result.x is None:
+        return MilpSolution(array("h", [INITIAL_ACTION_INDEX]) * num_slots, 0.0, optimal=False)
+
+    solution: FloatArray = result.x.reshape(num_slots, _NUM_VARS)
+    plan = array("h", (_to_action(segment, flows) for segment, flows in zip(segments, solution, strict=True)))
+    return MilpSolution(plan, -float(result.fun), optimal=result.status == 0)
+
+
+def _soc_percent(battery_level: float, lowest: int, highest: int) -> int:
+    """The nearest soc on the ACTION_SOC_STEP_PERCENT grid to the given battery level, clamped to [lowest, highest]"""
+    percent = round(battery_level / BATTERY_CAPACITY * 100 / ACTION_SOC_STEP_PERCENT) * ACTION_SOC_STEP_PERCENT
+    return min(max(percent, lowest), highest)
+
+
+def _to_action(segment: TimeSegment, flows: FloatArray) -> int:
+    """The index of the action which comes closest to doing what the solver wanted in this slot"""
+    battery_level = float(flows[_BATTERY_LEVEL])
+    if flows[_IS_CHARGE] > 0.5 and flows[_GRID_TO_BATTERY] > _FLOW_EPSILON:
+        return action_index(
+            ActionType.CHARGE, MIN_SOC_PERMITTED_PERCENT, _soc_percent(battery_level, MIN_SOC_PERMITTED_PERCENT, 100)
+        )
+
+    excess_solar_dc = segment.generation - segment.consumption / DC_TO_AC_EFFICIENCY
+    excess_solar_ac = max(0, excess_solar_dc * DC_TO_AC_EFFICIENCY)
+    if flows[_IS_DISCHARGE] > 0.5 and flows[_FEED_IN] > excess_solar_ac + _FLOW_EPSILON:
+        # Don't allow a discharge down to 100%, as with the other engines
+        min_soc_percent = _soc_percent(battery_level, MIN_SOC_PERMITTED_PERCENT, 100 - ACTION_SOC_STEP_PERCENT)
+        return action_index(ActionType.DISCHARGE, min_soc_percent, 100)
+
+    # If the battery didn't take all of the excess solar it could, or didn't make up all of a shortfall that it could,
+    # stop it at the level the solver left it at
+    min_soc_percent = MIN_SOC_PERMITTED_PERCENT
+    max_soc_percent = 100
+    if excess_solar_dc > 0 and flows[_SOLAR_TO_BATTERY] < excess_solar_dc - _FLOW_EPSILON:
+        max_soc_percent = _soc_percent(battery_level, MIN_SOC_PERMITTED_PERCENT, 100)
+    elif excess_solar_dc < 0 and flows[_BATTERY_DISCHARGE] < -excess_solar_dc - _FLOW_EPSILON:
+        min_soc_percent = _soc_percent(battery_level, MIN_SOC_PERMITTED_PERCENT, 100)
+    return action_index(ActionType.SELF_USE, min_soc_percent, max_soc_percent)
@@ -0,0 +1,92 @@
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from dataclasses import field
+
+from .simulation import SimulationCounters
+
+
+@dataclass
+class PhaseStats:
+    wall_time: float = 0.0
+    """Seconds spent in this phase. For phases which run in parallel, this is summed across the workers"""
+
+    runs: int = 0
+    """Number of plans scored in this phase"""
+
+    def add(self, other: "PhaseStats") -> None:
+        self.wall_time += other.wall_time
+        self.runs += other.runs
+
+
+@dataclass
+class RestartStats:
+    restart: int
+    seeded: bool
+    """Whether this restart started from a seed plan, rather than a random one"""
+
+    wall_time: float
+    runs: int
+    score: float
+    converged: bool
+    score_trace: list[float] | None = None
+    """If convergence tracing was enabled, the score at the start of each iteration and at the end"""
+
+
+@dataclass
+class OptimizerStats:
+    engine: str = ""
+    wall_time: float = 0.0
+    runs: int = 0
+    segments_simulated: int = 0
+    cache_hits: int = 0
+    """Number of plans whose score was already known, so weren't simulated"""
+
+    cache_misses: int = 0
+    pruned: int = 0
+    """Number of plans which weren't scored, because they couldn't be any better than another plan"""
+
+    converged: bool = False
+    """Whether the optimization ran to completion, rather than being cut short by the budget"""
+
+    score: float = 0.0
+    """Score of the plan which the optimization found"""
+
+    phases: dict[str, PhaseStats] = field(default_factory=dict)
+    restarts: list[RestartStats] = field(default_factory=list)
+
+    @contextmanager
+    def phase(self, name: str, counters: SimulationCounters) -> Iterator[None]:
+        """Add the time taken and plans scored within the block to the given phase"""
+        start_time = time.perf_counter()
+        start_runs = counters.runs
+        try:
+            yield
+        finally:
+            self.add_phase(name, PhaseStats(time.perf_counter() - start_time, counters.runs - start_runs))
+
+    def add_phase(self, name: str, phase: PhaseStats) -> None:
+        self.phases.setdefault(name, PhaseStats()).add(phase)
+
+    def add_stage(self, name: str, other: "OptimizerStats") -> None:
+        """
+        Add the totals of another optimization which produced part of the same plan, e.g. its tail, as a phase. Its own
+        phases and restarts aren't kept.
+        """
+        self.wall_time += other.wall_time
+        self.runs += other.runs
+        self.segments_simulated += other.segments_simulated
+        self.cache_hits += other.cache_hits
+        self.cache_misses += other.cache_misses
+        self.pruned += other.pruned
+        self.converged = self.converged and other.converged
+        self.add_phase(name, PhaseStats(other.wall_time, other.runs))
+
+    def convergence_trace(self) -> list[dict[str, float]]:
+        """The score traces of all restarts, as one row per (restart, iteration), e.g. for pd.DataFrame"""
+        return [
+            {"restart": restart.restart, "iteration": iteration, "score": score}
+            for restart in self.restarts
+            for iteration, score in enumerate(restart.score_trace or [])
+        ]
@@ -0,0 +1,106 @@
+import math
+from array import array
+from collections import deque
+from typing import Any
+from typing import Iterable
+from typing import Sequence
+
+from .action_table import Plan
+from .simulation import TimeSegment
+
+DEFAULT_PLAN_LIBRARY_SIZE = 7 * 24
+
+# Fingerprints summarize the segments over periods of this many slots, which is enough to tell e.g. a cheap night or a
+# sunny afternoon from the rest of the day, while keeping the library small enough to store and search
+FINGERPRINT_PERIOD_SLOTS = 6
+
+# How many kWh of net load count as much as 1p of tariff when comparing fingerprints. Tariffs are typically tens of
+# pence, while each slot's net load is typically a few kWh at most
+TARIFF_SCALE = 0.1
+
+
+def fingerprint(segments: Sequence[TimeSegment]) -> list[float]:
+    """
+    A compact summary of the segments, for finding similar days: the mean import and feed-in tariffs, and the mean net
+    load (consumption less generation), over each period of FINGERPRINT_PERIOD_SLOTS slots
+    """
+    result: list[float] = []
+    for start in range(0, len(segments), FINGERPRINT_PERIOD_SLOTS):
+        period = segments[start : start + FINGERPRINT_PERIOD_SLOTS]
+        result.extend(
+            round(sum(x) / len(period), 2)
+            for x in (
+                (segment.import_tariff * TARIFF_SCALE for segment in period),
+                (segment.feed_in_tariff * TARIFF_SCALE for segment in period),
+                (segment.consumption - segment.generation for segment in period),
+            )
+        )
+    return result
+
+
+def fingerprint_size(num_slots: int) -> int:
+    """The length of the fingerprint of num_slots segments"""
+    return 3 * math.ceil(num_slots / FINGERPRINT_PERIOD_SLOTS)
+
+
+class PlanLibrary:
+    """
+    Recently optimized plans, by the fingerprint of the segments they were optimized for. Where tariffs repeat the same
+    shape every day (e.g. Flux or Go), the best plan for a similar day is usually close to the best plan now, so makes a
+    good place to start. When full, the oldest plan is dropped.
+    """
+
+    def __init__(
+        self, max_size: int = DEFAULT_PLAN_LIBRARY_SIZE, entries: Iterable[tuple[list[float], Plan]] = ()
+    ) -> None:
+        self.max_size = max_size
+        # (fingerprint, plan), oldest first
+        self._entries: deque[tuple[list[float], Plan]] = deque(entries, maxlen=max_size)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, segments: Sequence[TimeSegment], plan: Sequence[int]) -> None:
+        if len(plan) != len(segments):
+            raise ValueError(f"Plan has {len(plan)} slots, but there are {len(segments)} segments")
+        self._entries.append((fingerprint(segments), array("h", plan)))
+
+    def nearest(self, segments: Sequence[TimeSegment], count: int) -> list[Plan]:
+        """
+        Up to count plans which were optimized for the segments most like these, most similar first. Only plans with
+        the same number of slots are considered. Each is a copy, so can be modified.
+        """
+        target = fingerprint(segments)
+        # Later entries win ties, as they're more recent
+        matches = sorted(
+            (
+                (math.dist(target, entry_fingerprint), -i, plan)
+                for i, (entry_fingerprint, plan) in enumerate(self._entries)
+                if len(plan) == len(segments) and len(entry_fingerprint) == len(target)
+            ),
+            key=lambda x: x[:2],
+        )
+        return [array("h", plan) for _, _, plan in matches[:count]]
+
+    def to_dict(self) -> dict[str, Any]:
+        """A JSON-serializable form of the library, which from_dict can read"""
+        return {
+            "entries": [
+                {"fingerprint": entry_fingerprint, "plan": plan.tolist()} for entry_fingerprint, plan in self._entries
+            ]
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any], max_size: int = DEFAULT_PLAN_LIBRARY_SIZE) -> "PlanLibrary":
+        """
+        Read a library which to_dict wrote. Entries whose fingerprints aren't the right size for their plans (e.g. as
+        they were written by an older version, which fingerprinted every slot) are dropped
+        """
+        return cls(
+            max_size,
+            (
+                (list(x["fingerprint"]), array("h", x["plan"]))
+                for x in data["entries"]
+                if len(x["fingerprint"]) == fingerprint_size(len(x["plan"]))
+            ),
+        )
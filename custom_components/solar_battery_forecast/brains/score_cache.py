@@ -0,0 +1,54 @@
+from array import array
+from collections import OrderedDict
+from typing import Sequence
+
+from .action_table import ACTIONS
+from .action_table import CONTINUE_ACTION
+from .action_table import INITIAL_ACTION_INDEX
+
+DEFAULT_SCORE_CACHE_SIZE = 50_000
+
+# ACTION_KEYS[i] is how action i appears in a plan_key
+ACTION_KEYS = [array("h", [i]).tobytes() for i in range(len(ACTIONS))]
+ACTION_KEY_SIZE = len(ACTION_KEYS[0])
+
+
+def plan_key(plan: Sequence[int]) -> bytes:
+    """
+    A key which is the same for any two plans which do the same thing in every slot, whether they continue the
+    previous action or repeat it explicitly
+    """
+    effective_plan = array("h")
+    action = INITIAL_ACTION_INDEX
+    for action_change in plan:
+        if action_change != CONTINUE_ACTION:
+            action = action_change
+        effective_plan.append(action)
+    return effective_plan.tobytes()
+
+
+class ScoreCache:
+    """
+    The scores of recently-scored plans, by plan_key. When full, the least recently used score is dropped.
+
+    The scores are only valid for the segments they were calculated with, so a cache mustn't outlive an optimization.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_SCORE_CACHE_SIZE) -> None:
+        self.max_size = max_size
+        self._scores: OrderedDict[bytes, float] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def get(self, key: bytes) -> float | None:
+        score = self._scores.get(key)
+        if score is not None:
+            self._scores.move_to_end(key)
+        return score
+
+    def put(self, key: bytes, score: float) -> None:
+        """Add the score of a plan which has just been simulated"""
+        self._scores[key] = score
+        if len(self._scores) > self.max_size:
+            self._scores.popitem(last=False)
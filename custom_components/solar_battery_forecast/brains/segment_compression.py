@@ -0,0 +1,41 @@
+from typing import Sequence
+
+from .action_table import Plan
+from .action_table import new_plan
+from .simulation import DISCHARGE_DISINCENTIVE
+from .simulation import TimeSegment
+
+
+def group_equivalent_slots(segments: Sequence[TimeSegment]) -> list[tuple[int, int]]:
+    """
+    Group runs of neighbouring slots which the optimizer can treat as one, returning (first_slot, last_slot) for each
+    group, in order. Every slot is in exactly one group.
+
+    Slots are equivalent if they have no generation and the same tariffs, and feeding in pays less than importing costs
+    (e.g. most of the night). The only thing which changes between them is how much the house uses, so there's rarely
+    any reason to do something different in each.
+    """
+    groups: list[tuple[int, int]] = []
+    first_slot = 0
+    for slot in range(1, len(segments) + 1):
+        if slot == len(segments) or not _equivalent(segments[slot - 1], segments[slot]):
+            groups.append((first_slot, slot - 1))
+            first_slot = slot
+    return groups
+
+
+def _equivalent(x: TimeSegment, y: TimeSegment) -> bool:
+    return (
+        x.generation == 0
+        and y.generation == 0
+        and x.import_tariff == y.import_tariff
+        and x.feed_in_tariff == y.feed_in_tariff
+        # Otherwise it could be worth charging in one slot and discharging in the next, as fast as the inverter allows
+        and x.feed_in_tariff - DISCHARGE_DISINCENTIVE <= x.import_tariff
+    )
+
+
+def share_group_decisions(plan: Plan, groups: Sequence[tuple[int, int]]) -> None:
+    """Make every slot in each group carry on with the action of the group's first slot"""
+    for first_slot, last_slot in groups:
+        plan[first_slot + 1 : last_slot + 1] = new_plan(last_slot - first_slot)
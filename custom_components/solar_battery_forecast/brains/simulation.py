@@ -0,0 +1,198 @@
+from dataclasses import dataclass
+from dataclasses import field
+from enum import Enum
+
+
+class ActionType(Enum):
+    SELF_USE = 0
+    CHARGE = 1
+    DISCHARGE = 2
+
+
+@dataclass(frozen=True)
+class Action:
+    action_type: ActionType
+    min_soc: float
+    max_soc: float
+
+    def clone(self) -> "Action":
+        return Action(self.action_type, self.min_soc, self.max_soc)
+
+    def make_hash(self) -> int:
+        return hash((self.action_type, self.min_soc, self.max_soc))
+
+    def __repr__(self) -> str:
+        return f"Action({self.action_type}, {self.min_soc}, {self.max_soc})"
+
+
+@dataclass
+class TimeSegment:
+    generation: float
+    consumption: float
+    feed_in_tariff: float
+    import_tariff: float
+
+
+DISCHARGE_DISINCENTIVE = 2
+
+SEGMENT_LENGTH_HOURS = 1
+BATTERY_CAPACITY = 4.2
+
+AC_TO_DC_EFFICIENCY = 0.95
+DC_TO_AC_EFFICIENCY = 0.95
+
+INVERTER_POWER_PER_SEGMENT = 3 * SEGMENT_LENGTH_HOURS
+
+# TODO: These are currently unused
+EXPORT_LIMIT_PER_SEGMENT = 9999
+EXPORT_LIMIT_PER_SEGMENT_DC = EXPORT_LIMIT_PER_SEGMENT / DC_TO_AC_EFFICIENCY
+
+# Lowest that we can choose to discharge the battery to
+MIN_SOC_PERMITTED_PERCENT = 20
+
+INITIAL_ACTION = Action(ActionType.SELF_USE, min_soc=MIN_SOC_PERMITTED_PERCENT / 100, max_soc=1.0)
+
+
+@dataclass
+class RunOutputSegment:
+    battery_level: float
+    battery_soc: float
+    feed_in_kwh: float
+    import_kwh: float
+    feed_in_cost: float
+    cumulative_feed_in_cost: float
+    import_cost: float
+    cumulative_import_cost: float
+    cumulative_score: float
+
+
+@dataclass
+class RunOutput:
+    segments: list[RunOutputSegment] = field(default_factory=list)
+
+
+@dataclass
+class SimulationCounters:
+    runs: int = 0
+    """Number of plans which have been scored"""
+
+    segments_simulated: int = 0
+    """Number of segments which were actually simulated while scoring those plans"""
+
+    cache_hits: int = 0
+    """Number of those plans whose score was already known (e.g. from a ScoreCache), so weren't simulated"""
+
+    cache_misses: int = 0
+    """Number of those plans which were looked up in a ScoreCache, but weren't there"""
+
+    pruned: int = 0
+    """Number of plans which weren't scored at all, because they couldn't be any better than another plan"""
+
+    def add(self, other: "SimulationCounters") -> None:
+        self.runs += other.runs
+        self.segments_simulated += other.segments_simulated
+        self.cache_hits += other.cache_hits
+        self.cache_misses += other.cache_misses
+        self.pruned += other.pruned
+
+
+def plan_score(feed_in_cost: float, import_cost: float, battery_level: float, terminal_value: float = 0.0) -> float:
+    """
+    The score of a plan with these total costs, which leaves battery_level in the battery, each kWh of which is worth
+    terminal_value.
+
+    Each part is rounded, to avoid floating-point error saying that one result is better than another, when in fact
+    they're the same.
+    """
+    score = round(feed_in_cost, 2) - round(import_cost, 2)
+    if terminal_value != 0:
+        score += round(battery_level * terminal_value, 2)
+    return score
+
+
+def _clamp(val: float, lower: float, upper: float) -> float:
+    if val < lower:
+        return lower
+    if val > upper:
+        return upper
+    return val
+
+
+def simulate_segment(
+    segment: TimeSegment, action: Action, battery_level: float
+) -> tuple[float, float, float, float, float]:
+    """
+    Simulate a single segment, starting with the given battery level.
+
+    Returns (battery_level, feed_in_amount, import_amount, feed_in_cost, import_cost) for the end of the segment.
+    """
+    battery_discharge = 0.0
+    inverter_output_ac = 0.0
+
+    if action.action_type == ActionType.SELF_USE:
+        # If generation can cover consumption, excess goes into battery. Else excess comes from battery if
+        # available
+        if segment.generation > segment.consumption / DC_TO_AC_EFFICIENCY:
+            # Generation covers consumption: charge the battery and then export the rest
+            excess_solar_dc = segment.generation - segment.consumption / DC_TO_AC_EFFICIENCY
+            battery_discharge = -_clamp(BATTERY_CAPACITY * action.max_soc - battery_level, 0, excess_solar_dc)
+            # TODO: Export limit
+            inverter_output_ac = segment.consumption + (excess_solar_dc + battery_discharge) * DC_TO_AC_EFFICIENCY
+        else:
+            # Generation doesn't cover consumption: output all generation + some battery
+            required_energy_dc = segment.consumption / DC_TO_AC_EFFICIENCY - segment.generation
+            battery_discharge = _clamp(battery_level - BATTERY_CAPACITY * action.min_soc, 0, required_energy_dc)
+            inverter_output_ac = (segment.generation + battery_discharge) * DC_TO_AC_EFFICIENCY
+
+    elif action.action_type == ActionType.CHARGE:
+        # Solar goes to the battery if available
+        solar_to_battery = _clamp(BATTERY_CAPACITY * action.max_soc - battery_level, 0, segment.generation)
+        if solar_to_battery == segment.generation:
+            # Any remaining charge comes through the inverter
+            inverter_to_battery_dc = _clamp(
+                BATTERY_CAPACITY * action.max_soc - battery_level - solar_to_battery,
+                0,
+                INVERTER_POWER_PER_SEGMENT / AC_TO_DC_EFFICIENCY,
+            )
+            inverter_output_ac = -inverter_to_battery_dc * AC_TO_DC_EFFICIENCY
+        else:
+            # Any excess solar is output from the inverter
+            inverter_to_battery_dc = 0
+            inverter_output_ac = (segment.generation - solar_to_battery) * DC_TO_AC_EFFICIENCY
+        battery_discharge = -(solar_to_battery + inverter_to_battery_dc)
+
+    elif action.action_type == ActionType.DISCHARGE:
+        # The inverter exports at the set rate, using as much solar as possible, and the rest from battery.
+        # Load is taken from the exported energy, with the rest going to the grid
+        # TODO: Max export rate
+        inverter_max_export_dc = INVERTER_POWER_PER_SEGMENT / DC_TO_AC_EFFICIENCY
+        solar_to_inverter_export = min(segment.generation, inverter_max_export_dc)
+        # The battery dischages to make up the gap if possible. Any excess generation goes into the battery
+        if inverter_max_export_dc > solar_to_inverter_export:
+            battery_discharge = _clamp(
+                battery_level - BATTERY_CAPACITY * action.min_soc,
+                0,
+                inverter_max_export_dc - solar_to_inverter_export,
+            )
+        else:
+            battery_discharge = -_clamp(
+                BATTERY_CAPACITY * action.max_soc - battery_level,
+                0,
+                solar_to_inverter_export - inverter_max_export_dc,
+            )
+        inverter_output_ac = (solar_to_inverter_export + max(0, battery_discharge)) * DC_TO_AC_EFFICIENCY
+
+    battery_level -= battery_discharge
+    assert battery_level >= 0
+
+    if inverter_output_ac > segment.consumption:
+        feed_in_amount = inverter_output_ac - segment.consumption
+        import_amount = 0.0
+    else:
+        feed_in_amount = 0.0
+        import_amount = segment.consumption - inverter_output_ac
+
+    this_feed_in_cost = max(0, feed_in_amount * (segment.feed_in_tariff - DISCHARGE_DISINCENTIVE))
+    this_import_cost = import_amount * segment.import_tariff
+
+    return battery_level, feed_in_amount, import_amount, this_feed_in_cost, this_import_cost
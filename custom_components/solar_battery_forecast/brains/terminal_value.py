@@ -0,0 +1,43 @@
+import math
+from typing import Sequence
+
+from .simulation import AC_TO_DC_EFFICIENCY
+from .simulation import BATTERY_CAPACITY
+from .simulation import DC_TO_AC_EFFICIENCY
+from .simulation import DISCHARGE_DISINCENTIVE
+from .simulation import MIN_SOC_PERMITTED_PERCENT
+from .simulation import TimeSegment
+
+
+def terminal_battery_value(segments: Sequence[TimeSegment]) -> float:
+    """
+    Roughly what each kWh in the battery at the start of the given segments is worth (in the same units as the score),
+    so that a plan which stops before them doesn't end by emptying the battery for nothing.
+
+    A kWh in the battery covers the house's first shortfalls in solar, saving what they would have cost to import,
+    until the battery's usable capacity runs out. Alternatively it can be fed in. Either way, it's worth no more than
+    the cheapest way of refilling the battery before then instead: importing, or keeping excess solar rather than
+    feeding it in.
+    """
+    usable_capacity = BATTERY_CAPACITY * (100 - MIN_SOC_PERMITTED_PERCENT) / 100
+    used = 0.0
+    saved = 0.0
+    feed_in_value = 0.0
+    cheapest_refill = math.inf
+    for segment in segments:
+        feed_in_value = max(
+            feed_in_value, min((segment.feed_in_tariff - DISCHARGE_DISINCENTIVE) * DC_TO_AC_EFFICIENCY, cheapest_refill)
+        )
+        shortfall_dc = segment.consumption / DC_TO_AC_EFFICIENCY - segment.generation
+        cheapest_refill = min(cheapest_refill, segment.import_tariff / AC_TO_DC_EFFICIENCY)
+        if shortfall_dc < 0:
+            cheapest_refill = min(
+                cheapest_refill, max(0, segment.feed_in_tariff - DISCHARGE_DISINCENTIVE) * DC_TO_AC_EFFICIENCY
+            )
+        elif used < usable_capacity:
+            energy = min(shortfall_dc, usable_capacity - used)
+            saved += energy * min(segment.import_tariff * DC_TO_AC_EFFICIENCY, cheapest_refill)
+            used += energy
+
+    use_value = saved / used if used > 0 else 0.0
+    return max(use_value, feed_in_value, 0.0)
@@ -0,0 +1,164 @@
+from typing import Callable
+from typing import Sequence
+
+from .action_table import ACTIONS
+from .simulation import AC_TO_DC_EFFICIENCY
+from .simulation import BATTERY_CAPACITY
+from .simulation import DC_TO_AC_EFFICIENCY
+from .simulation import DISCHARGE_DISINCENTIVE
+from .simulation import INVERTER_POWER_PER_SEGMENT
+from .simulation import Action
+from .simulation import ActionType
+from .simulation import TimeSegment
+
+Transition = Callable[[float], tuple[float, float, float]]
+"""
+Simulates one segment under one action: takes the battery level at the start of the segment, and returns
+(battery_level, feed_in_cost, import_cost) at the end
+"""
+
+_INVERTER_MAX_CHARGE_DC = INVERTER_POWER_PER_SEGMENT / AC_TO_DC_EFFICIENCY
+
+
+def make_transition(segment: TimeSegment, action: Action) -> Transition:
+    """
+    Equivalent to simulate_segment for this segment and action, but cheaper to call.
+
+    Within a segment, the battery charges (or discharges) 1:1 with how far it is from a target, up to a limit, so the
+    battery level at the end, and the inverter output, are piecewise linear in the battery level at the start.
+    Everything which doesn't depend on the battery level is worked out here, and the rest is done with exactly the
+    same floating-point operations as simulate_segment, so the results are identical.
+    """
+    consumption = segment.consumption
+    generation = segment.generation
+    feed_in_rate = segment.feed_in_tariff - DISCHARGE_DISINCENTIVE
+    import_tariff = segment.import_tariff
+
+    if action.action_type == ActionType.SELF_USE:
+        if generation > consumption / DC_TO_AC_EFFICIENCY:
+            # Excess solar charges the battery up to max soc, and the rest is exported
+            excess_solar_dc = generation - consumption / DC_TO_AC_EFFICIENCY
+            max_level = BATTERY_CAPACITY * action.max_soc
+
+            def self_use_charge(battery_level: float) -> tuple[float, float, float]:
+                battery_charge = max_level - battery_level
+                if battery_charge < 0:
+                    battery_charge = 0
+                elif battery_charge > excess_solar_dc:
+                    battery_charge = excess_solar_dc
+                battery_discharge = -battery_charge
+                inverter_output_ac = consumption + (excess_solar_dc + battery_discharge) * DC_TO_AC_EFFICIENCY
+                battery_level -= battery_discharge
+                if inverter_output_ac > consumption:
+                    feed_in_cost = (inverter_output_ac - consumption) * feed_in_rate
+                    return battery_level, feed_in_cost if feed_in_cost > 0 else 0, 0.0
+                return battery_level, 0.0, (consumption - inverter_output_ac) * import_tariff
+
+            return self_use_charge
+
+        # The battery makes up the shortfall, down to min soc
+        return _make_discharge(
+            BATTERY_CAPACITY * action.min_soc,
+            consumption / DC_TO_AC_EFFICIENCY - generation,
+            generation,
+            consumption,
+            feed_in_rate,
+            import_tariff,
+        )
+
+    if action.action_type == ActionType.CHARGE:
+        max_level = BATTERY_CAPACITY * action.max_soc
+
+        def charge(battery_level: float) -> tuple[float, float, float]:
+            # Solar goes to the battery if available, then any remaining charge comes through the inverter
+            solar_to_battery = max_level - battery_level
+            if solar_to_battery < 0:
+                solar_to_battery = 0
+            elif solar_to_battery > generation:
+                solar_to_battery = generation
+            if solar_to_battery == generation:
+                inverter_to_battery_dc = max_level - battery_level - solar_to_battery
+                if inverter_to_battery_dc < 0:
+                    inverter_to_battery_dc = 0
+                elif inverter_to_battery_dc > _INVERTER_MAX_CHARGE_DC:
+                    inverter_to_battery_dc = _INVERTER_MAX_CHARGE_DC
+                inverter_output_ac = -inverter_to_battery_dc * AC_TO_DC_EFFICIENCY
+            else:
+                inverter_to_battery_dc = 0
+                inverter_output_ac = (generation - solar_to_battery) * DC_TO_AC_EFFICIENCY
+            battery_level -= -(solar_to_battery + inverter_to_battery_dc)
+            if inverter_output_ac > consumption:
+                feed_in_cost = (inverter_output_ac - consumption) * feed_in_rate
+                return battery_level, feed_in_cost if feed_in_cost > 0 else 0, 0.0
+            return battery_level, 0.0, (consumption - inverter_output_ac) * import_tariff
+
+        return charge
+
+    # Discharge: the inverter exports at its max rate, using as much solar as possible and the rest from the battery
+    inverter_max_export_dc = INVERTER_POWER_PER_SEGMENT / DC_TO_AC_EFFICIENCY
+    solar_to_inverter_export = min(generation, inverter_max_export_dc)
+    if inverter_max_export_dc > solar_to_inverter_export:
+        return _make_discharge(
+            BATTERY_CAPACITY * action.min_soc,
+            inverter_max_export_dc - solar_to_inverter_export,
+            solar_to_inverter_export,
+            consumption,
+            feed_in_rate,
+            import_tariff,
+        )
+
+    # Solar alone can export at the max rate. Any excess could go into the battery, but by definition there isn't any
+    inverter_output_ac = solar_to_inverter_export * DC_TO_AC_EFFICIENCY
+    if inverter_output_ac > consumption:
+        feed_in_cost = max(0, (inverter_output_ac - consumption) * feed_in_rate)
+        import_cost = 0.0
+    else:
+        feed_in_cost = 0.0
+        import_cost = (consumption - inverter_output_ac) * import_tariff
+
+    def discharge_from_solar(battery_level: float) -> tuple[float, float, float]:
+        return battery_level, feed_in_cost, import_cost
+
+    return discharge_from_solar
+
+
+def _make_discharge(
+    min_level: float,
+    max_discharge: float,
+    inverter_input: float,
+    consumption: float,
+    feed_in_rate: float,
+    import_tariff: float,
+) -> Transition:
+    def discharge(battery_level: float) -> tuple[float, float, float]:
+        battery_discharge = battery_level - min_level
+        if battery_discharge < 0:
+            battery_discharge = 0
+        elif battery_discharge > max_discharge:
+            battery_discharge = max_discharge
+        inverter_output_ac = (inverter_input + battery_discharge) * DC_TO_AC_EFFICIENCY
+        battery_level -= battery_discharge
+        if inverter_output_ac > consumption:
+            feed_in_cost = (inverter_output_ac - consumption) * feed_in_rate
+            return battery_level, feed_in_cost if feed_in_cost > 0 else 0, 0.0
+        return battery_level, 0.0, (consumption - inverter_output_ac) * import_tariff
+
+    return discharge
+
+
+class TransitionTable:
+    """
+    The Transition for each segment and action, made the first time it's needed.
+
+    The transitions are only valid for the segments as they were when they were made.
+    """
+
+    def __init__(self, segments: Sequence[TimeSegment]) -> None:
+        self._segments = segments
+        self._transitions: list[list[Transition | None]] = [[None] * len(ACTIONS) for _ in segments]
+
+    def get(self, slot: int, action: int) -> Transition:
+        transition = self._transitions[slot][action]
+        if transition is None:
+            transition = self._transitions[slot][action] = make_transition(self._segments[slot], ACTIONS[action])
+        return transition
@@ -2,19 +2,27 @@ import logging
 from datetime import datetime
 from datetime import timedelta
 from datetime import timezone
+from datetime import tzinfo
+from typing import Any
 from typing import Callable
 
 import pandas as pd
 from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import Event
 from homeassistant.core import HomeAssistant
 from homeassistant.helpers.event import async_track_time_change
+from homeassistant.helpers.storage import Store
 from homeassistant.util import dt
 
 from .brains import load_forecaster
-from .brains.battery_model import BATTERY_CAPACITY
-from .brains.battery_model import BatteryModel
-from .brains.battery_model import TimeSegment
-from .brains.load_forecaster import LoadForecaster
+from .brains.action_table import CONTINUE_ACTION
+from .brains.action_table import Plan
+from .brains.battery_model import NUM_LIBRARY_PLANS
+from .brains.plan_library import PlanLibrary
+from .brains.simulation import BATTERY_CAPACITY
+from .brains.simulation import TimeSegment
+from .const import DOMAIN
 from .data.data_source import DataSource
 from .data.hass_data_source import HassDataSource
 from .data.main_config import MainConfig
@@ -23,9 +31,25 @@ from .entities.entity_controller import EntityController
 from .entities.entity_controller import EntityControllerState
 from .entities.entity_controller import EntityControllerSubscriber
 from .entities.entity_controller import RateOverrides
+from .worker import Worker
+from .worker import WorkerError
 
 _LOGGER = logging.getLogger(__name__)
 
+# The model is run every hour, so mustn't be allowed to take too long on awkward days
+OPTIMIZER_TIME_BUDGET = timedelta(minutes=2)
+# The jobs which run in the worker process. Only it imports this module
+WORKER_JOBS_MODULE = f"{__package__}.worker_jobs"
+# Any job in the worker process which takes longer than this has probably got stuck, so is killed
+WORKER_TIMEOUT = OPTIMIZER_TIME_BUDGET + timedelta(minutes=3)
+
+PLAN_LIBRARY_STORAGE_VERSION = 1
+# The library changes every hour, so there's no need to write it out straight away
+PLAN_LIBRARY_SAVE_DELAY = timedelta(minutes=10)
+
+INITIAL_LOAD_FORECAST_STORAGE_VERSION = 1
+LOAD_FORECASTER_STORAGE_VERSION = 1
+
 CONFIG = MainConfig(
     load_power_sum_sensor="sensor.load_energy_today",
     soc_sensor="sensor.battery_soc",
@@ -47,17 +71,46 @@ class Controller(EntityController):
         self._unload: list[Callable[[], None]] = []
 
         self.data_source: DataSource = HassDataSource(hass, CONFIG, self._user_config)
-        self._load_forecaster = LoadForecaster()
+        # Forecasting and optimizing happen here, so that they don't hold the GIL in HA's process. The load forecasters
+        # live in the worker process too
+        self._worker = Worker(WORKER_JOBS_MODULE, timeout=WORKER_TIMEOUT.total_seconds())
 
         self._state = EntityControllerState()
         self._rate_overrides = RateOverrides()
 
+        # The last plan found by the battery model, and the time of its first slot. Used as a starting point next time
+        self._last_plan: Plan | None = None
+        self._last_plan_start: datetime | None = None
+        # Past plans, to start from on similar days. Loaded on first use, and kept across restarts
+        self._plan_library: PlanLibrary | None = None
+        self._plan_library_store: Store[dict[str, Any]] = Store(
+            hass, PLAN_LIBRARY_STORAGE_VERSION, f"{DOMAIN}.{config_entry.entry_id}.plan_library"
+        )
+        # The midnight that state.initial_load_forecast was made for. It's saved, so that a restart during the day
+        # doesn't have to make it again
+        self._initial_load_forecast_midnight: datetime | None = None
+        self._initial_load_forecast_store: Store[dict[str, Any]] = Store(
+            hass, INITIAL_LOAD_FORECAST_STORAGE_VERSION, f"{DOMAIN}.{config_entry.entry_id}.initial_load_forecast"
+        )
+        # The load forecaster's last full fit. It's saved, so that after a restart the forecaster doesn't have to fit
+        # from scratch
+        self._load_forecaster_fit: dict[str, Any] | None = None
+        self._load_forecaster_store: Store[dict[str, Any]] = Store(
+            hass, LOAD_FORECASTER_STORAGE_VERSION, f"{DOMAIN}.{config_entry.entry_id}.load_forecaster"
+        )
+
         async def _refresh(datetime: datetime) -> None:
             # Create a new initial forecast at midnight
             await self.load(datetime)
 
         self._unload.append(async_track_time_change(self._hass, _refresh, minute=5, second=0))
 
+        async def _stop(_event: Event) -> None:
+            # The worker process would otherwise stop HA from exiting
+            await self._worker.cancel()
+
+        self._unload.append(self._hass.bus.async_listen(EVENT_HOMEASSISTANT_STOP, _stop))
+
     @property
     def state(self) -> EntityControllerState:
         return self._state
@@ -106,24 +159,56 @@ class Controller(EntityController):
 
         self._state.load_today = None
         self._state.load_forecast = None
-        self._state.initial_load_forecast = None
+        self._state.load_forecast_stats = None
+        if self._initial_load_forecast_midnight != midnight:
+            self._state.initial_load_forecast = None
 
         is_midnight = now.hour == 0
         if load_history is not None:
             self._state.load_today = load_history[midnight:]  # type: ignore
 
-            self._state.load_forecast = await self._hass.async_add_executor_job(
-                self._load_forecaster.predict, load_history
-            )
+            load_history_to_midnight: pd.DataFrame | None = None
+            if not is_midnight and self._state.initial_load_forecast is None:
+                self._state.initial_load_forecast = await self._load_initial_load_forecast(midnight)
+                if self._state.initial_load_forecast is None:
+                    # If we never stored an initial forecast, re-calculate one from data up to midnight, alongside the
+                    # current forecast
+                    load_history_to_midnight = load_history.loc[: midnight - timedelta(hours=1)].copy()  # type: ignore
+
+            if self._load_forecaster_fit is None:
+                self._load_forecaster_fit = await self._load_forecaster_store.async_load()
+            try:
+                (
+                    self._state.load_forecast,
+                    initial_load_forecast,
+                    load_forecaster_fit,
+                    self._state.load_forecast_stats,
+                ) = await self._worker.run(
+                    "predict_load", load_history, load_history_to_midnight, self._load_forecaster_fit
+                )
+            except WorkerError:
+                _LOGGER.warning("Unable to forecast load", exc_info=True)
+                return
+            if load_forecaster_fit is not None and load_forecaster_fit != self._load_forecaster_fit:
+                self._load_forecaster_fit = load_forecaster_fit
+                await self._load_forecaster_store.async_save(load_forecaster_fit)
             if is_midnight:
-                self._state.initial_load_forecast = self._state.load_forecast
-            elif self._state.initial_load_forecast is None:
-                # If we never stored an initial forecast, re-calculate one from data up to midnight
-                load_history_to_midnight = load_history.loc[: midnight - timedelta(hours=1)].copy()  # type: ignore
-                self._state.initial_load_forecast = await self._hass.async_add_executor_job(
-                    self._load_forecaster.predict, load_history_to_midnight
+                initial_load_forecast = self._state.load_forecast
+            if initial_load_forecast is not None:
+                self._state.initial_load_forecast = initial_load_forecast
+                self._initial_load_forecast_midnight = midnight
+                await self._initial_load_forecast_store.async_save(
+                    {"midnight": midnight.isoformat(), "forecast": _serialize_forecast(initial_load_forecast)}
                 )
 
+    async def _load_initial_load_forecast(self, midnight: datetime) -> pd.DataFrame | None:
+        """The saved initial load forecast, if it was made for the given midnight"""
+        data = await self._initial_load_forecast_store.async_load()
+        if data is None or datetime.fromisoformat(data["midnight"]) != midnight:
+            return None
+        self._initial_load_forecast_midnight = midnight
+        return _deserialize_forecast(data["forecast"], midnight.tzinfo)
+
     async def _run_model(self, now: datetime) -> None:
         now = dt.as_local(now)
         is_midnight = now.hour == 0
@@ -147,6 +232,7 @@ class Controller(EntityController):
             )
             self._state.current_action = None
             self._state.battery_forecast = None
+            self._state.optimizer_stats = None
             if is_midnight:
                 self._state.initial_battery_forecast = None
             return
@@ -174,8 +260,33 @@ class Controller(EntityController):
         ]
 
         initial_battery = soc * BATTERY_CAPACITY / 100
-        battery_model = BatteryModel(initial_battery=initial_battery)
-        actions, outputs = await self._hass.async_add_executor_job(battery_model.shotgun_hillclimb, segments)
+        seed_plan = self._get_seed_plan(start, len(segments))
+        plan_library = await self._get_plan_library()
+        library_plans = plan_library.nearest(segments, NUM_LIBRARY_PLANS)
+        try:
+            actions, outputs, best_plan, optimizer_stats = await self._worker.run(
+                "optimize",
+                initial_battery,
+                OPTIMIZER_TIME_BUDGET.total_seconds(),
+                segments,
+                seed_plan,
+                library_plans,
+            )
+        except WorkerError:
+            _LOGGER.warning("Unable to run the battery model", exc_info=True)
+            self._state.current_action = None
+            self._state.battery_forecast = None
+            self._state.optimizer_stats = None
+            if is_midnight:
+                self._state.initial_battery_forecast = None
+            return
+        if not optimizer_stats.converged:
+            _LOGGER.warning("Battery model ran out of time, using the best plan found so far")
+        self._last_plan = best_plan
+        self._last_plan_start = start
+        plan_library.add(segments, best_plan)
+        self._plan_library_store.async_delay_save(plan_library.to_dict, PLAN_LIBRARY_SAVE_DELAY.total_seconds())
+        self._state.optimizer_stats = optimizer_stats
         self._state.current_action = actions[0]
 
         # The nth prediction is actually for the end of that hour. Translate by 1 to make it the prediction at the
@@ -187,12 +298,37 @@ class Controller(EntityController):
         if is_midnight:
             self._state.initial_battery_forecast = battery_forecast.iloc[:24]
 
+    async def _get_plan_library(self) -> PlanLibrary:
+        if self._plan_library is None:
+            data = await self._plan_library_store.async_load()
+            self._plan_library = PlanLibrary()
+            if data is not None:
+                try:
+                    self._plan_library = PlanLibrary.from_dict(data)
+                except (KeyError, TypeError, ValueError):
+                    _LOGGER.warning("Ignoring saved plan library, as it couldn't be read", exc_info=True)
+        return self._plan_library
+
+    def _get_seed_plan(self, start: datetime, num_slots: int) -> Plan | None:
+        """Get the last plan, shifted to begin at start. Slots past the end of the last plan continue its last action"""
+        if self._last_plan is None or self._last_plan_start is None:
+            return None
+
+        shift = round((start - self._last_plan_start) / timedelta(hours=1))
+        if shift < 0 or shift >= len(self._last_plan):
+            return None
+
+        seed_plan = self._last_plan[shift : shift + num_slots]
+        seed_plan.extend([CONTINUE_ACTION] * (num_slots - len(seed_plan)))
+        return seed_plan
+
     async def reload(self) -> None:
         await self.load(datetime.now(timezone.utc))
 
-    def unload(self) -> None:
+    async def unload(self) -> None:
         for u in self._unload:
             u()
+        await self._worker.cancel()
 
     def _update_entities(self) -> None:
         for entity in self._entities:
@@ -203,3 +339,12 @@ class Controller(EntityController):
 
     def unsubscribe(self, subscriber: EntityControllerSubscriber) -> None:
         self._entities.remove(subscriber)
+
+
+def _serialize_forecast(df: pd.DataFrame) -> dict[str, dict[str, float]]:
+    return {index.isoformat(): series.to_dict() for index, series in df.iterrows()}  # type: ignore
+
+
+def _deserialize_forecast(data: dict[str, dict[str, float]], tz: tzinfo | None) -> pd.DataFrame:
+    df = pd.DataFrame.from_dict({pd.Timestamp(k).tz_convert(tz): v for k, v in data.items()}, orient="index")
+    return df.asfreq("h")
@@ -12,3 +12,5 @@ class DiagnosticData(TypedDict):
     current_action: dict[str, Any] | None
     battery_forecast: dict[str, Any] | None
     initial_battery_forecast: dict[str, Any] | None
+    optimizer_stats: dict[str, Any] | None
+    load_forecast_stats: dict[str, Any] | None
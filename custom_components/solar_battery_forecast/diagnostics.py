@@ -1,3 +1,4 @@
+from dataclasses import asdict
 from typing import Any
 
 import pandas as pd
@@ -30,6 +31,8 @@ async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigE
         else None
     )
     current_action = vars(state.current_action) if state.current_action else None
+    optimizer_stats = asdict(state.optimizer_stats) if state.optimizer_stats else None
+    load_forecast_stats = asdict(state.load_forecast_stats) if state.load_forecast_stats else None
 
     data = DiagnosticData(
         soc=soc,
@@ -41,5 +44,7 @@ async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigE
         current_action=current_action,
         battery_forecast=serialize(state.battery_forecast),
         initial_battery_forecast=serialize(state.initial_battery_forecast),
+        optimizer_stats=optimizer_stats,
+        load_forecast_stats=load_forecast_stats,
     )
     return data  # type: ignore
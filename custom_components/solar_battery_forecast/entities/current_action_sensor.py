@@ -1,7 +1,7 @@
 from homeassistant.components.sensor import SensorEntity
 from homeassistant.const import Platform
 
-from ..brains.battery_model import ActionType
+from ..brains.simulation import ActionType
 from .entity_controller import EntityController
 from .entity_mixin import EntityMixin
 
@@ -8,7 +8,9 @@ from datetime import time
 import pandas as pd
 from homeassistant.config_entries import ConfigEntry
 
-from ..brains.battery_model import Action
+from ..brains.load_forecaster import LoadForecastStats
+from ..brains.optimizer_stats import OptimizerStats
+from ..brains.simulation import Action
 
 
 class EntityControllerSubscriber(ABC):
@@ -44,6 +46,12 @@ class EntityControllerState:
     initial_battery_forecast: pd.DataFrame | None = None
     """The battery forecast calculated at midnight"""
 
+    optimizer_stats: OptimizerStats | None = None
+    """Timings and counters from the last run of the battery model"""
+
+    load_forecast_stats: LoadForecastStats | None = None
+    """Timings and counters from the last load forecast"""
+
 
 def _midnight() -> time:
     return time(0, 0, 0)
@@ -0,0 +1,42 @@
+from homeassistant.components.sensor import SensorEntity
+from homeassistant.components.sensor.const import SensorDeviceClass
+from homeassistant.components.sensor.const import SensorStateClass
+from homeassistant.const import EntityCategory
+from homeassistant.const import Platform
+from homeassistant.const import UnitOfTime
+
+from .entity_controller import EntityController
+from .entity_mixin import EntityMixin
+
+
+class OptimizerStatsSensor(EntityMixin, SensorEntity):
+    """
+    How long the last battery model optimization took, with a summary as attributes. The breakdown by phase and restart
+    is only in the diagnostics, as it's too big to record every hour
+    """
+
+    def __init__(self, controller: EntityController) -> None:
+        self._controller = controller
+
+        self._key = "optimizer_stats"
+        self._attr_name = "Optimizer Stats"
+        self._attr_device_class = SensorDeviceClass.DURATION
+        self._attr_state_class = SensorStateClass.MEASUREMENT
+        self._attr_native_unit_of_measurement = UnitOfTime.SECONDS
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+        self.entity_id = self._get_entity_id(Platform.SENSOR)
+
+    def _update(self) -> None:
+        # Calculate these once, then cache
+        stats = self._controller.state.optimizer_stats
+        if stats is None:
+            self._attr_native_value = None
+            self._attr_extra_state_attributes = {}
+        else:
+            self._attr_native_value = round(stats.wall_time, 2)
+            self._attr_extra_state_attributes = {
+                "engine": stats.engine,
+                "runs": stats.runs,
+                "score": round(stats.score, 2),
+                "converged": stats.converged,
+            }
@@ -9,6 +9,7 @@ from .entities.battery_forecast_sensors import InitialBatteryForecastSensor
 from .entities.current_action_sensor import CurrentActionSensor
 from .entities.load_forecast_sensors import InitialLoadForecastSensor
 from .entities.load_forecast_sensors import LoadForecastSensor
+from .entities.optimizer_stats_sensor import OptimizerStatsSensor
 
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry, async_add_devices: AddEntitiesCallback) -> None:
@@ -21,5 +22,6 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry, async_add_d
             CurrentActionSensor(controller),
             BatteryForecastSensor(controller),
             InitialBatteryForecastSensor(controller),
+            OptimizerStatsSensor(controller),
         ]
     )
@@ -0,0 +1,168 @@
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import threading
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from typing import Any
+
+_LOGGER = logging.getLogger(__name__)
+
+# How long the worker process may take to start, in seconds, including importing everything
+WORKER_START_TIMEOUT = 60
+
+
+class WorkerError(Exception):
+    """
+    A job didn't finish, because it raised (which is the cause of this), timed out, was cancelled, or the worker
+    process died
+    """
+
+
+class Worker:
+    """
+    A long-lived process which runs CPU-bound jobs (forecasting and optimizing) one at a time, so that they don't hold
+    the GIL in HA's process. The jobs are the functions in jobs_module, which only the worker process imports, when it
+    starts. So the heavy imports (pandas, statsmodels, numpy) only happen once, and any state which the jobs keep stays
+    out of HA's process.
+
+    If a job takes longer than timeout seconds, or is cancelled, the process is killed, and a new one is started for
+    the next job. The same happens if the process dies. Any state which jobs keep in the process (e.g. the load
+    forecasters' fits) is lost when that happens.
+    """
+
+    def __init__(self, jobs_module: str, timeout: float | None = None) -> None:
+        self._jobs_module = jobs_module
+        self._timeout = timeout
+        self._process: BaseProcess | None = None
+        self._connection: Connection | None = None
+        # What the process sends back, as read from the connection by a thread of its own. If the process exits, the
+        # last message is the EOFError or OSError which that caused
+        self._messages: asyncio.Queue[Any] | None = None
+        # Jobs wait here for the one before them to finish
+        self._lock = asyncio.Lock()
+
+    async def run(self, job: str, *args: Any) -> Any:
+        """
+        Run the function called job in jobs_module with args in the worker process, and return what it returns. args
+        and the result must be picklable. If it raises, that's raised as the cause of a WorkerError
+        """
+        async with self._lock:
+            try:
+                connection = await self._start()
+                connection.send((job, args))
+                succeeded, result = await self._receive(self._timeout)
+            except TimeoutError:
+                await self.cancel()
+                raise WorkerError(f"{job} timed out") from None
+            except (EOFError, OSError) as e:
+                _LOGGER.warning("Worker process died while running %s", job)
+                await self.cancel()
+                raise WorkerError(f"Worker process died while running {job}") from e
+            except asyncio.CancelledError:
+                await self.cancel()
+                raise
+
+        if not succeeded:
+            raise WorkerError(f"{job} failed: {result!r}") from result
+        return result
+
+    async def cancel(self) -> None:
+        """Stop any job which is running, by killing the worker process. The next job starts a new one"""
+        process = self._process
+        self._process = None
+        # The reader thread closes the connection, once it sees the process has gone
+        self._connection = None
+        self._messages = None
+        if process is not None:
+            process.kill()
+            await asyncio.get_running_loop().run_in_executor(None, process.join)
+
+    async def _start(self) -> Connection:
+        if self._process is not None and self._connection is not None and self._process.is_alive():
+            return self._connection
+
+        await self.cancel()
+        # Use spawn rather than fork, as it isn't safe to fork HA's multi-threaded process
+        context = multiprocessing.get_context("spawn")
+        self._connection, child_connection = context.Pipe()
+        # This can't be a daemon process, as those can't start processes of their own. Whoever owns the worker needs to
+        # cancel it before exiting instead
+        self._process = context.Process(target=_worker_main, args=(child_connection, self._jobs_module))
+        self._process.start()
+        child_connection.close()
+        self._messages = asyncio.Queue()
+        threading.Thread(
+            target=_read_messages,
+            args=(self._connection, asyncio.get_running_loop(), self._messages),
+            name="solar_battery_forecast_worker_reader",
+            daemon=True,
+        ).start()
+        # Wait until it's ready, so that its imports don't count towards the first job's timeout
+        await self._receive(WORKER_START_TIMEOUT)
+        return self._connection
+
+    async def _receive(self, timeout: float | None) -> Any:
+        assert self._messages is not None
+        message = await asyncio.wait_for(self._messages.get(), timeout)
+        if isinstance(message, (EOFError, OSError)):
+            raise message
+        return message
+
+
+def _read_messages(connection: Connection, loop: asyncio.AbstractEventLoop, messages: asyncio.Queue[Any]) -> None:
+    """
+    Pass everything which the worker process sends to messages, until it exits, and then the error which that causes.
+    This runs in a thread of its own for each worker process, as recv blocks
+    """
+    with connection:
+        while True:
+            try:
+                message = connection.recv()
+            except (EOFError, OSError) as e:
+                message = e
+            try:
+                loop.call_soon_threadsafe(messages.put_nowait, message)
+            except RuntimeError:
+                # The event loop has been closed, so there's no one left to receive it
+                return
+            if isinstance(message, (EOFError, OSError)):
+                return
+
+
+def exit_with_parent() -> None:
+    """
+    Exit this process as soon as the process which started it does. Otherwise if the worker process is killed, the
+    processes which it started (which have no other way of knowing) are left behind
+    """
+    parent = multiprocessing.parent_process()
+    if parent is not None:
+
+        def watch() -> None:
+            parent.join()
+            os._exit(1)
+
+        threading.Thread(target=watch, daemon=True).start()
+
+
+def _worker_main(connection: Connection, jobs_module: str) -> None:
+    exit_with_parent()
+    jobs = importlib.import_module(jobs_module)
+    # Everything the jobs need has been imported, so we're ready
+    connection.send(None)
+    while True:
+        try:
+            job, args = connection.recv()
+        except EOFError:
+            return
+        try:
+            result: tuple[bool, Any] = (True, getattr(jobs, job)(*args))
+        except Exception as e:
+            result = (False, e)
+        try:
+            connection.send(result)
+        except Exception as e:
+            # E.g. an exception which can't be pickled
+            connection.send((False, WorkerError(f"Unable to return the result of {job}: {e!r}")))
@@ -0,0 +1,82 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
+from typing import Any
+from typing import Sequence
+
+import pandas as pd
+
+from .brains.action_table import Plan
+from .brains.battery_model import BatteryModel
+from .brains.load_forecaster import LoadForecaster
+from .brains.load_forecaster import LoadForecastStats
+from .brains.optimizer_stats import OptimizerStats
+from .brains.simulation import Action
+from .brains.simulation import RunOutput
+from .brains.simulation import TimeSegment
+from .worker import exit_with_parent
+
+# The jobs which the worker process runs. Only it imports this module, as the jobs keep their state here between calls
+
+_LOGGER = logging.getLogger(__name__)
+
+# The most processes which jobs run things on in parallel, so that the hill climb restarts don't take over a big machine
+MAX_PARALLEL_PROCESSES = 4
+
+_load_forecaster = LoadForecaster()
+
+
+@cache
+def _executor() -> ProcessPoolExecutor:
+    """Used to run things in parallel, e.g. the battery model's hill climb restarts"""
+    return ProcessPoolExecutor(
+        max_workers=min(os.cpu_count() or 1, MAX_PARALLEL_PROCESSES),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=exit_with_parent,
+    )
+
+
+def predict_load(
+    load_history: pd.DataFrame,
+    load_history_to_midnight: pd.DataFrame | None = None,
+    saved_fit: dict[str, Any] | None = None,
+) -> tuple[pd.DataFrame | None, pd.DataFrame | None, dict[str, Any] | None, LoadForecastStats]:
+    """
+    Predict load from load_history, using a LoadForecaster which keeps its fit between calls. If
+    load_history_to_midnight is given, also predict load from that, in parallel, with a fresh LoadForecaster.
+
+    If the LoadForecaster has no fit yet (e.g. the worker process has just started), it starts from saved_fit, a fit
+    which it returned earlier. Returns the predictions, its fit (to be saved), and its stats.
+    """
+    midnight_prediction = (
+        None
+        if load_history_to_midnight is None
+        else _executor().submit(LoadForecaster().predict, load_history_to_midnight)
+    )
+    if saved_fit is not None and _load_forecaster.fit_to_dict() is None:
+        try:
+            _load_forecaster.restore_fit(saved_fit)
+        except (KeyError, TypeError, ValueError):
+            _LOGGER.warning("Ignoring saved load forecaster fit, as it couldn't be read", exc_info=True)
+    prediction = _load_forecaster.predict(load_history)
+    return (
+        prediction,
+        None if midnight_prediction is None else midnight_prediction.result(),
+        _load_forecaster.fit_to_dict(),
+        _load_forecaster.stats,
+    )
+
+
+def optimize(
+    initial_battery: float,
+    time_budget: float,
+    segments: list[TimeSegment],
+    seed_plan: Sequence[int] | None,
+    library_plans: Sequence[Sequence[int]],
+) -> tuple[list[Action], RunOutput, Plan, OptimizerStats]:
+    """Run BatteryModel.optimize. Returns the actions and run output, and the model's best_plan and stats"""
+    battery_model = BatteryModel(initial_battery=initial_battery, executor=_executor(), time_budget=time_budget)
+    actions, outputs = battery_model.optimize(segments, seed_plan, library_plans)
+    return actions, outputs, battery_model.best_plan, battery_model.stats
@@ -0,0 +1,114 @@
+from dataclasses import dataclass
+
+from custom_components.solar_battery_forecast.brains.simulation import BATTERY_CAPACITY
+from custom_components.solar_battery_forecast.brains.simulation import TimeSegment
+
+
+@dataclass
+class Scenario:
+    name: str
+    initial_battery: float
+    segments: list[TimeSegment]
+    """48 hourly segments, starting at midnight"""
+
+
+# A typical household, in kWh per hour starting at midnight
+HOUSEHOLD_CONSUMPTION = [
+    0.2, 0.4, 0.2, 0.2, 0.2, 0.31, 0.25, 0.41, 0.32, 0.32, 0.29, 0.4,
+    0.57, 0.53, 0.82, 0.32, 0.32, 0.22, 0.11, 0.45, 0.2, 0.1, 0.2, 0.2,
+]  # fmt: skip
+
+# A sunny spring day on a ~4kWp array
+SPRING_GENERATION = [
+    0, 0, 0, 0, 0, 0, 0.05, 0.15, 0.72, 2.04, 2.33, 2.27,
+    2.35, 2.1, 1.94, 1.26, 0.75, 1.26, 0.11, 0.06, 0, 0, 0, 0,
+]  # fmt: skip
+
+# A clear midsummer day, where generation is limited by the inverter around midday
+SUMMER_GENERATION = [
+    0, 0, 0, 0, 0.02, 0.2, 0.6, 1.2, 1.9, 2.6, 3.1, 3.4,
+    3.5, 3.4, 3.1, 2.7, 2.1, 1.5, 0.9, 0.4, 0.1, 0.01, 0, 0,
+]  # fmt: skip
+
+# Heat pump and lighting push up winter consumption, especially in the morning and evening
+WINTER_CONSUMPTION = [
+    0.5, 0.45, 0.45, 0.45, 0.5, 0.7, 1.1, 1.3, 1.0, 0.8, 0.7, 0.7,
+    0.8, 0.7, 0.7, 0.8, 1.1, 1.4, 1.5, 1.3, 1.1, 0.9, 0.7, 0.6,
+]  # fmt: skip
+
+# An Agile day with a windy, sunny afternoon which pushes prices negative
+AGILE_IMPORT_TARIFF = [
+    14.2, 12.8, 11.5, 10.9, 11.3, 13.6, 17.9, 22.4, 19.8, 12.1, 4.3, -1.2,
+    -4.8, -6.5, -3.1, 2.2, 24.6, 33.8, 38.1, 29.5, 21.3, 18.7, 16.2, 14.9,
+]  # fmt: skip
+AGILE_FEED_IN_TARIFF = [
+    8.1, 7.4, 6.8, 6.5, 6.7, 7.8, 10.1, 12.6, 11.2, 7.0, 3.1, 0.6,
+    0.0, 0.0, 0.0, 1.9, 13.9, 18.8, 21.0, 16.5, 12.1, 10.7, 9.4, 8.6,
+]  # fmt: skip
+
+
+def _segments(
+    generation: list[float], consumption: list[float], import_tariff: list[float], feed_in_tariff: list[float]
+) -> list[TimeSegment]:
+    day = [
+        TimeSegment(generation=g, consumption=c, feed_in_tariff=f, import_tariff=i)
+        for g, c, f, i in zip(generation, consumption, feed_in_tariff, import_tariff, strict=True)
+    ]
+    return day + [TimeSegment(x.generation, x.consumption, x.feed_in_tariff, x.import_tariff) for x in day]
+
+
+def flux() -> Scenario:
+    # Octopus Flux: cheap from 02:00 to 05:00, with a high export rate from 16:00 to 19:00
+    import_tariff = [30.72] * 2 + [18.43] * 3 + [30.72] * 11 + [43.01] * 3 + [30.72] * 5
+    feed_in_tariff = [19.72] * 2 + [7.43] * 3 + [19.72] * 11 + [32.01] * 3 + [19.72] * 5
+    return Scenario(
+        "flux",
+        initial_battery=0.2 * BATTERY_CAPACITY,
+        segments=_segments(SPRING_GENERATION, HOUSEHOLD_CONSUMPTION, import_tariff, feed_in_tariff),
+    )
+
+
+def agile_negative() -> Scenario:
+    return Scenario(
+        "agile_negative",
+        initial_battery=0.5 * BATTERY_CAPACITY,
+        segments=_segments(SPRING_GENERATION, HOUSEHOLD_CONSUMPTION, AGILE_IMPORT_TARIFF, AGILE_FEED_IN_TARIFF),
+    )
+
+
+def go_cheap_night() -> Scenario:
+    # Octopus Go: cheap from 00:00 to 04:00, with a flat export rate
+    import_tariff = [8.5] * 4 + [29.5] * 20
+    feed_in_tariff = [15.0] * 24
+    generation = [x * 0.6 for x in SPRING_GENERATION]
+    return Scenario(
+        "go_cheap_night",
+        initial_battery=0.3 * BATTERY_CAPACITY,
+        segments=_segments(generation, HOUSEHOLD_CONSUMPTION, import_tariff, feed_in_tariff),
+    )
+
+
+def summer_high_solar() -> Scenario:
+    # Flat import and export rates: the battery can only help by soaking up solar for the evening
+    import_tariff = [27.0] * 24
+    feed_in_tariff = [15.0] * 24
+    return Scenario(
+        "summer_high_solar",
+        initial_battery=0.4 * BATTERY_CAPACITY,
+        segments=_segments(SUMMER_GENERATION, HOUSEHOLD_CONSUMPTION, import_tariff, feed_in_tariff),
+    )
+
+
+def winter_zero_solar() -> Scenario:
+    # Economy 7: cheap from 00:00 to 07:00, with nothing to export
+    import_tariff = [13.5] * 7 + [36.0] * 17
+    feed_in_tariff = [15.0] * 24
+    return Scenario(
+        "winter_zero_solar",
+        initial_battery=0.2 * BATTERY_CAPACITY,
+        segments=_segments([0.0] * 24, WINTER_CONSUMPTION, import_tariff, feed_in_tariff),
+    )
+
+
+def all_scenarios() -> list[Scenario]:
+    return [flux(), agile_negative(), go_cheap_night(), summer_high_solar(), winter_zero_solar()]
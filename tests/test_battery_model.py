@@ -1,109 +1,492 @@
+import logging
 import random
+from concurrent.futures import ProcessPoolExecutor
 
-from custom_components.solar_battery_forecast.brains.battery_model import Action
-from custom_components.solar_battery_forecast.brains.battery_model import ActionType
+import pytest
+
+from custom_components.solar_battery_forecast.brains.action_table import ACTIONS
+from custom_components.solar_battery_forecast.brains.action_table import CONTINUE_ACTION
+from custom_components.solar_battery_forecast.brains.action_table import INITIAL_ACTION_INDEX
+from custom_components.solar_battery_forecast.brains.action_table import index_of
+from custom_components.solar_battery_forecast.brains.action_table import plan_from_actions
+from custom_components.solar_battery_forecast.brains.action_table import plan_to_actions
+from custom_components.solar_battery_forecast.brains.batch_simulator import PlanBatch
 from custom_components.solar_battery_forecast.brains.battery_model import BatteryModel
-from custom_components.solar_battery_forecast.brains.battery_model import TimeSegment
+from custom_components.solar_battery_forecast.brains.battery_model import OptimizerEngine
+from custom_components.solar_battery_forecast.brains.change_points import apply_move
+from custom_components.solar_battery_forecast.brains.change_points import change_point_moves
+from custom_components.solar_battery_forecast.brains.dominance import dominated_action_types
+from custom_components.solar_battery_forecast.brains.incremental_simulator import IncrementalSimulator
+from custom_components.solar_battery_forecast.brains.plan_library import PlanLibrary
+from custom_components.solar_battery_forecast.brains.plan_library import fingerprint
+from custom_components.solar_battery_forecast.brains.plan_library import fingerprint_size
+from custom_components.solar_battery_forecast.brains.score_cache import ScoreCache
+from custom_components.solar_battery_forecast.brains.score_cache import plan_key
+from custom_components.solar_battery_forecast.brains.segment_compression import group_equivalent_slots
+from custom_components.solar_battery_forecast.brains.simulation import BATTERY_CAPACITY
+from custom_components.solar_battery_forecast.brains.simulation import Action
+from custom_components.solar_battery_forecast.brains.simulation import ActionType
+from custom_components.solar_battery_forecast.brains.simulation import RunOutput
+from custom_components.solar_battery_forecast.brains.simulation import SimulationCounters
+from custom_components.solar_battery_forecast.brains.simulation import TimeSegment
+from custom_components.solar_battery_forecast.brains.simulation import simulate_segment
+from custom_components.solar_battery_forecast.brains.terminal_value import terminal_battery_value
+from custom_components.solar_battery_forecast.brains.transition_table import TransitionTable
+from custom_components.solar_battery_forecast.brains.transition_table import make_transition
+from tests.scenarios import Scenario
+from tests.scenarios import all_scenarios
+from tests.scenarios import flux
+from tests.scenarios import go_cheap_night
 
 
 def test_flux() -> None:
-    consumption = [
-        0.2,
-        0.4,
-        0.2,
-        0.2,
-        0.2,
-        0.31,
-        0.25,
-        0.41,
-        0.32,
-        0.32,
-        0.29,
-        0.4,
-        0.57,
-        0.53,
-        0.82,
-        0.32,
-        0.32,
-        0.22,
-        0.11,
-        0.45,
-        0.2,
-        0.1,
-        0.2,
-        0.2,
-    ]
-    generation = [
-        0,
-        0,
-        0,
-        0,
-        0,
-        0,
-        0.05,
-        0.15,
-        0.72,
-        2.04,
-        2.33,
-        2.27,
-        2.35,
-        2.1,
-        1.94,
-        1.26,
-        0.75,
-        1.26,
-        0.11,
-        0.06,
-        0,
-        0,
-        0,
-        0,
+    scenario = flux()
+    model = BatteryModel(initial_battery=scenario.initial_battery, seed=1)
+    actions, output = model.shotgun_hillclimb(scenario.segments)
+
+    assert len(actions) == 24
+    assert len(output.segments) == len(scenario.segments)
+    # Charge in the cheap period, and only then
+    charge_slots = {i: x.max_soc for i, x in enumerate(actions) if x.action_type == ActionType.CHARGE}
+    assert charge_slots == {2: 0.4, 3: 0.4, 4: 0.4}
+
+
+def test_coarse_to_fine_flux() -> None:
+    scenario = flux()
+    fine_model = BatteryModel(initial_battery=scenario.initial_battery, seed=1)
+    fine_model.optimize(scenario.segments)
+    model = BatteryModel(initial_battery=scenario.initial_battery, seed=1, coarse_block_slots=6)
+    actions, _ = model.optimize(scenario.segments)
+
+    charge_slots = {i: x.max_soc for i, x in enumerate(actions) if x.action_type == ActionType.CHARGE}
+    assert charge_slots == {2: 0.4, 3: 0.4, 4: 0.4}
+    assert "coarse_ascent" in model.stats.phases
+    assert model.num_runs < fine_model.num_runs
+
+
+def test_group_equivalent_slots() -> None:
+    night = TimeSegment(generation=0, consumption=0.2, feed_in_tariff=5, import_tariff=10)
+    day = TimeSegment(generation=1, consumption=0.2, feed_in_tariff=5, import_tariff=10)
+    # It's worth charging and discharging within this group, so it can't share one decision
+    arbitrage = TimeSegment(generation=0, consumption=0.2, feed_in_tariff=15, import_tariff=10)
+    segments = [night, night, night, day, day, night, arbitrage, arbitrage]
+    assert group_equivalent_slots(segments) == [(0, 2), (3, 3), (4, 4), (5, 5), (6, 6), (7, 7)]
+
+
+def test_compressed_flux() -> None:
+    scenario = flux()
+    model = BatteryModel(initial_battery=scenario.initial_battery, seed=1, compress_segments=True)
+    actions, _ = model.optimize(scenario.segments)
+
+    # The cheap period is one group, so it's charged as one
+    charge_slots = {i: x.max_soc for i, x in enumerate(actions) if x.action_type == ActionType.CHARGE}
+    assert charge_slots == {2: 0.4, 3: 0.4, 4: 0.4}
+    assert CONTINUE_ACTION not in model.best_plan
+
+
+def test_hillclimb_restart_scores_its_plan() -> None:
+    # Coarse blocks and shared decisions both change the plan between the climb's levels
+    scenario = go_cheap_night()
+    model = BatteryModel(initial_battery=scenario.initial_battery, seed=1)
+    for restart in range(4):
+        score, plan, _ = model.hillclimb_restart(
+            scenario.segments, restart, random.Random(restart), coarse_block_slots=6, compress_segments=True
+        )
+        assert score == pytest.approx(model.run(scenario.segments, plan))
+
+
+def test_milp_flux() -> None:
+    scenario = flux()
+    model = BatteryModel(initial_battery=scenario.initial_battery, engine=OptimizerEngine.MILP)
+    actions, _ = model.optimize(scenario.segments)
+
+    assert model.stats.converged
+    charge_slots = {i: x.max_soc for i, x in enumerate(actions) if x.action_type == ActionType.CHARGE}
+    assert charge_slots == {2: 0.4, 3: 0.4, 4: 0.4}
+    assert any(x.action_type == ActionType.DISCHARGE for x in actions[16:19])
+
+
+def test_change_point_flux() -> None:
+    scenario = flux()
+    hill_climb_model = BatteryModel(initial_battery=scenario.initial_battery, seed=1)
+    hill_climb_model.optimize(scenario.segments)
+    model = BatteryModel(initial_battery=scenario.initial_battery, seed=1, engine=OptimizerEngine.CHANGE_POINT)
+    actions, _ = model.optimize(scenario.segments)
+
+    charge_slots = {i: x.max_soc for i, x in enumerate(actions) if x.action_type == ActionType.CHARGE}
+    assert charge_slots == {2: 0.4, 3: 0.4, 4: 0.4}
+    assert model.stats.converged
+    assert model.num_runs < hill_climb_model.num_runs / 4
+
+
+def test_horizon_flux() -> None:
+    scenario = flux()
+    full_model = BatteryModel(initial_battery=scenario.initial_battery, seed=1)
+    full_model.optimize(scenario.segments)
+    model = BatteryModel(initial_battery=scenario.initial_battery, seed=1, horizon_slots=24)
+    actions, output = model.optimize(scenario.segments)
+
+    assert len(actions) == 24
+    assert len(output.segments) == len(scenario.segments)
+    assert len(model.best_plan) == len(scenario.segments)
+    charge_slots = {i: x.max_soc for i, x in enumerate(actions) if x.action_type == ActionType.CHARGE}
+    assert charge_slots == {2: 0.4, 3: 0.4, 4: 0.4}
+    assert 0 < terminal_battery_value(scenario.segments[24:]) < max(x.import_tariff for x in scenario.segments)
+    assert model.terminal_value == 0
+    assert model.counters.segments_simulated < full_model.counters.segments_simulated / 2
+
+
+def cheap_slot_before_dear_day() -> Scenario:
+    # Charging in the one cheap slot at the end of the horizon only pays off during the day after it
+    import_tariff = [30.0] * 23 + [5.0] + [40.0] * 24
+    return Scenario(
+        "cheap_slot_before_dear_day",
+        initial_battery=0.2 * BATTERY_CAPACITY,
+        segments=[
+            TimeSegment(generation=0.0, consumption=1.0, feed_in_tariff=0.0, import_tariff=x) for x in import_tariff
+        ],
+    )
+
+
+@pytest.mark.parametrize("scenario", [*all_scenarios(), cheap_slot_before_dear_day()], ids=lambda x: x.name)
+def test_horizon_matches_full_optimization(scenario: Scenario) -> None:
+    full_model = BatteryModel(initial_battery=scenario.initial_battery, seed=1)
+    full_model.optimize(scenario.segments)
+    model = BatteryModel(initial_battery=scenario.initial_battery, seed=1, horizon_slots=24)
+    model.optimize(scenario.segments)
+
+    full_score = full_model.run(scenario.segments, full_model.best_plan)
+    score = model.run(scenario.segments, model.best_plan)
+    assert score >= full_score - 0.02 * abs(full_score)
+
+
+def test_horizon_splits_budget_between_chunks() -> None:
+    scenario = flux()
+    segments = scenario.segments + scenario.segments[:24]
+    model = BatteryModel(initial_battery=scenario.initial_battery, seed=1, horizon_slots=24, run_budget=3000)
+    actions, output = model.optimize(segments)
+
+    assert len(actions) == 24
+    assert len(output.segments) == len(model.best_plan) == len(segments)
+    # Each of the three chunks gets a third of the budget, so the two after the first take about twice as many runs
+    tail_runs = model.stats.phases["tail"].runs
+    assert tail_runs > 1.5 * (model.stats.runs - tail_runs)
+
+
+def random_segments(rng: random.Random, num_segments: int) -> list[TimeSegment]:
+    # Include generation above the inverter limit, so that every branch of the model gets exercised
+    return [
+        TimeSegment(
+            generation=rng.choice((0.0, rng.uniform(0, 1), rng.uniform(0, 5))),
+            consumption=rng.uniform(0.1, 2),
+            feed_in_tariff=rng.uniform(-5, 30),
+            import_tariff=rng.uniform(-5, 45),
+        )
+        for _ in range(num_segments)
     ]
-    import_tariff = [30.72] * 2 + [18.43] * 3 + [30.72] * 11 + [43.01] * 3 + [30.72] * 5
-    feed_in_tariff = [19.72] * 2 + [7.43] * 3 + [19.72] * 11 + [32.01] * 3 + [19.72] * 5
-
-    result = run(consumption, generation, import_tariff, feed_in_tariff)
-    expected = [
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.CHARGE, 0.2, 0.4),
-        Action(ActionType.CHARGE, 0.2, 0.4),
-        Action(ActionType.CHARGE, 0.2, 0.4),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
-        Action(ActionType.SELF_USE, 0.2, 1.0),
+
+
+def random_plan(rng: random.Random, num_segments: int) -> list[Action | None]:
+    return [
+        None
+        if rng.random() < 0.5
+        else Action(
+            rng.choice(list(ActionType)),
+            min_soc=rng.randrange(10, 101, 10) / 100,
+            max_soc=rng.randrange(10, 101, 10) / 100,
+        )
+        for _ in range(num_segments)
     ]
-    assert result == expected
 
 
-def run(
-    consumption: list[float], generation: list[float], import_tariff: list[float], feed_in_tariff: list[float]
-) -> list[Action]:
-    seed = random.randrange(2**32)
-    random.seed(seed)
-    print(f"Seed: {seed}")
-    model = BatteryModel()
-    model.debug = True
+def test_run_batch_matches_run() -> None:
+    rng = random.Random(1234)
+    segments = random_segments(rng, 48)
+    plans = [random_plan(rng, len(segments)) for _ in range(200)]
+    model = BatteryModel(initial_battery=2.1)
+
+    batch_outputs: list[RunOutput] = []
+    scores = model.run_batch(segments, PlanBatch.from_actions(plans), batch_outputs)
+
+    for plan, score, batch_output in zip(plans, scores, batch_outputs, strict=True):
+        output = RunOutput()
+        assert model.run(segments, plan_from_actions(plan), output) == score
+        assert output == batch_output
+
+
+@pytest.mark.parametrize("use_transitions", [False, True])
+def test_incremental_simulator_matches_run(use_transitions: bool) -> None:
+    rng = random.Random(5678)
+    segments = random_segments(rng, 48)
+    model = BatteryModel(initial_battery=2.1)
+    transitions = TransitionTable(segments) if use_transitions else None
+    simulator = IncrementalSimulator(segments, 2.1, SimulationCounters(), transitions=transitions)
+
+    plan = plan_from_actions(random_plan(rng, len(segments)))
+    assert simulator.reset(plan) == model.run(segments, plan)
+    for _ in range(500):
+        first_slot = rng.randrange(len(segments))
+        last_slot = min(first_slot + rng.randrange(4), len(segments) - 1)
+        old_plan = plan[:]
+        changed_plan = plan_from_actions(random_plan(rng, len(segments)))
+        plan[first_slot : last_slot + 1] = changed_plan[first_slot : last_slot + 1]
+
+        score = simulator.evaluate(plan, first_slot, last_slot)
+        assert score == model.run(segments, plan)
+        if rng.random() < 0.5:
+            simulator.accept()
+            assert simulator.score == score
+        else:
+            plan = old_plan
+
+
+def test_evaluate_best_matches_evaluate() -> None:
+    rng = random.Random(1357)
+    segments = random_segments(rng, 48)
+    simulator = IncrementalSimulator(segments, 2.1, SimulationCounters())
+    candidates = [range(len(ACTIONS))] * len(segments)
+    for _ in range(20):
+        plan = plan_from_actions(random_plan(rng, len(segments)))
+        simulator.reset(plan)
+        # As well as changing single slots, this deletes and shifts change points
+        moves = rng.sample(change_point_moves(plan, candidates), 200)
+        scores = []
+        for move in moves:
+            moved_plan = plan[:]
+            apply_move(moved_plan, move)
+            scores.append(simulator.evaluate(moved_plan, move[0], move[1]))
+
+        best_score = max(scores)
+        assert simulator.evaluate_best(plan, moves) == (scores.index(best_score), best_score)
+
+
+def test_transition_matches_simulate_segment() -> None:
+    rng = random.Random(2468)
+    # Include battery levels right on the min/max socs, where the transitions change from one piece to the next
+    battery_levels = [0.0, 0.42, 0.84, 2.1, 4.2] + [rng.uniform(0, 4.2) for _ in range(5)]
+    for segment in [*random_segments(rng, 20), TimeSegment(0, 0, 15, 15), TimeSegment(5, 0, 15, 15)]:
+        for action in ACTIONS:
+            transition = make_transition(segment, action)
+            for battery_level in battery_levels:
+                expected_level, _, _, expected_feed_in_cost, expected_import_cost = simulate_segment(
+                    segment, action, battery_level
+                )
+                assert transition(battery_level) == (expected_level, expected_feed_in_cost, expected_import_cost)
+
+
+def test_action_table() -> None:
+    for index, action in enumerate(ACTIONS):
+        assert index_of(action) == index
+    plan = plan_from_actions([None, ACTIONS[5], None])
+    assert list(plan) == [CONTINUE_ACTION, 5, CONTINUE_ACTION]
+    assert plan_to_actions(plan) == [None, ACTIONS[5], None]
+    with pytest.raises(ValueError):
+        index_of(Action(ActionType.CHARGE, min_soc=0.2, max_soc=0.25))
+
+
+def test_dynamic_programming_compared_to_hill_climb() -> None:
+    # The plans from the two engines shouldn't be identical, but the dynamic programming one should be at least as good
+    # overall. How long each takes is left to the benchmarks
+    engines = (OptimizerEngine.DYNAMIC_PROGRAMMING, OptimizerEngine.HILL_CLIMB)
+    scores = {engine: 0.0 for engine in engines}
+    for seed in range(100, 103):
+        segments = random_segments(random.Random(seed), 24)
+        for engine in engines:
+            actions, output = BatteryModel(initial_battery=2.1, engine=engine, seed=seed).optimize(segments)
+            scores[engine] += output.segments[-1].cumulative_score
+            assert len(actions) == 24
+            assert len(output.segments) == len(segments)
+
+    assert scores[OptimizerEngine.DYNAMIC_PROGRAMMING] >= scores[OptimizerEngine.HILL_CLIMB]
+
+
+def test_hillclimb_is_reproducible_across_executors() -> None:
+    segments = random_segments(random.Random(200), 24)
+    sequential_actions, sequential_output = BatteryModel(initial_battery=2.1, seed=1).shotgun_hillclimb(segments)
+
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        battery_model = BatteryModel(initial_battery=2.1, executor=executor, seed=1)
+        parallel_actions, parallel_output = battery_model.shotgun_hillclimb(segments)
+
+    assert parallel_actions == sequential_actions
+    assert parallel_output == sequential_output
+    assert battery_model.num_runs > 0
+
+
+def test_hillclimb_stops_when_out_of_budget() -> None:
+    segments = random_segments(random.Random(300), 24)
+
+    battery_model = BatteryModel(initial_battery=2.1, seed=1, run_budget=500)
+    actions, output = battery_model.shotgun_hillclimb(segments)
+    assert not battery_model.converged
+    assert len(actions) == 24
+    assert len(output.segments) == len(segments)
+    # The post-processing stops once the budget has been spent too, so it's only overshot by each restart's last step
+    assert battery_model.num_runs <= 1.2 * 500
+
+    unlimited_model = BatteryModel(initial_battery=2.1, seed=1)
+    unlimited_model.shotgun_hillclimb(segments)
+    assert unlimited_model.converged
+    assert battery_model.num_runs < unlimited_model.num_runs
+
+
+def test_hillclimb_warm_start_from_shifted_plan() -> None:
+    segments = random_segments(random.Random(400), 25)
+    first_model = BatteryModel(initial_battery=2.1, seed=1)
+    first_model.shotgun_hillclimb(segments[:24])
+    seed_plan = [*first_model.best_plan[1:], CONTINUE_ACTION]
+
+    cold_model = BatteryModel(initial_battery=2.1, seed=2)
+    cold_model.shotgun_hillclimb(segments[1:])
+    warm_model = BatteryModel(initial_battery=2.1, seed=2)
+    warm_actions, _ = warm_model.shotgun_hillclimb(segments[1:], seed_plan)
+
+    assert len(warm_actions) == 24
+    assert warm_model.num_runs < cold_model.num_runs
+    with pytest.raises(ValueError):
+        warm_model.shotgun_hillclimb(segments[1:], seed_plan[:-1])
+
+
+def test_plan_library() -> None:
+    rng = random.Random(450)
+    segments = random_segments(rng, 24)
+    other_segments = random_segments(rng, 24)
+    first_model = BatteryModel(initial_battery=2.1, seed=1)
+    first_model.shotgun_hillclimb(segments)
+    library = PlanLibrary(max_size=2)
+    library.add(other_segments, [INITIAL_ACTION_INDEX] * 24)
+    library.add(segments, first_model.best_plan)
+    library.add(segments[:12], first_model.best_plan[:12])
+    data = library.to_dict()
+    # Older versions fingerprinted every slot, so their entries are dropped
+    data["entries"].append({"fingerprint": [0.0] * 4 * 24, "plan": [INITIAL_ACTION_INDEX] * 24})
+    library = PlanLibrary.from_dict(data, max_size=2)
+
+    assert len(library) == 2
+    assert len(fingerprint(segments)) == fingerprint_size(24) == 12
+    # The oldest plan was dropped, and plans for a different number of slots are ignored
+    assert library.nearest(segments, 2) == [first_model.best_plan]
+
+    cold_model = BatteryModel(initial_battery=2.1, seed=2)
+    cold_model.shotgun_hillclimb(segments)
+    warm_model = BatteryModel(initial_battery=2.1, seed=2)
+    warm_model.shotgun_hillclimb(segments, library_plans=library.nearest(segments, 2))
+
+    assert [x.seeded for x in warm_model.stats.restarts[:2]] == [True, False]
+    assert len(warm_model.stats.restarts) == len(cold_model.stats.restarts)
+    assert warm_model.num_runs < cold_model.num_runs
+
+
+def test_optimizer_stats() -> None:
+    segments = random_segments(random.Random(500), 24)
+    battery_model = BatteryModel(initial_battery=2.1, seed=1)
+    battery_model.shotgun_hillclimb(segments)
+    stats = battery_model.stats
+
+    assert stats.engine == OptimizerEngine.HILL_CLIMB.value
+    assert stats.converged
+    assert stats.runs == battery_model.num_runs
+    assert [x.restart for x in stats.restarts] == list(range(10))
+    assert sum(x.runs for x in stats.restarts) <= stats.phases["restarts"].runs
+    for phase in ("steepest_ascent", "none_removal", "simplify", "optimize_min_max_soc"):
+        assert stats.phases[phase].runs > 0
+    assert stats.wall_time >= stats.phases["restarts"].wall_time
+
+
+def test_dominated_action_types() -> None:
     segments = [
-        TimeSegment(generation=g, consumption=c, feed_in_tariff=f, import_tariff=i)
-        for g, c, f, i in zip(generation, consumption, feed_in_tariff, import_tariff, strict=True)
+        TimeSegment(generation=0, consumption=0.2, feed_in_tariff=2, import_tariff=30),
+        # Nothing later is worth as much as importing costs here. Feeding in doesn't pay, but we're paid to import
+        # later, so it might be worth making space
+        TimeSegment(generation=0, consumption=0.2, feed_in_tariff=2, import_tariff=40),
+        TimeSegment(generation=1, consumption=0.2, feed_in_tariff=2, import_tariff=-5),
     ]
-    segments = segments + segments
-    result = model.shotgun_hillclimb(segments, 2)
-    return result
+    assert dominated_action_types(segments) == [set(), {ActionType.CHARGE}, {ActionType.DISCHARGE}]
+    # Unless whatever's left in the battery at the end is worth more
+    assert dominated_action_types(segments, terminal_value=45) == [set(), set(), {ActionType.DISCHARGE}]
+
+
+def test_pruning_gives_same_plan() -> None:
+    scenario = flux()
+    unpruned_model = BatteryModel(initial_battery=scenario.initial_battery, seed=1, prune_dominated=False)
+    unpruned_actions, _ = unpruned_model.optimize(scenario.segments)
+    model = BatteryModel(initial_battery=scenario.initial_battery, seed=1)
+    actions, _ = model.optimize(scenario.segments)
+
+    assert actions == unpruned_actions
+    assert unpruned_model.stats.pruned == 0
+    assert model.stats.pruned > 0
+    assert model.num_runs + model.stats.pruned == unpruned_model.num_runs
+
+
+def test_pruning_gives_same_plan_with_horizon() -> None:
+    scenario = cheap_slot_before_dear_day()
+    unpruned_model = BatteryModel(
+        initial_battery=scenario.initial_battery, seed=1, horizon_slots=24, prune_dominated=False
+    )
+    unpruned_actions, _ = unpruned_model.optimize(scenario.segments)
+    model = BatteryModel(initial_battery=scenario.initial_battery, seed=1, horizon_slots=24)
+    actions, _ = model.optimize(scenario.segments)
+
+    assert actions == unpruned_actions
+    assert model.best_plan == unpruned_model.best_plan
+
+
+def test_stats_dont_depend_on_log_level(caplog: pytest.LogCaptureFixture) -> None:
+    segments = random_segments(random.Random(700), 24)
+    battery_model = BatteryModel(initial_battery=2.1, seed=1)
+    battery_model.optimize(segments)
+    with caplog.at_level(logging.DEBUG, logger="custom_components.solar_battery_forecast.brains.battery_model"):
+        debug_battery_model = BatteryModel(initial_battery=2.1, seed=1)
+        debug_battery_model.optimize(segments)
+
+    assert any(record.message.startswith("Restart") for record in caplog.records)
+    assert debug_battery_model.stats.runs == battery_model.stats.runs
+    assert debug_battery_model.stats.segments_simulated == battery_model.stats.segments_simulated
+    assert debug_battery_model.counters == battery_model.counters
+
+
+def test_convergence_trace() -> None:
+    segments = random_segments(random.Random(600), 24)
+    battery_model = BatteryModel(initial_battery=2.1, seed=1, trace_convergence=True)
+    battery_model.shotgun_hillclimb(segments)
+
+    for restart in battery_model.stats.restarts:
+        assert restart.score_trace is not None
+        assert restart.score_trace == sorted(restart.score_trace)
+        assert restart.score_trace[-1] == restart.score
+    rows = battery_model.stats.convergence_trace()
+    assert len(rows) == sum(len(x.score_trace or []) for x in battery_model.stats.restarts)
+
+    untraced_model = BatteryModel(initial_battery=2.1, seed=1)
+    untraced_model.shotgun_hillclimb(segments)
+    assert all(x.score_trace is None for x in untraced_model.stats.restarts)
+
+
+def test_score_cache() -> None:
+    assert plan_key([CONTINUE_ACTION, 5, CONTINUE_ACTION]) == plan_key([INITIAL_ACTION_INDEX, 5, 5])
+    assert plan_key([CONTINUE_ACTION, 5, CONTINUE_ACTION]) != plan_key([CONTINUE_ACTION, 5, 6])
+
+    cache = ScoreCache(max_size=2)
+    cache.put(b"a", 1.0)
+    cache.put(b"b", 2.0)
+    assert cache.get(b"a") == 1.0
+    cache.put(b"c", 3.0)
+    assert cache.get(b"b") is None
+    assert cache.get(b"a") == 1.0
+    assert len(cache) == 2
+
+
+def test_score_cache_gives_same_plan() -> None:
+    segments = random_segments(random.Random(700), 24)
+    uncached_model = BatteryModel(initial_battery=2.1, seed=1)
+    uncached_actions, uncached_output = uncached_model.shotgun_hillclimb(segments)
+    cached_model = BatteryModel(initial_battery=2.1, seed=1, score_cache_size=10_000)
+    cached_actions, cached_output = cached_model.shotgun_hillclimb(segments)
+
+    assert cached_actions == uncached_actions
+    assert cached_output == uncached_output
+    assert cached_model.num_runs == uncached_model.num_runs
+    assert cached_model.stats.cache_misses > 0
+    assert cached_model.stats.cache_hits > uncached_model.stats.cache_hits
+    assert cached_model.stats.segments_simulated < uncached_model.stats.segments_simulated
@@ -0,0 +1,9 @@
+import importlib
+
+import pytest
+
+
+def test_controller_imports() -> None:
+    # Annotations are evaluated on import, so e.g. a string type alias used with | only fails here
+    pytest.importorskip("homeassistant")
+    importlib.import_module("custom_components.solar_battery_forecast.controller")
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from custom_components.solar_battery_forecast.brains.load_forecaster import PREDICTION_PERIOD
+from custom_components.solar_battery_forecast.brains.load_forecaster import LoadForecaster
+from tests.scenarios import HOUSEHOLD_CONSUMPTION
+
+
+def load_history(num_hours: int) -> pd.DataFrame:
+    rng = np.random.default_rng(1)
+    index = pd.date_range("2024-03-01", periods=num_hours, freq="h", tz="Europe/London")
+    values = np.resize(HOUSEHOLD_CONSUMPTION, num_hours) * rng.uniform(0.8, 1.2, num_hours)
+    return pd.DataFrame({"value": values}, index=index)
+
+
+def test_appended_forecast_matches_full_fit() -> None:
+    history = load_history(24 * 29 + 6)
+    forecaster = LoadForecaster()
+    for num_hours in range(24 * 29, len(history) + 1):
+        prediction = forecaster.predict(history.iloc[:num_hours].copy())
+    full_fit_prediction = LoadForecaster().predict(history.copy())
+
+    assert prediction is not None
+    assert full_fit_prediction is not None
+    assert prediction.index[0] == history.index[-1] + pd.Timedelta(hours=1)
+    assert len(prediction) == PREDICTION_PERIOD / pd.Timedelta(hours=1)
+    assert (prediction.index == full_fit_prediction.index).all()
+    assert (prediction["predicted"] - full_fit_prediction["predicted"]).abs().max() < 0.1
+
+
+def test_restored_fit() -> None:
+    history = load_history(24 * 30)
+    forecaster = LoadForecaster()
+    prediction = forecaster.predict(history.iloc[: 24 * 29 + 6].copy())
+    saved_fit = forecaster.fit_to_dict()
+    assert saved_fit is not None
+
+    # Later the same day, the saved fit is used as it is
+    restored = LoadForecaster()
+    restored.restore_fit(saved_fit)
+    assert restored.fit_to_dict() == saved_fit
+    restored_prediction = restored.predict(history.iloc[: 24 * 29 + 6].copy())
+    assert restored_prediction is not None
+    assert prediction is not None
+    assert (restored_prediction["predicted"] - prediction["predicted"]).abs().max() < 1e-6
+    assert restored.fit_to_dict() == saved_fit
+
+    # The next day, it's refitted
+    restored = LoadForecaster()
+    restored.restore_fit(saved_fit)
+    restored_prediction = restored.predict(history.copy())
+    full_fit_prediction = LoadForecaster().predict(history.copy())
+    assert restored_prediction is not None
+    assert full_fit_prediction is not None
+    assert restored.fit_to_dict() != saved_fit
+    assert (restored_prediction["predicted"] - full_fit_prediction["predicted"]).abs().max() < 0.1
+
+    with pytest.raises(ValueError):
+        LoadForecaster().restore_fit({**saved_fit, "order": [1, 1, 1]})
+
+
+def test_warm_started_fit() -> None:
+    history = load_history(24 * 30 + 6)
+    forecaster = LoadForecaster()
+    forecaster.predict(history.iloc[: 24 * 29 + 6].copy())
+    assert forecaster.stats.update == "full_fit"
+    assert not forecaster.stats.warm_start
+
+    # The next day's full fit starts from the last one's parameters
+    prediction = forecaster.predict(history.copy())
+    cold = LoadForecaster()
+    cold_prediction = cold.predict(history.copy())
+    assert forecaster.stats.update == "full_fit"
+    assert forecaster.stats.warm_start
+    assert 0 < forecaster.stats.iterations < cold.stats.iterations
+    assert prediction is not None
+    assert cold_prediction is not None
+    assert (prediction["predicted"] - cold_prediction["predicted"]).abs().max() < 1e-3
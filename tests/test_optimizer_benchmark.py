@@ -0,0 +1,80 @@
+import json
+import os
+import time
+from collections.abc import Iterator
+from dataclasses import asdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from custom_components.solar_battery_forecast.brains.battery_model import BatteryModel
+from custom_components.solar_battery_forecast.brains.battery_model import OptimizerEngine
+from tests.scenarios import Scenario
+from tests.scenarios import all_scenarios
+
+# Run with UPDATE_BENCHMARK_BASELINE=1 to record new baselines, after checking that any regressions are intended
+BASELINE_PATH = Path(__file__).parent / "benchmark_baseline.json"
+UPDATE_BASELINE = os.environ.get("UPDATE_BENCHMARK_BASELINE") == "1"
+# Wall time is always reported, but depends too much on the machine and whatever else it's doing to fail the benchmark
+# by default. Run with CHECK_BENCHMARK_WALL_TIME=1 to check it against the baseline too
+CHECK_WALL_TIME = os.environ.get("CHECK_BENCHMARK_WALL_TIME") == "1"
+
+SEED = 1
+
+# How far each result may regress from its baseline before the benchmark fails.
+# Scores are in pence, and the optimizer happily gives up MARGIN (1p) to get a neater plan.
+SCORE_TOLERANCE = 1.0
+RUNS_TOLERANCE = 0.1
+# Generous, as the baseline was probably recorded on a different machine. The slack (in seconds) stops very quick
+# benchmarks from failing because of noise
+WALL_TIME_TOLERANCE = 1.0
+WALL_TIME_SLACK = 0.2
+
+
+@dataclass
+class BenchmarkResult:
+    wall_time: float
+    num_runs: int
+    score: float
+    score_24h: float
+
+
+@pytest.fixture(scope="module")
+def baselines() -> Iterator[dict[str, Any]]:
+    baselines = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+    yield baselines
+    if UPDATE_BASELINE:
+        BASELINE_PATH.write_text(json.dumps(baselines, indent=4, sort_keys=True) + "\n")
+
+
+@pytest.mark.parametrize("engine", list(OptimizerEngine), ids=lambda x: x.value)
+@pytest.mark.parametrize("scenario", all_scenarios(), ids=lambda x: x.name)
+def test_benchmark(scenario: Scenario, engine: OptimizerEngine, baselines: dict[str, Any]) -> None:
+    battery_model = BatteryModel(initial_battery=scenario.initial_battery, engine=engine, seed=SEED)
+    start = time.perf_counter()
+    _, output = battery_model.optimize(scenario.segments)
+    result = BenchmarkResult(
+        wall_time=round(time.perf_counter() - start, 3),
+        num_runs=battery_model.num_runs,
+        score=round(output.segments[-1].cumulative_score, 2),
+        score_24h=round(output.segments[23].cumulative_score, 2),
+    )
+    print(f"{scenario.name} ({engine.value}): {result}")
+
+    key = f"{scenario.name}/{engine.value}"
+    if UPDATE_BASELINE:
+        baselines[key] = asdict(result)
+        return
+
+    if key not in baselines:
+        pytest.fail(f"No baseline for {key}. Run with UPDATE_BENCHMARK_BASELINE=1 to record one")
+    baseline = BenchmarkResult(**baselines[key])
+    assert result.score >= baseline.score - SCORE_TOLERANCE, f"Score regressed from {baseline.score}"
+    assert result.score_24h >= baseline.score_24h - SCORE_TOLERANCE, f"24h score regressed from {baseline.score_24h}"
+    assert result.num_runs <= baseline.num_runs * (1 + RUNS_TOLERANCE), f"Runs regressed from {baseline.num_runs}"
+    if CHECK_WALL_TIME:
+        assert result.wall_time <= baseline.wall_time * (1 + WALL_TIME_TOLERANCE) + WALL_TIME_SLACK, (
+            f"Wall time regressed from {baseline.wall_time}"
+        )
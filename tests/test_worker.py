@@ -0,0 +1,138 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from custom_components.solar_battery_forecast.worker import Worker
+from custom_components.solar_battery_forecast.worker import WorkerError
+from tests.scenarios import flux
+from tests.test_load_forecaster import load_history
+
+JOBS_MODULE = "custom_components.solar_battery_forecast.worker_jobs"
+
+
+# The jobs for the tests of the Worker itself, which the worker process finds by importing this module
+
+
+def power(base: int, exponent: int) -> int:
+    return int(base**exponent)
+
+
+def divide(a: float, b: float) -> float:
+    return a / b
+
+
+def parse_int(value: str) -> int:
+    return int(value)
+
+
+def get_pid() -> int:
+    return os.getpid()
+
+
+def sleep(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+async def _reader_threads(expected: int) -> int:
+    # Reader threads exit shortly after their process does
+    for _ in range(20):
+        count = sum(t.name == "solar_battery_forecast_worker_reader" for t in threading.enumerate())
+        if count <= expected:
+            break
+        await asyncio.sleep(0.05)
+    return count
+
+
+def test_worker_runs_jobs_and_recovers() -> None:
+    async def run() -> None:
+        worker = Worker(__name__, timeout=2)
+        try:
+            assert await worker.run("power", 2, 10) == 1024
+            pid = await worker.run("get_pid")
+            with pytest.raises(WorkerError):
+                await worker.run("sleep", 5)
+            # A new process takes over after a timeout
+            assert await worker.run("get_pid") != pid
+            # ...and the old one's reader thread is gone
+            assert await _reader_threads(1) == 1
+
+            job = asyncio.create_task(worker.run("sleep", 5))
+            await asyncio.sleep(0.5)
+            job.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await job
+            assert await worker.run("power", 3, 2) == 9
+        finally:
+            await worker.cancel()
+        assert await _reader_threads(0) == 0
+
+    asyncio.run(run())
+
+
+def test_worker_wraps_job_exceptions() -> None:
+    async def run() -> None:
+        worker = Worker(__name__, timeout=2)
+        try:
+            with pytest.raises(WorkerError) as exc_info:
+                await worker.run("divide", 1, 0)
+            assert isinstance(exc_info.value.__cause__, ZeroDivisionError)
+            # The process survives its job raising
+            pid = await worker.run("get_pid")
+            with pytest.raises(WorkerError) as exc_info:
+                await worker.run("parse_int", "not a number")
+            assert isinstance(exc_info.value.__cause__, ValueError)
+            assert await worker.run("get_pid") == pid
+            with pytest.raises(WorkerError) as exc_info:
+                await worker.run("no_such_job")
+            assert isinstance(exc_info.value.__cause__, AttributeError)
+        finally:
+            await worker.cancel()
+
+    asyncio.run(run())
+
+
+def test_worker_predicts_load() -> None:
+    async def run() -> None:
+        history = load_history(24 * 29 + 6)
+        worker = Worker(JOBS_MODULE, timeout=120)
+        try:
+            prediction, midnight_prediction, fit, stats = await worker.run(
+                "predict_load", history.iloc[:-1].copy(), history.iloc[:-6].copy(), None
+            )
+            assert prediction is not None
+            assert midnight_prediction is not None
+            assert midnight_prediction.index[0] < prediction.index[0]
+            assert fit is not None
+            assert stats.update == "full_fit"
+
+            # The forecaster keeps its fit in the worker process, so the next hour's forecast only appends to it
+            prediction, midnight_prediction, _, stats = await worker.run("predict_load", history.copy(), None, fit)
+            assert prediction is not None
+            assert prediction.index[0] == history.index[-1] + (history.index[-1] - history.index[-2])
+            assert midnight_prediction is None
+            assert stats.update == "append"
+        finally:
+            await worker.cancel()
+
+    asyncio.run(run())
+
+
+def test_worker_optimizes() -> None:
+    async def run() -> None:
+        scenario = flux()
+        worker = Worker(JOBS_MODULE, timeout=120)
+        try:
+            actions, outputs, best_plan, stats = await worker.run(
+                "optimize", scenario.initial_battery, 30, scenario.segments, None, []
+            )
+        finally:
+            await worker.cancel()
+
+        assert len(actions) == 24
+        assert len(best_plan) == len(outputs.segments) == len(scenario.segments)
+        assert stats.runs > 0
+
+    asyncio.run(run())